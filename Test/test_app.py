@@ -0,0 +1,125 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+# no display needed
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+try:
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtTest import QTest
+    from PyQt5.QtWidgets import QApplication
+    from App import App
+except ImportError:
+    App = None
+
+from BitBoard import BitBoard
+from GameLog import GameLog
+
+
+@unittest.skipIf(App is None, "PyQt5 and qtpy are not installed")
+class AppTest(unittest.TestCase):
+    '''
+        Smoke test of the threads of the App driven by its keys, drawn offscreen
+    '''
+    TIMEOUT = 30
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # the AI loads its theta from the working directory
+        self.cwd = os.getcwd()
+        os.chdir(SRC)
+        self.qt_app = QApplication.instance() or QApplication([])
+        self.app = App()
+        self.app.REPLAY_FILE = os.path.join(self.directory, 'replay.log')
+
+    def tearDown(self):
+        self.app.ai_stop = True
+        self.app.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def wait(self, condition):
+        # run the GUI event loop until condition holds
+        start = time.time()
+        while not condition():
+            self.assertLess(time.time() - start, self.TIMEOUT)
+            self.qt_app.processEvents()
+            time.sleep(0.001)
+        self.qt_app.processEvents()
+
+    def check_drawn(self):
+        # the latest frame is drawn and the stack pixmap holds its board
+        app = self.app
+        self.wait(lambda: app.frame is app.pending_frame)
+        app.grab()
+        self.assertTrue(np.array_equal(app.frame.board, app.board.board))
+        self.assertTrue(np.array_equal(app.stack_board, app.board.board))
+
+    def wait_replay(self):
+        done = threading.Event()
+        self.app.replay_steps.put(done.set)
+        self.wait(done.is_set)
+
+    def test_ai_and_replay(self):
+        app = self.app
+        self.assertRaises(Exception, GameLog, app.REPLAY_FILE)
+        QTest.keyClick(app, Qt.Key_R)
+        self.assertFalse(app.running)
+
+        QTest.keyClick(app, Qt.Key_A)
+        QTest.keyClick(app, Qt.Key_T)
+        self.assertTrue(app.turbo)
+        self.wait(lambda: app.board.cur_pieces >= 40 or not app.running)
+        QTest.keyClick(app, Qt.Key_S)
+        self.wait(lambda: not app.running)
+        self.assertEqual(app.board_msg[0][2], 'GAME OVER')
+        self.check_drawn()
+        board = app.board.board.copy()
+        lines = app.board.cur_removed_lines
+
+        QTest.keyClick(app, Qt.Key_R)
+        log = app.replay
+        self.assertGreater(len(log), 0)
+        for i in range(len(log)):
+            QTest.keyClick(app, Qt.Key_Right)
+        self.wait_replay()
+        self.assertEqual(app.replay_pos, len(log))
+        self.check_drawn()
+        if not app.replay.get_move(len(log) - 1)[4]:
+            self.assertTrue(np.array_equal(app.board.board, board))
+            self.assertEqual(app.board.cur_removed_lines, lines)
+
+        QTest.keyClick(app, Qt.Key_Left)
+        QTest.keyClick(app, Qt.Key_Left)
+        self.wait_replay()
+        self.assertEqual(app.replay_pos, len(log) - 2)
+        seek_board = BitBoard()
+        log.seek(seek_board, len(log) - 2)
+        self.assertTrue(np.array_equal(app.board.board, seek_board.board))
+        self.check_drawn()
+
+    def test_play(self):
+        app = self.app
+        QTest.keyClick(app, Qt.Key_Space)
+        self.assertTrue(app.running)
+        self.assertEqual(app.running_mode, app.RUNNING_MODE_PLAY)
+        for key in (Qt.Key_F, Qt.Key_S, Qt.Key_Left, Qt.Key_Right, Qt.Key_Up, Qt.Key_Down):
+            QTest.keyClick(app, key)
+        self.assertEqual(app.speed, app.DEFAULT_SPEED)
+        for i in range(3):
+            QTest.keyClick(app, Qt.Key_Space)
+        self.assertEqual(np.sum(app.board.board > 0), 12)
+        self.check_drawn()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+from BitBoard import BitBoard
+from Board import Board
+from GameLog import GameLog, GameLogWriter
+from LinearQLearning import QLearnPlayer
+from PieceSource import UniformSource
+from Shape import Shape
+from VecBoard import VecBoard
+
+
+def get_stack(rng, geometry, top):
+    # a random stack with holes, no row full, at most top rows high
+    board = np.zeros((geometry.height, geometry.width), np.int)
+    heights = rng.randint(0, top + 1, geometry.width)
+    for x in range(geometry.width):
+        board[:heights[x], x] = rng.randint(0, 2, heights[x]) * rng.randint(1, Shape.MAX_SHAPE)
+        if heights[x]:
+            board[heights[x] - 1, x] = 1
+    board[:, rng.randint(geometry.width)] = 0
+    return board
+
+
+class MinDistanceTest(unittest.TestCase):
+    def test_every_rotation(self):
+        rng = np.random.RandomState(0)
+        board = Board()
+        bit_board = BitBoard()
+        for i in range(20):
+            stack = get_stack(rng, board.geometry, 10)
+            board.load_board(stack)
+            bit_board.load_board(stack)
+            for piece in range(1, Shape.MAX_SHAPE):
+                for rotation in range(Shape.SUB[piece]):
+                    for x in bit_board.geometry.actions[piece][rotation]:
+                        for cur_y in (board.geometry.height - 1, 12, 8):
+                            for b in (board, bit_board):
+                                b.new_shape(piece)
+                                b.cur_shape.set_sub_shape(rotation)
+                                b.cur_shape.set_x(x)
+                                b.cur_y = cur_y
+                            self.assertEqual(bit_board.get_min_distance(), board.get_min_distance(),
+                                             (Shape.NAME[piece], rotation, x, cur_y))
+
+
+class NewShapeTest(unittest.TestCase):
+    def test_reuse(self):
+        board = Board()
+        shape = board.new_shape(Shape.TShape)
+        shape.set_sub_shape(2)
+        shape.set_x(0)
+        self.assertIs(board.new_shape(Shape.TShape), shape)
+        self.assertEqual((shape.sub_shape, shape.x), (0, int(board.geometry.width / 2 - 1)))
+        self.assertIsNot(board.new_shape(Shape.LShape), shape)
+
+
+class EngineTest(unittest.TestCase):
+    '''
+        Board, BitBoard and a VecBoard of one well play the same seeded moves,
+        the trained theta picks most of them so the games clear lines
+    '''
+    MOVES = 600
+
+    def play(self, weights):
+        rng = np.random.RandomState(1)
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(os.path.join(SRC, 'theta.save'))
+        player.set_debug(player.DEBUG_LEVEL0, False)
+        boards = [Board(), BitBoard()]
+        vec_board = VecBoard(1)
+        for b in boards + [vec_board]:
+            b.set_reward(weights)
+
+        games = 0
+        lines = 0
+        for move in range(self.MOVES):
+            piece = rng.randint(1, Shape.MAX_SHAPE)
+            shape = boards[1].new_shape(piece)
+            if rng.rand() < 0.2:
+                rotation = rng.randint(Shape.SUB[piece])
+                x = rng.choice(boards[1].geometry.actions[piece][rotation])
+            else:
+                rotation, x = player.select_action(boards[1].get_feature_index(), shape)
+
+            results = []
+            for b in boards:
+                alive = b.drop(piece, rotation, x)
+                results.append((not alive, b.cur_removed_lines, b.get_reward() if alive else VecBoard.GAME_OVER_REWARD))
+            vec_board.pieces[:] = piece
+            features, rewards, done, vec_lines = vec_board.step(np.array([rotation]), np.array([x]))
+            results.append((done[0], vec_lines[0], rewards[0]))
+
+            for result in results[1:]:
+                self.assertEqual(result[:2], results[0][:2], move)
+                self.assertAlmostEqual(result[2], results[0][2], 9, move)
+            if results[0][0]:
+                games += 1
+                lines += results[0][1]
+                for b in boards:
+                    b.init()
+                continue
+            rows = boards[0].get_rows()
+            heights = boards[0].get_heights()
+            self.assertEqual(boards[1].get_rows(), rows, move)
+            self.assertEqual(boards[1].get_heights(), heights, move)
+            self.assertEqual(vec_board.rows[0].tolist(), rows, move)
+            self.assertEqual(vec_board.heights[0].tolist(), heights, move)
+            index = boards[0].get_feature_index().tolist()
+            self.assertEqual(boards[1].get_feature_index().tolist(), index, move)
+            self.assertEqual(features[0].tolist(), index, move)
+        # the moves cover finished games and cleared lines
+        self.assertGreater(games, 5)
+        self.assertGreater(lines, 20)
+
+    def test_default_reward(self):
+        self.play(None)
+
+    def test_feature_reward(self):
+        self.play({'lines': 2, 'holes': -4, 'bumpiness': -1, 'wells': -0.5, 'row_transitions': -0.25,
+                   'landing_height': -1})
+
+
+class GameLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_seek(self):
+        # a plain Board restored anywhere in the log keeps its point check
+        file_name = os.path.join(self.directory, 'game.log')
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(os.path.join(SRC, 'theta.save'))
+        player.set_debug(player.DEBUG_LEVEL0, False)
+        board = Board()
+        board.set_piece_source(UniformSource(0))
+        game_log = GameLogWriter(file_name, interval=16)
+        board.set_game_log(game_log)
+        lines = [board.play_game(player) for i in range(3)]
+        game_log.close()
+
+        log = GameLog(file_name)
+        self.assertEqual(log.get_summary().tolist(), lines)
+        for n in range(0, len(log), 5):
+            board = Board()
+            bit_board = BitBoard()
+            log.seek(board, n)
+            log.seek(bit_board, n)
+            self.assertTrue(np.array_equal(board.board, bit_board.board), n)
+            board.point_check()
+            piece, rotation, x, removed, game_over = log.get_move(n)
+            self.assertEqual(board.drop(piece, rotation, x), not game_over, n)
+            board.point_check()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+# the modules of training, evaluation and benchmarking, and everything they use
+HEADLESS = ['Shape', 'Geometry', 'Features', 'Board', 'BitBoard', 'VecBoard', 'LinearQLearning', 'SearchPlayer',
+            'ReplayBuffer', 'ThetaFile', 'Checkpoint', 'GameLog', 'Metrics', 'PieceSource', 'Train', 'Evaluate',
+            'Benchmark', 'ParallelTraining', 'InferenceServer', 'TrainingCurve', 'Sweep']
+GUI = ('PyQt5', 'qtpy')
+
+# time to import HEADLESS once numpy is loaded, as a share of the import of numpy in the same interpreter,
+# so a slow or busy machine slows both
+IMPORT_BUDGET = 1.0
+RUNS = 3
+
+
+def run(code):
+    # a fresh interpreter in src, so nothing is imported yet
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], cwd=SRC, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return result.stdout.strip()
+
+
+class ImportTest(unittest.TestCase):
+    def test_no_gui(self):
+        loaded = run("import sys\n"
+                     "import %s\n"
+                     "print(' '.join(m for m in sys.modules if m.split('.')[0] in %r))" % (', '.join(HEADLESS), GUI))
+        self.assertEqual(loaded, '')
+
+    def test_lazy_tables(self):
+        built = run("import %s\n"
+                    "from Geometry import Geometry\n"
+                    "print(sum(name in Geometry.DEFAULT.__dict__ for name in Geometry.TABLES))" % ', '.join(HEADLESS))
+        self.assertEqual(built, '0')
+        self.assertEqual(run("from Geometry import Geometry\n"
+                             "print(Geometry.DEFAULT.placement_index.shape)"), '(8, 4, 10)')
+
+    def test_import_budget(self):
+        times = []
+        for i in range(RUNS):
+            times.append([float(seconds) for seconds in run("import time\n"
+                                                            "start = time.perf_counter()\n"
+                                                            "import numpy\n"
+                                                            "numpy_seconds = time.perf_counter() - start\n"
+                                                            "start = time.perf_counter()\n"
+                                                            "import %s\n"
+                                                            "print(numpy_seconds, time.perf_counter() - start)"
+                                                            % ', '.join(HEADLESS)).split()])
+        numpy_seconds, seconds = min(times, key=lambda t: t[1] / t[0])
+        self.assertLess(seconds, IMPORT_BUDGET * numpy_seconds,
+                        "importing the headless modules took %.3f s, numpy %.3f s" % (seconds, numpy_seconds))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+import InferenceServer
+import ThetaFile
+from Features import FeatureSet
+from InferenceServer import InferenceClient
+from LinearQLearning import QLearnPlayer
+
+
+class InferenceServerTest(unittest.TestCase):
+    TIMEOUT = 10
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.theta_file = os.path.join(self.directory, 'theta')
+        ThetaFile.convert(os.path.join(SRC, 'theta.save'), self.theta_file)
+        self.path = os.path.join(self.directory, 'socket')
+        self.server = None
+        self.thread = None
+        self.sockets = []
+
+    def tearDown(self):
+        # a server stuck writing to a socket gets an error once it is closed
+        for sock in self.sockets:
+            sock.close()
+        if self.server is not None:
+            self.server.running = False
+            self.thread.join(self.TIMEOUT)
+        shutil.rmtree(self.directory)
+
+    def start(self, theta_file):
+        self.server = InferenceServer.InferenceServer(theta_file, reload_interval=0.05)
+        self.thread = threading.Thread(target=self.server.serve_unix, args=(self.path,), daemon=True)
+        self.thread.start()
+        while not os.path.exists(self.path):
+            self.thread.join(0.01)
+
+    def connect(self):
+        client = InferenceClient(self.path)
+        client.sock.settimeout(self.TIMEOUT)
+        self.sockets.append(client.sock)
+        return client
+
+    def test_moves(self):
+        self.start(self.theta_file)
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(self.theta_file)
+        geometry = player.geometry
+        rng = np.random.RandomState(0)
+        client = self.connect()
+        for i in range(20):
+            piece = rng.randint(1, 8)
+            heights = rng.randint(0, 8, geometry.width)
+            status = geometry.feature_offset + heights - np.min(heights)
+            q = player.get_values(status[None], np.array([piece]))[0]
+            rotation, x, value = client.select_action(piece, heights)
+            self.assertEqual((rotation, x), divmod(int(np.argmax(q)), geometry.width))
+            self.assertAlmostEqual(value, np.max(q))
+        self.assertIsNone(client.select_action(0, heights))
+        client.close()
+
+    def test_stalled_client(self):
+        # a client that does not read its responses does not hold up the others
+        self.start(self.theta_file)
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sockets.append(stalled)
+        stalled.connect(self.path)
+        count = 100000
+        request = InferenceServer.REQUEST.pack(0, 1, InferenceServer.CONTOUR) + bytes(10)
+        sender = threading.Thread(target=stalled.sendall, args=(request * count,), daemon=True)
+        sender.start()
+
+        client = self.connect()
+        while self.server.requests < count:
+            self.assertEqual(client.select_action(1, np.zeros(10))[:2], client.select_action(1, np.zeros(10))[:2])
+        sender.join()
+
+        size = len(InferenceServer.MAGIC) + InferenceServer.HELLO.size + count * InferenceServer.RESPONSE.size
+        received = 0
+        stalled.settimeout(self.TIMEOUT)
+        while received < size:
+            received += len(stalled.recv(1 << 16))
+        self.assertEqual(received, size)
+        client.close()
+
+    def test_pipe(self):
+        client = InferenceClient.spawn(self.theta_file)
+        self.assertEqual((client.width, client.height), (10, 20))
+        self.assertEqual(len(client.select_actions([(i, np.zeros(10), None) for i in range(1, 8)] * 100)), 700)
+        client.close()
+
+    def test_feature_set(self):
+        player = QLearnPlayer()
+        geometry = player.geometry
+        for names in (['heights', 'holes'], ['heights', 'landing_height']):
+            player.set_feature_set(FeatureSet(names, geometry))
+            player.theta[:] = np.random.RandomState(0).random_sample(player.theta.shape)
+            ThetaFile.save(self.theta_file, player.theta, player.get_meta())
+            if 'landing_height' in names:
+                with self.assertRaisesRegex(Exception, "landing height"):
+                    InferenceServer.InferenceServer(self.theta_file)
+                continue
+            self.start(self.theta_file)
+            client = self.connect()
+            rows = [(1 << geometry.width) - 2] * 3 + [0] * (geometry.height - 3)
+            self.assertIsNotNone(client.select_action(2, rows=rows))
+            self.assertIsNone(client.select_action(2, heights=np.zeros(geometry.width)))
+            client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
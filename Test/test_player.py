@@ -0,0 +1,113 @@
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+from BitBoard import BitBoard
+from Geometry import Geometry
+from LinearQLearning import QLearnPlayer
+from PieceSource import UniformSource
+from SearchPlayer import SearchPlayer
+from Shape import Shape
+
+
+class SetFeaturesTest(unittest.TestCase):
+    def test_dense_features(self):
+        # a feature count that is no contour keeps the geometry of the well
+        for sparse in (False, True):
+            player = QLearnPlayer()
+            player.set_sparse(sparse)
+            player.set_features(10, player.geometry.theta_shape[:3])
+            self.assertIs(player.geometry, Geometry.DEFAULT)
+            self.assertEqual(player.theta.shape, Geometry.DEFAULT.theta_shape[:3] + (10,))
+
+        player.set_sparse(False)
+        player.set_features(10, player.geometry.theta_shape[:3])
+        shape = Shape(3)
+        for i in range(10):
+            player.select_action(np.ones(10), shape)
+            player.update(np.ones(10) * 2, 1)
+        self.assertGreater(np.max(player.theta), 0)
+
+    def test_contour_features(self):
+        geometry = Geometry.get(8, 16, 12)
+        player = QLearnPlayer()
+        player.set_features(geometry.features_num, geometry.theta_shape[:3])
+        self.assertIs(player.geometry, geometry)
+
+
+class SearchTableTest(unittest.TestCase):
+    '''
+        The transposition table only saves work, the search values are the same without it
+    '''
+    WEIGHTS = {'lines': 4, 'holes': -7, 'bumpiness': -1, 'landing_height': -1}
+
+    def get_players(self, depth):
+        players = []
+        for table_size in (1 << 20, 0):
+            player = SearchPlayer(depth, table_size=table_size)
+            player.load_theta(os.path.join(SRC, '16_theta_14'))
+            player.set_debug(player.DEBUG_LEVEL0, False)
+            player.set_reward(self.WEIGHTS)
+            players.append(player)
+        return players
+
+    def test_landing_height(self):
+        # the same rows landed at different heights are different states for the reward
+        table, plain = self.get_players(2)
+        board = BitBoard()
+        board.load_board([[1] * 9 + [0]] * 2 + [[0] * 10] * 18)
+        values = []
+        for landing_height in (0.5, 1.5):
+            state = (board.rows, board.heights, board.filled, landing_height)
+            values.append(plain.get_expected_value(state, 2))
+            self.assertEqual(table.get_expected_value(state, 2), values[-1])
+        self.assertNotEqual(values[0], values[1])
+        self.assertEqual(sum(key[1] == 2 for key in table.table), 2)
+
+    def test_game(self):
+        table, plain = self.get_players(3)
+        board = BitBoard()
+        board.set_reward(self.WEIGHTS)
+        board.set_piece_source(UniformSource(0))
+        for p in (table, plain):
+            p.set_board(board)
+        shape = board.new_shape()
+        for move in range(3):
+            state = (board.rows, board.heights, board.filled, board.landing_height)
+            result = table.search(state, shape.get_shape(), table.depth)
+            self.assertEqual(result, plain.search(state, shape.get_shape(), plain.depth), move)
+            shape.set_sub_shape(result[0][0])
+            shape.set_x(result[0][1])
+            self.assertTrue(board.add_shape(shape))
+            board.get_reward()
+            shape = board.new_shape()
+        self.assertGreater(table.hits, 0)
+
+
+class PlayGameTest(unittest.TestCase):
+    def test_dense_contour(self):
+        # a dense contour player reads the 0/1 vector of the contour indices and plays as the sparse one
+        results = []
+        for sparse in (True, False):
+            random.seed(0)
+            player = QLearnPlayer()
+            player.set_sparse(sparse)
+            player.load_theta(os.path.join(SRC, 'theta.save'))
+            player.set_debug(player.DEBUG_LEVEL0, True)
+            board = BitBoard()
+            board.set_piece_source(UniformSource(0))
+            lines = [board.play_game(player, 50) for i in range(3)]
+            results.append((lines, np.array(player.theta)))
+        self.assertEqual(results[0][0], results[1][0])
+        self.assertGreater(sum(results[0][0]), 0)
+        self.assertTrue(np.allclose(results[0][1], results[1][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from ReplayBuffer import ReplayBuffer
+from Shape import Shape
+
+
+def get_transition(i, features=Shape.MAX_WIDTH):
+    # transition number i, every field derived from i, every fifth one ends its game
+    done = i % 5 == 4
+    new_status = np.zeros(0, np.int) if done else np.arange(features) + 2 * i
+    return np.arange(features) + i, i % 7 + 1, i % 34, new_status, float(i), done, i % 8
+
+
+class ReplayBufferTest(unittest.TestCase):
+    CAPACITY = 10
+
+    def check(self, buffer, first, last):
+        # the buffer holds transitions first..last - 1 and samples nothing else
+        self.assertEqual(len(buffer), last - first)
+        status, shapes, actions, new_status, rewards, done, p_shapes = buffer.sample(1000)
+        ids = rewards.astype(np.int)
+        self.assertEqual(set(ids.tolist()), set(range(first, last)))
+        for j, i in enumerate(ids):
+            transition = get_transition(i)
+            self.assertEqual(status[j].tolist(), transition[0].tolist())
+            self.assertEqual((shapes[j], actions[j]), transition[1:3])
+            self.assertEqual((done[j], p_shapes[j]), transition[5:])
+            if not done[j]:
+                self.assertEqual(new_status[j].tolist(), transition[3].tolist())
+
+    def test_add(self):
+        buffer = ReplayBuffer(self.CAPACITY, seed=0)
+        for i in range(7):
+            status, shape, action, new_status, reward, done, p_shape = get_transition(i)
+            buffer.add(status, shape, action, new_status, reward, p_shape)
+        self.check(buffer, 0, 7)
+        # wraps around, overwriting the oldest transitions
+        for i in range(7, 23):
+            status, shape, action, new_status, reward, done, p_shape = get_transition(i)
+            buffer.add(status, shape, action, new_status, reward, p_shape)
+        self.assertEqual(buffer.pos, 23 % self.CAPACITY)
+        self.check(buffer, 23 - self.CAPACITY, 23)
+
+    def test_add_batch(self):
+        buffer = ReplayBuffer(self.CAPACITY, seed=0)
+        count = 0
+        # batches that end short of, exactly on and across the end of the ring
+        for size in (4, 6, 7, 9):
+            transitions = [get_transition(i) for i in range(count, count + size)]
+            fields = [np.array([t[k] for t in transitions]) for k in (0, 1, 2, 4, 5, 6)]
+            status, shapes, actions, rewards, done, p_shapes = fields
+            # the rows of finished games hold anything in a batch
+            new_status = np.array([t[3] if not t[5] else -np.ones(Shape.MAX_WIDTH, np.int) for t in transitions])
+            buffer.add_batch(status, shapes, actions, new_status, rewards, done, p_shapes)
+            count += size
+            self.assertEqual(buffer.pos, count % self.CAPACITY)
+            self.check(buffer, max(0, count - self.CAPACITY), count)
+
+
+if __name__ == '__main__':
+    unittest.main()
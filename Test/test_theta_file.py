@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+import ThetaFile
+from BitBoard import BitBoard
+from LinearQLearning import QLearnPlayer
+
+# thetas pickled by the versions before the theta file
+PICKLES = ['16_theta_14', '40_7.43', 'theta.save']
+
+
+class ThetaFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, name, meta=None):
+        file_name = os.path.join(self.directory, name + '.theta')
+        ThetaFile.convert(os.path.join(SRC, name), file_name, meta)
+        return file_name
+
+    def test_convert(self):
+        for name in PICKLES:
+            pickled = ThetaFile.load_pickle(os.path.join(SRC, name))
+            file_name = self.convert(name)
+            self.assertFalse(ThetaFile.is_theta_file(os.path.join(SRC, name)))
+            self.assertTrue(ThetaFile.is_theta_file(file_name))
+            for mmap in (False, True):
+                theta, header = ThetaFile.load(file_name, mmap)
+                self.assertEqual(theta.dtype, pickled.dtype, name)
+                self.assertTrue(np.array_equal(theta, pickled), name)
+                self.assertEqual(theta.flags.writeable, not mmap, name)
+                del theta
+
+    def test_header(self):
+        meta = {'alpha': 0.01, 'gamma': 0.9, 'epsilon': 0.05, 'board_height': 20}
+        file_name = self.convert('theta.save', meta)
+        header, offset = ThetaFile.read_header(file_name)
+        theta = ThetaFile.load_pickle(os.path.join(SRC, 'theta.save'))
+        for key, value in meta.items():
+            self.assertEqual(header[key], value)
+        self.assertEqual(header['version'], ThetaFile.VERSION)
+        self.assertEqual(header['shape'], list(theta.shape))
+        self.assertEqual(header['dtype'], theta.dtype.str)
+        self.assertEqual(header['board_width'], theta.shape[2])
+        self.assertEqual(header['feature_layout'], ThetaFile.FEATURE_LAYOUT)
+        self.assertEqual(header['game_over_height'], theta.shape[3] // theta.shape[2] - 1)
+        self.assertEqual(offset % ThetaFile.ALIGN, 0)
+        self.assertEqual(os.path.getsize(file_name), offset + theta.nbytes)
+
+        # saved again with the header read back, the file is the same
+        copy_name = os.path.join(self.directory, 'copy.theta')
+        ThetaFile.save(copy_name, theta, header)
+        self.assertEqual(ThetaFile.read_header(copy_name), (header, offset))
+        with open(file_name, 'rb') as f, open(copy_name, 'rb') as copy:
+            self.assertEqual(f.read(), copy.read())
+
+        with self.assertRaises(Exception):
+            ThetaFile.read_header(os.path.join(SRC, 'theta.save'))
+
+    def test_player_mmap(self):
+        file_name = self.convert('theta.save')
+        pickled = QLearnPlayer()
+        pickled.set_sparse(True)
+        pickled.load_theta(os.path.join(SRC, 'theta.save'))
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(file_name, mmap=True)
+        self.assertFalse(player.theta.flags.writeable)
+        self.assertTrue(np.array_equal(player.theta, pickled.theta))
+
+        board = BitBoard()
+        shape = board.new_shape(1)
+        status = board.get_feature_index()
+        for p in (player, pickled):
+            p.set_debug(p.DEBUG_LEVEL0, False)
+        self.assertEqual(player.select_action(status, shape), pickled.select_action(status, shape))
+        # without learning the map is only read
+        player.update(status, 1, shape)
+
+        player.set_debug(player.DEBUG_LEVEL0, True)
+        player.select_action(status, shape)
+        with self.assertRaisesRegex(Exception, "Theta Error"):
+            player.update(status, 1, shape)
+        player.select_actions(status[None], np.array([1]))
+        with self.assertRaisesRegex(Exception, "Theta Error"):
+            player.update_batch(status[None], np.array([1.0]), np.array([False]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+from BitBoard import BitBoard
+from Checkpoint import CheckpointWriter
+from LinearQLearning import QLearnPlayer
+from PieceSource import UniformSource
+from TrainingCurve import CurveWriter, load_curve
+
+
+class NameWriter(CheckpointWriter):
+    # keeps the names of the checkpoints instead of writing them
+    def __init__(self, rounds):
+        super().__init__(rounds=rounds, latest=None)
+        self.names = []
+
+    def save(self, theta, file_name, meta=None, cur_round=None):
+        self.names.append(file_name)
+        self.last_round = cur_round
+
+
+class CheckpointNameTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_statistics(self):
+        # every checkpoint is named by the max and average of the INFO_ROUND games it ends
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(os.path.join(SRC, 'theta.save'))
+        player.set_debug(player.DEBUG_LEVEL0, False)
+        board = BitBoard()
+        board.INFO_ROUND = 5
+        board.set_piece_source(UniformSource(0))
+        board.set_curve(CurveWriter(self.directory))
+        checkpoint = NameWriter(board.INFO_ROUND)
+        board.start_training(player, rounds=15, target_lines=None, checkpoint=checkpoint)
+        board.curve.close()
+
+        lines = load_curve(self.directory)['lines'].tolist()
+        # the board counts the round of its first init, so the statistics end one game early
+        names = []
+        start = 0
+        for end in range(board.INFO_ROUND - 1, len(lines), board.INFO_ROUND):
+            games = lines[start:end]
+            names.append("theta_%d_%.3f" % (max(games), sum(games) / board.INFO_ROUND))
+            start = end
+        self.assertEqual(checkpoint.names, names)
+        self.assertGreater(max(lines), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, SRC)
+
+from BitBoard import BitBoard
+from LinearQLearning import QLearnPlayer
+from VecBoard import VecBoard
+
+
+class VecBoardTest(unittest.TestCase):
+    '''
+        Every well of a VecBoard against its own BitBoard given the same pieces and actions
+    '''
+    N = 16
+    STEPS = 200
+
+    def play(self, weights):
+        np.random.seed(2)
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(os.path.join(SRC, 'theta.save'))
+        player.set_debug(player.DEBUG_LEVEL0, True)
+        player.epsilon = 0.2
+        vec_board = VecBoard(self.N, seed=2)
+        vec_board.set_reward(weights)
+        boards = [BitBoard() for i in range(self.N)]
+        for b in boards:
+            b.set_reward(weights)
+
+        features = vec_board.init()
+        games = np.zeros(self.N, np.int)
+        lines = 0
+        for step in range(self.STEPS):
+            pieces = vec_board.pieces.copy()
+            rotations, xs = player.select_actions(features, pieces)
+            features, rewards, done, vec_lines = vec_board.step(rotations, xs)
+            for i, b in enumerate(boards):
+                alive = b.drop(pieces[i], rotations[i], xs[i])
+                reward = b.get_reward() if alive else VecBoard.GAME_OVER_REWARD
+                self.assertEqual(done[i], not alive, (step, i))
+                self.assertEqual(vec_lines[i], b.cur_removed_lines, (step, i))
+                self.assertAlmostEqual(rewards[i], reward, 9, (step, i))
+                if done[i]:
+                    games[i] += 1
+                    lines += b.cur_removed_lines
+                    b.init()
+                self.assertEqual(features[i].tolist(), b.get_feature_index().tolist(), (step, i))
+                self.assertEqual(vec_board.rows[i].tolist(), b.get_rows(), (step, i))
+        # every well finished games and was reset
+        self.assertTrue(np.all(games > 1), games)
+        self.assertGreater(lines, 100)
+
+    def test_default_reward(self):
+        self.play(None)
+
+    def test_feature_reward(self):
+        self.play({'lines': 3, 'holes': -5, 'bumpiness': -1, 'col_transitions': -0.5, 'landing_height': -1})
+
+
+if __name__ == '__main__':
+    unittest.main()
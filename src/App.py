@@ -1,15 +1,22 @@
+import collections
+import os
+import queue
 import sys
 import threading
 import time
 
-from PyQt5.QtGui import QPainter, QColor, QFont
+import numpy as np
+from PyQt5.QtGui import QPainter, QColor, QFont, QPixmap
 from PyQt5.QtWidgets import QMainWindow, QDesktopWidget, QApplication
-from PyQt5.QtCore import Qt, QBasicTimer, pyqtSignal
+from PyQt5.QtCore import Qt, QBasicTimer, QRect, pyqtSignal
 from qtpy import QtWidgets
 
 from Board import Board
+from BitBoard import BitBoard
 from Shape import Shape
-from LinearQLearning import QLearnPlayer
+from GameLog import GameLog, GameLogWriter
+from Metrics import Metrics
+from SearchPlayer import SearchPlayer
 
 
 def catch_exceptions(t, val, tb):
@@ -20,7 +27,11 @@ def catch_exceptions(t, val, tb):
 
 
 old_hook = sys.excepthook
-sys.excepthook = catch_exceptions
+
+
+# immutable copy of the board handed from the simulation thread to the GUI thread
+# cells are the (row, x) of the falling piece, msg the status bar message or None
+Frame = collections.namedtuple('Frame', ['board', 'piece', 'cells', 'msg'])
 
 
 class App(QMainWindow):
@@ -31,6 +42,15 @@ class App(QMainWindow):
     RUNNING_MODE_REPLAY = 4
 
     DEFAULT_SPEED = 300
+    # milliseconds between two checks for a new frame
+    FRAME_INTERVAL = 16
+    # lookahead of the AI player, 1 plays greedily on the Q values
+    SEARCH_DEPTH = 2
+    # AI games are logged here and replayed from it
+    REPLAY_FILE = 'replay.log'
+    # AI play appends a JSON line of metrics to this file every METRICS_PIECES pieces, None disables it
+    METRICS_FILE = None
+    METRICS_PIECES = 1000
 
     FONT_BIG = 40
     FONT_M = 25
@@ -58,29 +78,69 @@ class App(QMainWindow):
 
         self.timer = QBasicTimer()
         self.speed = self.DEFAULT_SPEED
+        # the AI plays without pauses, the GUI only draws the latest frame
+        self.turbo = False
 
-        self.board = Board()
+        self.board = BitBoard()
         self.running = False
         self.running_mode = self.RUNNING_MODE_NONE
         self.show_board_msg([(self.FONT_M, 1, 'Press Any Key'), (self.FONT_M, 1, 'To Start')])
         self.show_status_bar_msg('Press T to Training, Press A to show AI')
 
         self.player = None
+        # set by the GUI to end the AI game, the simulation thread finishes it
+        self.ai_stop = False
+        self.replay = None
+        # replay steps waiting for the replay thread, the only one moving through the log
+        self.replay_steps = None
+
+        # pre-rendered square of every shape color
+        self.tiles = None
+        # locked cells rendered once, stack_board is the board they were rendered from
+        self.stack = None
+        self.stack_board = None
+        # where the falling piece was last drawn
+        self.piece_rect = QRect()
+        self.replay_pos = 0
+
+        # frame drawn by paintEvent and the latest one published by the simulation
+        self.frame = Frame(np.zeros((Board.BOARD_HEIGHT, Board.BOARD_WIDTH), np.int), Shape.NoShape, (), None)
+        self.pending_frame = self.frame
+        self.frame_timer = QBasicTimer()
+        self.frame_timer.start(self.FRAME_INTERVAL, self)
 
     def show_board_msg(self, msg):
         self.board_msg = msg
 
     def clear_board_msg(self):
         self.board_msg = None
+        # refresh only repaints the board, the message covers the whole window
+        self.update()
 
     def show_status_bar_msg(self, msg):
         self.msg_2_bar.emit(str(msg))
 
+    def publish(self, msg=None):
+        '''
+            Hand a copy of the board to the GUI thread, safe to call from any thread
+            frames published faster than FRAME_INTERVAL are never drawn
+        '''
+        shape = self.board.cur_shape
+        if shape and shape.get_shape() != Shape.NoShape:
+            cells = tuple((self.board.cur_y - y, x) for y, x in shape.get_pos())
+            self.pending_frame = Frame(self.board.board.copy(), shape.get_shape(), cells, msg)
+        else:
+            self.pending_frame = Frame(self.board.board.copy(), Shape.NoShape, (), msg)
+
+    def pace(self, seconds):
+        if not self.turbo:
+            time.sleep(seconds)
+
     def center(self):
         screen = QDesktopWidget().screenGeometry()
         size = self.geometry()
-        self.move((screen.width() - size.width()) / 2,
-                  (screen.height() - size.height()) / 2)
+        self.move((screen.width() - size.width()) // 2,
+                  (screen.height() - size.height()) // 2)
 
     def paintEvent(self, event):
         painter = QPainter(self)
@@ -90,18 +150,13 @@ class App(QMainWindow):
         painter.drawLine(0, self.GAME_OVER_LINE_HEIGHT + 2, self.WIDTH, self.GAME_OVER_LINE_HEIGHT + 2)
 
         board_bottom = self.height() - self.STATUS_BAR_HEIGHT
-        for i in range(Board.BOARD_HEIGHT):
-            for j in range(Board.BOARD_WIDTH):
-                shape = self.board.board[i, j]
-                if shape != Shape.NoShape:
-                    self.draw_square(painter, j * self.square_width(),
-                                     board_bottom - (i + 1) * self.square_height(), shape)
-
-        if self.board.cur_shape and self.board.cur_shape.get_shape() != Shape.NoShape:
-            for y, x in self.board.cur_shape.get_pos():
-                j = self.board.cur_y - y
-                self.draw_square(painter, x * self.square_width(),
-                                 board_bottom - (j + 1) * self.square_height(), self.board.cur_shape.get_shape())
+        size = int(self.square_height())
+        painter.drawPixmap(0, board_bottom - Board.BOARD_HEIGHT * size, self.get_stack())
+
+        if self.frame.cells:
+            tile = self.get_tiles()[self.frame.piece]
+            for j, x in self.frame.cells:
+                painter.drawPixmap(x * size, board_bottom - (j + 1) * size, tile)
 
         if self.board_msg:
             color_table = [0x000000, 0xCC6666, 0x66CC66, 0x6666CC,
@@ -131,8 +186,82 @@ class App(QMainWindow):
         painter.drawLine(x + self.square_width() - 1,
                          y + self.square_height() - 1, x + self.square_width() - 1, y + 1)
 
+    def get_tiles(self):
+        if self.tiles is None:
+            size = int(self.square_width())
+            self.tiles = [None]
+            for shape in range(1, Shape.MAX_SHAPE):
+                tile = QPixmap(size, size)
+                tile.fill(Qt.transparent)
+                painter = QPainter(tile)
+                self.draw_square(painter, 0, 0, shape)
+                painter.end()
+                self.tiles.append(tile)
+        return self.tiles
+
+    def get_stack(self):
+        '''
+            Pixmap of the locked cells of the frame, only the rows changed since the last call are drawn again
+        '''
+        size = int(self.square_height())
+        if self.stack is None:
+            self.stack = QPixmap(self.WIDTH, Board.BOARD_HEIGHT * size)
+            self.stack.fill(Qt.transparent)
+            self.stack_board = np.zeros((Board.BOARD_HEIGHT, Board.BOARD_WIDTH), np.int)
+
+        board = self.frame.board
+        dirty = np.flatnonzero(np.any(board != self.stack_board, axis=1))
+        if len(dirty):
+            tiles = self.get_tiles()
+            painter = QPainter(self.stack)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            for i in dirty:
+                y = (Board.BOARD_HEIGHT - 1 - i) * size
+                painter.fillRect(0, y, self.WIDTH, size, Qt.transparent)
+                for j in np.flatnonzero(board[i]):
+                    painter.drawPixmap(j * size, y, tiles[board[i, j]])
+            painter.end()
+            self.stack_board = board
+        return self.stack
+
+    def get_piece_rect(self, frame):
+        if not frame.cells:
+            return QRect()
+        size = int(self.square_width())
+        board_bottom = self.height() - self.STATUS_BAR_HEIGHT
+        xs = [x for y, x in frame.cells]
+        ys = [y for y, x in frame.cells]
+        return QRect(min(xs) * size, board_bottom - (max(ys) + 1) * size,
+                     (max(xs) - min(xs) + 1) * size, (max(ys) - min(ys) + 1) * size)
+
+    def refresh(self, frame):
+        '''
+            Show frame, repainting only the rows changed since the last paint and the old and new
+            place of the falling piece, the whole window while a message is shown
+        '''
+        self.frame = frame
+        if frame.msg is not None:
+            self.status_bar.showMessage(frame.msg)
+        if self.board_msg or self.stack_board is None:
+            self.piece_rect = self.get_piece_rect(frame)
+            self.update()
+            return
+
+        piece_rect = self.get_piece_rect(frame)
+        rect = piece_rect.united(self.piece_rect)
+        self.piece_rect = piece_rect
+
+        dirty = np.flatnonzero(np.any(frame.board != self.stack_board, axis=1))
+        if len(dirty):
+            size = int(self.square_height())
+            board_bottom = self.height() - self.STATUS_BAR_HEIGHT
+            rect = rect.united(QRect(0, board_bottom - (dirty[-1] + 1) * size,
+                                     self.WIDTH, (dirty[-1] - dirty[0] + 1) * size))
+        if not rect.isNull():
+            self.update(rect)
+
     def square_width(self):
-        return self.WIDTH / Board.BOARD_WIDTH
+        return self.WIDTH // Board.BOARD_WIDTH
 
     def square_height(self):
         return self.square_width()
@@ -143,94 +272,166 @@ class App(QMainWindow):
 
         self.board.init()
         self.board.next_step()
-        self.update()
+        self.publish()
         self.timer.start(self.speed, self)
 
     def timerEvent(self, event):
         if event.timerId() == self.timer.timerId():
             self.next_step()
+        elif event.timerId() == self.frame_timer.timerId():
+            frame = self.pending_frame
+            if frame is not self.frame:
+                self.refresh(frame)
 
     def start_training(self):
         pass
 
     def start_ai(self):
         self.running_mode = self.RUNNING_MODE_AI_PLAY
+        self.ai_stop = False
         self.clear_board_msg()
-        self.replay = []
         threading.Thread(target=self.ai_thread).start()
 
     def start_replay(self):
+        if not os.path.exists(self.REPLAY_FILE):
+            self.running = False
+            self.show_status_bar_msg('No game logged yet, Press A to show AI')
+            return
+        try:
+            replay = GameLog(self.REPLAY_FILE)
+        except Exception as e:
+            self.running = False
+            self.show_status_bar_msg('Cannot replay %s: %s' % (self.REPLAY_FILE, e))
+            return
+
         self.running_mode = self.RUNNING_MODE_REPLAY
         self.clear_board_msg()
 
         self.board.init()
-        self.update()
+        self.replay = replay
+        self.replay_pos = 0
+        if self.replay_steps is not None:
+            self.replay_steps.put(None)
+        self.replay_steps = queue.Queue()
+        threading.Thread(target=self.replay_thread, args=(self.replay_steps,), daemon=True).start()
+        self.publish(self.get_replay_msg())
+
+    def get_replay_msg(self):
+        return "Move: %d/%d Game: %d Score: %d" % (
+            self.replay_pos, len(self.replay), self.replay.get_game(self.replay_pos), self.board.cur_removed_lines)
 
-        player = QLearnPlayer()
-        player.load_theta('16_theta_14')
-        player.set_debug(debug=player.DEBUG_LEVEL3, learn=False)
-        self.player = player
+    def replay_next(self):
+        self.replay_steps.put(self.replay_next_step)
 
+    def replay_pre(self):
+        self.replay_steps.put(self.replay_pre_step)
 
-    def replay_next(self):
-        # threading.Thread(target=self.replay_thread()).start()
-        threading.Thread(target=self.replay_thread).start()
-        pass
+    def replay_thread(self, steps):
+        # runs the steps in the order of the keys, None ends the replay
+        while True:
+            step = steps.get()
+            if step is None:
+                return
+            step()
 
-    def replay_thread(self):
-        # self.board.new_shape(self.replay.pop(0).piece_shape)
-        self.board.new_shape()
-        self.update()
-        time.sleep(self.speed / 1000.0)
+    def replay_next_step(self):
+        if self.replay_pos >= len(self.replay):
+            return
+        piece, rotation, x, lines, game_over = self.replay.get_move(self.replay_pos)
+        self.replay_pos += 1
 
-        action = self.player.select_action(self.board.get_feature_vector(), self.board.cur_shape)
-        self.board.cur_shape.set_sub_shape(action[0])
-        self.board.cur_shape.set_x(action[1])
-        self.update()
+        self.board.new_shape(piece)
+        self.publish()
+        self.pace(self.speed / 1000.0)
+
+        self.board.cur_shape.set_sub_shape(rotation)
+        self.board.cur_shape.set_x(x)
+        self.publish()
 
         if not self.board.add_shape_without_remove():
-            self.update()
-            self.game_over()
+            self.publish()
+            self.pace(1)
+            # the next move in the log starts a new game
+            self.board.init()
 
         if self.board.num_of_full_lines:
-            time.sleep(1)
+            self.pace(self.speed / 1000.0)
             self.board.remove_full_lines()
-            self.update()
+        self.publish(self.get_replay_msg())
 
-        self.show_status_bar_msg("Score:%d" % self.board.cur_removed_lines)
-        self.board.print_info()
-        print(self.board.get_reward())
-
-    def replay_pre(self):
-        pass
+    def replay_pre_step(self):
+        if self.replay_pos == 0:
+            return
+        self.replay_pos -= 1
+        self.replay.seek(self.board, self.replay_pos)
+        self.publish(self.get_replay_msg())
 
     def ai_thread(self):
         self.board.init()
-        player = QLearnPlayer()
+        player = SearchPlayer(self.SEARCH_DEPTH)
         player.load_theta('16_theta_14')
         player.set_debug(debug=player.DEBUG_LEVEL0, learn=False)
-
-        while self.running:
-            self.replay.append(self.board.new_shape())
-            self.update()
-            time.sleep(float(self.speed) / 1000)
-            action = player.select_action(self.board.get_feature_vector(), self.board.cur_shape)
+        player.set_board(self.board)
+        game_log = GameLogWriter(self.REPLAY_FILE)
+        metrics = None
+        if self.METRICS_FILE is not None:
+            metrics = Metrics(self.METRICS_FILE)
+            player.set_metrics(metrics)
+
+        while not self.ai_stop:
+            if metrics:
+                t = time.perf_counter()
+            shape = self.board.new_shape()
+            if metrics:
+                metrics.add('pieces', t)
+            self.publish()
+            self.pace(float(self.speed) / 1000)
+            if metrics:
+                t = time.perf_counter()
+            feature = self.board.get_feature_vector()
+            if metrics:
+                t = metrics.add('features', t)
+            action = player.select_action(feature, self.board.cur_shape)
+            if metrics:
+                metrics.add('select', t)
             self.board.cur_shape.set_sub_shape(action[0])
             self.board.cur_shape.set_x(action[1])
-            self.update()
+            self.publish()
 
+            removed_lines = self.board.cur_removed_lines
+            if metrics:
+                t = time.perf_counter()
             if not self.board.add_shape_without_remove():
-                self.game_over()
-                time.sleep(1)
-                self.update()
+                # the lines the last piece completed still count, as in Board.drop
+                if self.board.num_of_full_lines:
+                    self.board.remove_full_lines()
+                game_log.add(self.board, shape.get_shape(), action[0], action[1],
+                             self.board.cur_removed_lines - removed_lines, True)
                 break
+            if metrics:
+                metrics.add('place', t)
 
             if self.board.num_of_full_lines:
-                time.sleep(float(self.speed) / 1000)
+                self.pace(float(self.speed) / 1000)
+                if metrics:
+                    t = time.perf_counter()
                 self.board.remove_full_lines()
-                self.update()
-
-            self.show_status_bar_msg("Score:%d" % self.board.cur_removed_lines)
+                if metrics:
+                    metrics.add('clear', t)
+            game_log.add(self.board, shape.get_shape(), action[0], action[1],
+                         self.board.cur_removed_lines - removed_lines, False)
+
+            self.publish("Score:%d Pieces:%d" % (self.board.cur_removed_lines, self.board.cur_pieces))
+            if metrics and self.board.cur_pieces % self.METRICS_PIECES == 0:
+                metrics.emit(player, pieces=self.board.cur_pieces, lines=self.board.cur_removed_lines)
+
+        game_log.close()
+        if metrics:
+            metrics.emit(player, pieces=self.board.cur_pieces, lines=self.board.cur_removed_lines)
+            metrics.close()
+        # the board is only touched by this thread until the final frame is out
+        self.game_over()
+        self.publish()
 
     def keyPressEvent(self, event):
         key = event.key()
@@ -263,13 +464,14 @@ class App(QMainWindow):
 
     def handle_ai_play_key(self, key):
         if key == Qt.Key_S:
-            self.game_over()
-            self.update()
+            self.ai_stop = True
 
+        elif key == Qt.Key_T:
+            self.turbo = not self.turbo
         elif key == Qt.Key_Up:
             self.speed *= 2
         elif key == Qt.Key_Down:
-            self.speed /= 2
+            self.speed //= 2
 
     def handle_replay_key(self, key):
         if key == Qt.Key_N or key == Qt.Key_Right:
@@ -282,7 +484,7 @@ class App(QMainWindow):
 
     def handle_play_key(self, key):
         if key == Qt.Key_F:
-            self.speed /= 2
+            self.speed //= 2
             self.timer.stop()
             self.timer.start(self.speed, self)
 
@@ -293,19 +495,19 @@ class App(QMainWindow):
 
         elif key == Qt.Key_Left:
             self.board.move_left()
-            self.update()
+            self.publish()
 
         elif key == Qt.Key_Right:
             self.board.move_right()
-            self.update()
+            self.publish()
 
         elif key == Qt.Key_Down:
             self.board.rotate_left()
-            self.update()
+            self.publish()
 
         elif key == Qt.Key_Up:
             self.board.rotate_right()
-            self.update()
+            self.publish()
 
         elif key == Qt.Key_Space:
             self.next_step(True)
@@ -317,7 +519,7 @@ class App(QMainWindow):
                 self.board.next_step(fast=False)
         else:
             self.game_over()
-        self.update()
+        self.publish()
 
     def game_over(self):
         self.running = False
@@ -335,6 +537,8 @@ class App(QMainWindow):
 
 
 if __name__ == '__main__':
+    # only the GUI reports exceptions in a message box, importing App leaves the hook alone
+    sys.excepthook = catch_exceptions
     qApp = QApplication([])
     app = App()
     app.show()
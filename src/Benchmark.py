@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+from BitBoard import BitBoard
+from Board import Board
+from Geometry import Geometry
+from LinearQLearning import QLearnPlayer
+from PieceSource import UniformSource
+from Shape import Shape
+
+THETA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '16_theta_14')
+
+# (name, function), every function takes the Workload and returns (operations, seconds)
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+
+class Workload(object):
+    '''
+        Fixed workload shared by every benchmark: the theta in THETA_FILE playing
+        greedily on seeded pieces. actions holds every (piece, rotation, x) played,
+        and replaying them on any engine goes through the same boards.
+        Wells of other sizes than THETA_FILE play a random theta drawn from seed.
+    '''
+
+    def __init__(self, pieces, games, seed, geometry=None):
+        self.seed = seed
+        self.games = games
+        self.geometry = geometry or Board.GEOMETRY
+
+        player = self.get_player(learn=False)
+        board = BitBoard(self.geometry)
+        board.set_piece_source(UniformSource(seed))
+        self.actions = []
+        self.features = []
+        self.indices = []
+        while len(self.actions) < pieces:
+            board.init()
+            while board.started and len(self.actions) < pieces:
+                shape = board.new_shape()
+                self.features.append(board.get_feature_vector())
+                self.indices.append(board.get_feature_index())
+                action = player.select_action(self.indices[-1], shape)
+                self.actions.append((shape.get_shape(), action[0], action[1]))
+                board.drop(shape.get_shape(), action[0], action[1])
+
+    def get_shapes(self):
+        shapes = []
+        for piece, rotation, x in self.actions:
+            shape = Shape(piece, self.geometry.width)
+            shape.set_sub_shape(rotation)
+            shape.set_x(x)
+            shapes.append(shape)
+        return shapes
+
+    def get_player(self, learn, sparse=True):
+        player = QLearnPlayer()
+        if self.geometry is Board.GEOMETRY:
+            player.load_theta(THETA_FILE)
+        else:
+            player.set_features(self.geometry.features_num, self.geometry.theta_shape[:3])
+            player.set_geometry(self.geometry)
+            player.theta[:] = np.random.RandomState(self.seed).normal(0, 1, player.theta.shape)
+        player.set_debug(player.DEBUG_LEVEL0, learn)
+        player.set_sparse(sparse)
+        return player
+
+
+def add_engine_benchmarks(engine):
+    name = engine.__name__
+
+    @benchmark(name + '.add_shape')
+    def add_shape(workload):
+        board = engine(workload.geometry)
+        elapsed = 0
+        for shape in workload.get_shapes():
+            start = time.perf_counter()
+            board.add_shape(shape)
+            elapsed += time.perf_counter() - start
+            if not board.started:
+                board.init()
+        return len(workload.actions), elapsed
+
+    @benchmark(name + '.drop')
+    def drop(workload):
+        board = engine(workload.geometry)
+        elapsed = 0
+        for piece, rotation, x in workload.actions:
+            start = time.perf_counter()
+            board.drop(piece, rotation, x)
+            elapsed += time.perf_counter() - start
+            if not board.started:
+                board.init()
+        return len(workload.actions), elapsed
+
+    @benchmark(name + '.add_shape_without_remove')
+    def add_shape_without_remove(workload):
+        board = engine(workload.geometry)
+        elapsed = 0
+        for shape in workload.get_shapes():
+            start = time.perf_counter()
+            board.add_shape_without_remove(shape)
+            elapsed += time.perf_counter() - start
+            if not board.started:
+                board.init()
+            elif board.num_of_full_lines:
+                board.remove_full_lines()
+        return len(workload.actions), elapsed
+
+    @benchmark(name + '.remove_full_lines')
+    def remove_full_lines(workload):
+        board = engine(workload.geometry)
+        elapsed = 0
+        ops = 0
+        for shape in workload.get_shapes():
+            board.add_shape_without_remove(shape)
+            if not board.started:
+                board.init()
+            elif board.num_of_full_lines:
+                start = time.perf_counter()
+                board.remove_full_lines()
+                elapsed += time.perf_counter() - start
+                ops += 1
+        return ops, elapsed
+
+    def add_state_benchmark(method):
+        @benchmark(name + '.' + method)
+        def state_benchmark(workload):
+            board = engine(workload.geometry)
+            elapsed = 0
+            ops = 0
+            for piece, rotation, x in workload.actions:
+                if board.drop(piece, rotation, x):
+                    func = getattr(board, method)
+                    start = time.perf_counter()
+                    func()
+                    elapsed += time.perf_counter() - start
+                    ops += 1
+                else:
+                    board.init()
+            return ops, elapsed
+
+    add_state_benchmark('get_feature_vector')
+    add_state_benchmark('get_feature_index')
+    add_state_benchmark('calculate')
+
+
+add_engine_benchmarks(Board)
+add_engine_benchmarks(BitBoard)
+
+
+@benchmark('Shape.get_pos')
+def get_pos(workload):
+    elapsed = 0
+    for shape in workload.get_shapes():
+        start = time.perf_counter()
+        shape.get_pos()
+        elapsed += time.perf_counter() - start
+    return len(workload.actions), elapsed
+
+
+def add_player_benchmarks(sparse):
+    name = 'QLearnPlayer.%s.' % ('sparse' if sparse else 'dense')
+
+    def get_status(workload):
+        if sparse:
+            return workload.indices
+        return workload.features
+
+    @benchmark(name + 'best_action')
+    def best_action(workload):
+        player = workload.get_player(learn=False, sparse=sparse)
+        elapsed = 0
+        for status, shape in zip(get_status(workload), workload.get_shapes()):
+            start = time.perf_counter()
+            player.best_action(status, shape)
+            elapsed += time.perf_counter() - start
+        return len(workload.actions), elapsed
+
+    @benchmark(name + 'action_values')
+    def action_values(workload):
+        # the scoring of every placement of a shape, without the cache
+        player = workload.get_player(learn=False, sparse=sparse)
+        elapsed = 0
+        for status, shape in zip(get_status(workload), workload.get_shapes()):
+            start = time.perf_counter()
+            player.action_values(status, shape.get_shape())
+            elapsed += time.perf_counter() - start
+        return len(workload.actions), elapsed
+
+    def add_update_benchmark(expectation):
+        @benchmark(name + ('update_expectation' if expectation else 'update'))
+        def update(workload):
+            player = workload.get_player(learn=True, sparse=sparse)
+            player.epsilon = 0
+            status = get_status(workload)
+            shapes = workload.get_shapes()
+            elapsed = 0
+            for i in range(len(status) - 1):
+                player.select_action(status[i], shapes[i])
+                next_shape = None if expectation else shapes[i + 1]
+                start = time.perf_counter()
+                player.update(status[i + 1], 1, next_shape)
+                elapsed += time.perf_counter() - start
+            return len(status) - 1, elapsed
+
+    add_update_benchmark(False)
+    add_update_benchmark(True)
+
+
+add_player_benchmarks(False)
+add_player_benchmarks(True)
+
+
+def add_game_benchmark(learn):
+    @benchmark('games.train' if learn else 'games.play')
+    def games(workload):
+        random.seed(workload.seed)
+        player = workload.get_player(learn=learn)
+        board = BitBoard(workload.geometry)
+        board.set_piece_source(UniformSource(workload.seed))
+        start = time.perf_counter()
+        for i in range(workload.games):
+            board.play_game(player)
+        return workload.games, time.perf_counter() - start
+
+
+add_game_benchmark(False)
+add_game_benchmark(True)
+
+
+def run(workload, repeat, select=None):
+    results = {}
+    for name, func in BENCHMARKS:
+        if select and not any(s in name for s in select):
+            continue
+        best = None
+        for i in range(repeat):
+            ops, elapsed = func(workload)
+            if ops and (best is None or elapsed / ops < best):
+                best = elapsed / ops
+        if best is not None:
+            results[name] = {'ops': ops, 'ns_per_op': best * 1e9, 'ops_per_sec': 1 / best}
+    return results
+
+
+def compare(results, baseline, threshold):
+    # regressions are the benchmarks slower than the baseline by more than threshold
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result['ns_per_op'] / baseline[name]['ns_per_op']
+        print("%-45s %12.1f ns %12.1f ns %7.3fx%s" % (name, baseline[name]['ns_per_op'], result['ns_per_op'], ratio,
+                                                     '  REGRESSION' if ratio > 1 + threshold else ''))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the engines and the learner on a fixed workload')
+    parser.add_argument('--pieces', type=int, default=5000, help='pieces in the micro benchmark workload')
+    parser.add_argument('--games', type=int, default=50, help='games in the macro benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=Geometry.DEFAULT.width, help='well width, for scaling runs')
+    parser.add_argument('--height', type=int, default=Geometry.DEFAULT.height, help='well height')
+    parser.add_argument('--game-over-height', type=int, default=Geometry.DEFAULT.game_over_height)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every benchmark, the best one is kept')
+    parser.add_argument('--select', nargs='*', help='only run the benchmarks whose name contains one of these')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed slowdown against the baseline before it counts as a regression')
+    args = parser.parse_args(argv)
+
+    geometry = Geometry.get(args.width, args.height, args.game_over_height)
+    workload = Workload(args.pieces, args.games, args.seed, geometry)
+    report = {
+        'workload': {'theta': os.path.basename(THETA_FILE) if geometry is Board.GEOMETRY else None,
+                     'pieces': args.pieces, 'games': args.games, 'seed': args.seed},
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform()},
+        'results': run(workload, args.repeat, args.select),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['workload'] != report['workload']:
+            print("Warning: baseline workload differs", baseline['workload'])
+        if compare(report['results'], baseline['results'], args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
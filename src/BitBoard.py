@@ -0,0 +1,176 @@
+import numpy as np
+
+from Board import Board
+from Shape import Shape
+
+
+class BitBoard(Board):
+    '''
+        Board engine keeping every row as a bit mask of the well width.
+        Column heights, per row fill counts and the number of filled cells
+        are maintained on each placement instead of rescanning the well.
+        board is kept as the color matrix so the GUI can still draw it.
+    '''
+    FULL_ROW = Board.GEOMETRY.full_row
+
+    def __init__(self, geometry=None):
+        self.rows = None
+        self.row_counts = None
+        self.heights = None
+        self.filled = None
+        self.touched_rows = None
+        super().__init__(geometry)
+
+    def init(self):
+        super().init()
+        self.board_m = None
+        self.rows = [0] * self.geometry.height
+        self.row_counts = [0] * self.geometry.height
+        self.heights = [0] * self.geometry.width
+        self.filled = 0
+        self.touched_rows = range(0)
+
+    def get_min_distance(self):
+        n_shape = self.cur_shape
+        cols, skirt, top, row_masks, row_counts, cells = \
+            self.geometry.placements[n_shape.piece_shape][n_shape.sub_shape][n_shape.x]
+        heights = self.heights
+        base = 0
+        for i in range(len(cols)):
+            if heights[cols[i]] - skirt[i] > base:
+                base = heights[cols[i]] - skirt[i]
+        # the shape can start below the first row of SHAPE_TABLE, as in get_pos
+        return self.cur_y - Shape.SHAPE_BOTTOM[n_shape.piece_shape][n_shape.sub_shape] - base
+
+    # x start from 0 and y start from 0
+    def set_pos(self, x, y, v):
+        self.rows[y] |= 1 << x
+        self.row_counts[y] += 1
+        self.filled += 1
+        if y + 1 > self.heights[x]:
+            self.heights[x] = y + 1
+        self.board[y, x] = v
+
+    def place(self, piece, rotation, x):
+        cols, skirt, top, row_masks, row_counts, cells = self.geometry.placements[piece][rotation][x]
+        heights = self.heights
+        base = 0
+        for i in range(len(cols)):
+            if heights[cols[i]] - skirt[i] > base:
+                base = heights[cols[i]] - skirt[i]
+
+        rows = self.rows
+        counts = self.row_counts
+        for i in range(len(row_masks)):
+            rows[base + i] |= row_masks[i]
+            counts[base + i] += row_counts[i]
+        for i in range(len(cols)):
+            heights[cols[i]] = base + top[i]
+        board = self.board
+        for y, c in cells:
+            board[base + y, c] = piece
+        self.filled += Shape.MAX_POINT
+        self.touched_rows = range(base, base + len(row_masks))
+        self.landing_height = base + (len(row_masks) - 1) / 2
+
+    def is_game_over(self):
+        if max(self.heights) > self.geometry.game_over_height:
+            self.started = False
+            self.total_removed_lines += self.cur_removed_lines
+            if self.cur_removed_lines > self.max_removed:
+                self.max_removed = self.cur_removed_lines
+            return True
+        return False
+
+    def count_full_lines(self):
+        # only the rows touched by the last placement can have become full
+        rows = self.rows
+        full_row = self.geometry.full_row
+        return sum(1 for y in self.touched_rows if rows[y] == full_row)
+
+    def remove_full_lines(self):
+        if self.num_of_full_lines:
+            self.calculate()
+            self.num_of_full_lines = 0
+
+        rows = self.rows
+        full_row = self.geometry.full_row
+        to_remove = [y for y in self.touched_rows if rows[y] == full_row]
+        self.touched_rows = range(0)
+
+        if len(to_remove) == 0:
+            return
+
+        removed = len(to_remove)
+        self.filled -= removed * self.geometry.width
+        self.one_removed_lines = removed
+        self.cur_removed_lines += removed
+
+        # shift the remaining rows down in place, nothing above the stack needs touching
+        row_counts = self.row_counts
+        board = self.board
+        top = max(self.heights)
+        dst = to_remove[0]
+        for src in range(dst, top):
+            if rows[src] == full_row:
+                continue
+            if src != dst:
+                rows[dst] = rows[src]
+                row_counts[dst] = row_counts[src]
+                board[dst] = board[src]
+            dst += 1
+        for y in range(dst, top):
+            rows[y] = 0
+            row_counts[y] = 0
+            board[y] = 0
+
+        # every full row crossed every column, the new top can only be lower
+        heights = self.heights
+        for x in range(self.geometry.width):
+            bit = 1 << x
+            h = heights[x] - removed
+            while h and not rows[h - 1] & bit:
+                h -= 1
+            heights[x] = h
+
+    def load_board(self, board, removed_lines=0, pieces=0):
+        filled = np.asarray(board) > 0
+        self.rows = filled.dot(1 << np.arange(self.geometry.width)).tolist()
+        self.row_counts = np.sum(filled, axis=1).tolist()
+        self.heights = (np.any(filled, axis=0) * (self.geometry.height - np.argmax(filled[::-1], axis=0))).tolist()
+        self.filled = int(np.sum(filled))
+        self.touched_rows = range(0)
+        super().load_board(board, removed_lines, pieces)
+        self.board_m = None
+
+    def calculate(self):
+        heights = self.heights
+        self.last_bad_pos = self.bad_pos
+        self.bad_pos = sum(heights) - self.filled
+        self.last_var = self.var
+        self.var = sum(abs(heights[i + 1] - heights[i]) for i in range(self.geometry.width - 1))
+        return self.bad_pos, self.var
+
+    def get_feature_vector(self):
+        res = np.zeros(self.geometry.features_num)
+        res[self.get_feature_index()] = 1
+        return res
+
+    def get_feature_index(self):
+        return self.geometry.feature_offset - min(self.heights) + self.heights
+
+    def get_rows(self):
+        return self.rows
+
+    def get_heights(self):
+        return self.heights
+
+    def point_check(self):
+        cur_num = sum(bin(row).count('1') for row in self.rows)
+        if cur_num != self.filled or np.sum(self.board > 0) != self.filled:
+            raise Exception("Point Check Error")
+
+
+if __name__ == '__main__':
+    board = BitBoard()
+    board.start_training()
@@ -1,17 +1,28 @@
 import pprint
+import time
 
 import numpy as np
 
+from Checkpoint import CheckpointWriter
+from Features import get_reward_set
+from Geometry import Geometry
 from LinearQLearning import QLearnPlayer
 from Shape import Shape
 
 
 class Board(object):
-    BOARD_WIDTH = Shape.MAX_WIDTH
-    BOARD_HEIGHT = 20
-    GAME_OVER_HEIGHT = 16
-
-    def __init__(self):
+    # size of the boards created without a geometry, kept here for the code written for it
+    GEOMETRY = Geometry.DEFAULT
+    BOARD_WIDTH = GEOMETRY.width
+    BOARD_HEIGHT = GEOMETRY.height
+    GAME_OVER_HEIGHT = GEOMETRY.game_over_height
+    # start of the one-hot block of each column in the feature vector
+    FEATURE_OFFSET = GEOMETRY.feature_offset
+    # weight of the removed lines and of the change of every feature in the reward of a move
+    REWARD_WEIGHTS = {'holes': -7, 'bumpiness': -1, 'lines': 4}
+
+    def __init__(self, geometry=None):
+        self.geometry = geometry or Board.GEOMETRY
         self.with_gui = False
         self.total_removed_lines = 0
         self.average = 0
@@ -19,20 +30,45 @@ class Board(object):
         self.INFO_ROUND = 1000
         self.max_removed = 0
         self.debug = False
+        # draws the pieces of new_shape, Shape picks them at random when None
+        self.piece_source = None
+        # GameLogWriter recording every drop
+        self.game_log = None
+        # Metrics timing the phases of every move, None when disabled
+        self.metrics = None
+        # CurveWriter recording every game of start_training
+        self.curve = None
 
         self.cur_shape = None
+        # one Shape of every piece, new_shape hands them out again instead of allocating
+        self.shapes = [Shape(p_shape, self.geometry.width) for p_shape in range(Shape.MAX_SHAPE)]
         self.cur_y = None
         self.bad_pos = None
         self.last_bad_pos = None
         self.var = None
         self.last_var = None
+        # height of the middle of the last piece placed
+        self.landing_height = None
         self.BOARD_M_FULL = self.get_full_board_m()
 
+        self.reward_weights = None
+        # FeatureSet of the reward when it weights more than holes and bumpiness, else None
+        self.reward_set = None
+        self.reward_vector = None
+        self.reward_empty = None
+        # features of the last move, alternating between the two buffers
+        self.reward_buffers = None
+        self.reward_last = None
+        self.set_reward()
+
         self.board = None
         self.board_m = None
 
         self.num_of_full_lines = None
         self.cur_removed_lines = None
+        self.cur_pieces = None
+        # sum of the rewards given to the player in the game
+        self.cur_reward = None
         self.one_removed_lines = None
         self.started = None
         self.init()
@@ -40,15 +76,43 @@ class Board(object):
         self.__total_points = 0
         self.__removed_points = 0
 
+    def set_piece_source(self, piece_source):
+        self.piece_source = piece_source
+
+    def set_game_log(self, game_log):
+        self.game_log = game_log
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+
+    def set_curve(self, curve):
+        self.curve = curve
+
+    def set_reward(self, weights=None):
+        '''
+            weights maps 'lines' and feature names to the weight of their change in the reward of a move,
+            Board.REWARD_WEIGHTS when None
+        '''
+        self.reward_weights = dict(Board.REWARD_WEIGHTS if weights is None else weights)
+        self.reward_set, self.reward_vector = get_reward_set(self.reward_weights, self.geometry)
+        if self.reward_set is not None:
+            self.reward_empty = self.reward_set.get_empty()
+            self.reward_buffers = np.zeros((2, self.reward_set.size))
+        self.reward_last = None
+
     def set_mode(self, gui, debug):
         self.with_gui = gui
         self.debug = debug
 
     def init(self):
-        self.board = np.zeros((Board.BOARD_HEIGHT, Board.BOARD_WIDTH), np.int)
-        self.board_m = np.zeros((Board.BOARD_HEIGHT + 1, Board.BOARD_WIDTH), np.int)
+        self.board = np.zeros((self.geometry.height, self.geometry.width), np.int)
+        self.board_m = np.zeros((self.geometry.height + 1, self.geometry.width), np.int)
         # self.total_removed_lines = 0
         self.cur_removed_lines = 0
+        self.cur_pieces = 0
+        self.cur_reward = 0
+        self.landing_height = 0
+        self.reward_last = None
         self.one_removed_lines = 0
         self.started = True
         self.round += 1
@@ -85,7 +149,7 @@ class Board(object):
     def get_min_distance(self):
         pos = self.cur_shape.get_pos()
         cur_h = np.argmax(self.board_m, axis=0)
-        min_distance = Board.BOARD_HEIGHT
+        min_distance = self.geometry.height
         for y, x in pos:
             if (self.cur_y - y - cur_h[x]) < min_distance:
                 min_distance = self.cur_y - y - cur_h[x]
@@ -120,70 +184,167 @@ class Board(object):
         self.cur_shape.rotate_right()
 
     def new_shape(self, shape=None):
-        self.cur_y = Board.BOARD_HEIGHT - 1
-        self.cur_shape = Shape(shape)
+        '''
+            Spawn piece shape, the next one of the piece source or a random one when None
+            the Shape returned is reused by the next piece of the same kind
+        '''
+        if shape is None:
+            shape = self.piece_source.next_piece() if self.piece_source is not None else Shape.random_shape()
+        self.cur_y = self.geometry.height - 1
+        self.cur_shape = self.shapes[shape]
+        self.cur_shape.reset()
         return self.cur_shape
 
     def get_reward(self):
-        # print(self.last_bad_pos, self.bad_pos, self.last_var, self.var, self.one_removed_lines)
-        reward = (self.last_bad_pos - self.bad_pos) * 7
-        # print(reward)
-        reward += self.one_removed_lines * 4
-        # print(reward)
-        reward += self.last_var - self.var
-        # print(reward)
+        # called once after every drop
+        weights = self.reward_weights
+        reward = self.one_removed_lines * weights.get('lines', 0)
+        if self.reward_set is None:
+            reward += (self.bad_pos - self.last_bad_pos) * weights.get('holes', 0)
+            reward += (self.var - self.last_var) * weights.get('bumpiness', 0)
+        else:
+            last = self.reward_empty if self.reward_last is None else self.reward_last
+            values = self.get_features(self.reward_set, self.reward_buffers[self.cur_pieces & 1])
+            reward += float(np.dot(self.reward_vector, values - last))
+            self.reward_last = values
         self.one_removed_lines = 0
         return reward
 
-    def start_training(self):
-        player = QLearnPlayer()
-        player.set_features(Board.BOARD_WIDTH * (Board.GAME_OVER_HEIGHT + 1),
-                            [Shape.MAX_SHAPE, max(Shape.SUB), Board.BOARD_WIDTH])
-        player.set_debug(player.DEBUG_LEVEL0, True)
-        player.load_theta('theta_53_15.034')
-
-        while True:
-            self.init()
-            while self.started:
-                new_shape = self.new_shape()
-
-                action = player.select_action(self.get_feature_vector(), new_shape)
-                new_shape.set_sub_shape(action[0])
-                new_shape.set_x(action[1])
-
-                self.add_shape(new_shape)
-                if self.debug:
-                    self.print_info()
-
-                if self.cur_removed_lines > 1000:
-                    print("theta_%d_%.3f" % (self.cur_removed_lines, self.average))
-                    player.save_theta("theta_%d_%.3f" % (self.max_removed, self.average))
-                    return
-
-                if self.started:
-                    player.update(self.get_feature_vector(), self.get_reward(), self.new_shape())
-                else:
-                    self.point_check()
-                    player.update(np.zeros(self.BOARD_WIDTH * (self.GAME_OVER_HEIGHT + 1)), -3,
-                                  new_shape)
-
-            if self.round % self.INFO_ROUND == 0:
+    def start_training(self, player=None, rounds=None, seconds=None, target_lines=1000, checkpoint=None):
+        '''
+            Train player until rounds games are played or seconds have passed, forever when both are None
+            stop and save theta as soon as one game removes target_lines lines
+            checkpoint is a CheckpointWriter, by default one saving every 10 INFO_ROUND games
+            with metrics set, a JSON line of metrics is emitted every INFO_ROUND games
+            with curve set, every game is added to it
+            return the player
+        '''
+        if checkpoint is None:
+            checkpoint = CheckpointWriter(rounds=self.INFO_ROUND * 10)
+        if player is None:
+            player = QLearnPlayer()
+            player.set_features(self.geometry.features_num, self.geometry.theta_shape[:3])
+            player.set_debug(player.DEBUG_LEVEL0, True)
+            player.set_sparse(True)
+            player.load_theta('theta_53_15.034')
+
+        player.set_metrics(self.metrics)
+        start_time = info_time = time.time()
+        games = pieces = info_games = info_pieces = 0
+        info_moves = player.evaluated
+        while (rounds is None or games < rounds) and (seconds is None or time.time() - start_time < seconds):
+            self.play_game(player, target_lines)
+            games += 1
+            pieces += self.cur_pieces
+            if self.curve is not None:
+                self.curve.add(self.cur_removed_lines, self.cur_pieces, self.cur_reward, player.epsilon)
+
+            if target_lines is not None and self.cur_removed_lines >= target_lines:
+                print("theta_%d_%.3f" % (self.cur_removed_lines, self.average))
+                player.save_theta("theta_%d_%.3f" % (self.max_removed, self.average))
+                break
+
+            info = self.round % self.INFO_ROUND == 0
+            if info:
                 self.average = self.total_removed_lines / self.INFO_ROUND
+            # counted in rounds as the statistics, so it is named by them before they are counted again from zero
+            if checkpoint.due(self.round):
+                checkpoint.save(player.theta, "theta_%d_%.3f" % (self.max_removed, self.average),
+                                player.get_meta(), self.round)
+
+            if info:
                 # self.print_info()
-                print("Round: %-10d" % self.round, "Max:", self.max_removed, "Avg:", self.average)
+                now = time.time()
+                print("Round: %-10d" % self.round, "Max:", self.max_removed, "Avg:", self.average,
+                      self.get_throughput(games - info_games, pieces - info_pieces,
+                                          player.evaluated - info_moves, now - info_time))
+                if self.curve is not None:
+                    print(self.curve.get_info())
+                if self.metrics is not None:
+                    self.metrics.emit(player, round=self.round, games=games - info_games,
+                                      pieces=pieces - info_pieces, average=self.average, max=self.max_removed)
+                info_time = now
+                info_games = games
+                info_pieces = pieces
+                info_moves = player.evaluated
                 self.total_removed_lines = 0
-
-                if self.round % (self.INFO_ROUND * 10) == 0:
-                    player.save_theta("theta_%d_%.3f" % (self.max_removed, self.average))
-
                 self.max_removed = 0
 
+        checkpoint.close()
+        print("Games: %d Pieces: %d Seconds: %.1f" % (games, pieces, time.time() - start_time),
+              self.get_throughput(games, pieces, player.evaluated, time.time() - start_time))
+        return player
+
     @staticmethod
-    def get_full_board_m():
-        res = np.zeros((Board.BOARD_HEIGHT + 1, Board.BOARD_WIDTH), np.int)
-        for i in range(Board.BOARD_HEIGHT + 1):
-            res[i] = i
-        return res
+    def get_throughput(games, pieces, moves, seconds):
+        # moves are the candidate placements the player has scored
+        seconds = max(seconds, 1e-9)
+        return "Pieces/s: %.1f Games/s: %.3f Moves/s: %.1f" % (pieces / seconds, games / seconds, moves / seconds)
+
+    def play_game(self, player, max_lines=None):
+        '''
+            Play one game with player, updating it after every piece
+            stop early once max_lines lines are removed, return the removed lines
+        '''
+        metrics = self.metrics
+        feature_set = player.feature_set
+        # a contour player without sparse features reads the 0/1 vector of the indices
+        dense = feature_set is None and not getattr(player, 'sparse', True)
+        if feature_set is not None:
+            # the player keeps the status of the last move while the next one is written
+            buffers = np.zeros((2, feature_set.size))
+            end_status = np.zeros(feature_set.size)
+        else:
+            buffers = None
+            end_status = np.zeros(self.geometry.features_num) if dense else np.zeros(0, np.int)
+        self.init()
+        if metrics:
+            t = time.perf_counter()
+        new_shape = self.new_shape()
+        if metrics:
+            t = metrics.add('pieces', t)
+        status = self.get_status(feature_set, buffers, dense)
+        if metrics:
+            t = metrics.add('features', t)
+        while self.started:
+            action = player.select_action(status, new_shape)
+            if metrics:
+                metrics.add('select', t)
+            new_shape.set_sub_shape(action[0])
+            new_shape.set_x(action[1])
+
+            self.add_shape(new_shape)
+            if self.debug:
+                self.print_info()
+
+            if metrics:
+                t = time.perf_counter()
+            if self.started:
+                # learn from the piece that is played next so a piece stream is not skipped through
+                next_shape = self.new_shape()
+                if metrics:
+                    t = metrics.add('pieces', t)
+                status = self.get_status(feature_set, buffers, dense)
+                if metrics:
+                    t = metrics.add('features', t)
+                reward = self.get_reward()
+                self.cur_reward += reward
+                player.update(status, reward, next_shape)
+                new_shape = next_shape
+            else:
+                self.point_check()
+                self.cur_reward -= 3
+                player.update(end_status, -3, new_shape)
+            if metrics:
+                t = metrics.add('update', t)
+
+            if max_lines is not None and self.cur_removed_lines >= max_lines:
+                break
+
+        return self.cur_removed_lines
+
+    def get_full_board_m(self):
+        return self.geometry.full_board_m
 
     # x start from 0 and y start from 0
     def set_pos(self, x, y, v):
@@ -191,79 +352,112 @@ class Board(object):
         self.board_m[y + 1, x] = y + 1
 
     def get_feature_vector(self):
-        res = np.zeros(self.BOARD_WIDTH * (self.GAME_OVER_HEIGHT + 1))
+        res = np.zeros(self.geometry.features_num)
         top = np.argmax(self.board_m, axis=0)
         top -= min(top)
 
         for i in range(top.shape[0]):
-            res[i * (self.GAME_OVER_HEIGHT + 1) + top[i]] = 1
+            res[i * (self.geometry.game_over_height + 1) + top[i]] = 1
 
         return res
 
+    def get_feature_index(self):
+        # indices of the ones in get_feature_vector
+        top = np.argmax(self.board_m, axis=0)
+        return self.geometry.feature_offset + top - min(top)
+
+    def get_rows(self):
+        # every row as a bit mask, from the bottom
+        return (self.board > 0).dot(1 << np.arange(self.geometry.width)).tolist()
+
+    def get_heights(self):
+        return np.argmax(self.board_m, axis=0).tolist()
+
+    def get_features(self, feature_set, out=None):
+        return feature_set.extract(self.get_rows(), self.get_heights(), self.landing_height, out)
+
+    def get_status(self, feature_set=None, buffers=None, dense=False):
+        '''
+            What a player reads: the contour indices, their 0/1 vector when dense,
+            or the features of feature_set written into buffers
+        '''
+        if feature_set is None:
+            return self.get_feature_vector() if dense else self.get_feature_index()
+        return self.get_features(feature_set, buffers[self.cur_pieces & 1])
+
     def point_check(self):
         cur_num = np.sum(self.board > 0)
         if cur_num != (self.__total_points - self.__removed_points):
             raise Exception("Point Check Error")
 
-    def add_shape(self, n_shape=None):
-
+    def place(self, piece, rotation, x):
         self.__total_points += Shape.MAX_POINT
 
-        if n_shape is None:
-            n_shape = self.cur_shape
-
-        pos = n_shape.get_pos()
+        index = self.geometry.placement_index[piece, rotation, x]
+        cell_x = self.geometry.placement_x[index]
+        cell_y = self.geometry.placement_y[index]
         cur_h = np.argmax(self.board_m, axis=0)
+        cell_y = cell_y + np.max(cur_h[cell_x] - cell_y)
+        self.landing_height = (cell_y.min() + cell_y.max()) / 2
 
-        min_distance = Board.BOARD_HEIGHT
-        for y, x in pos:
-            if (self.cur_y - y - cur_h[x]) < min_distance:
-                min_distance = self.cur_y - y - cur_h[x]
-
-        for y, x in pos:
-            self.set_pos(x, self.cur_y - y - min_distance, n_shape.get_shape())
+        self.board[cell_y, cell_x] = piece
+        self.board_m[cell_y + 1, cell_x] = cell_y + 1
 
-        self.remove_full_lines()
-        self.cur_shape = None
-
-        if np.max(self.board_m) > Board.GAME_OVER_HEIGHT:
+    def is_game_over(self):
+        if np.max(self.board_m) > self.geometry.game_over_height:
             self.started = False
             self.total_removed_lines += self.cur_removed_lines
             if self.cur_removed_lines > self.max_removed:
                 self.max_removed = self.cur_removed_lines
                 # print("#########GAME OVER#########")
+            return True
+        return False
+
+    def drop(self, piece, rotation, x):
+        '''
+            Drop piece with rotation at column x to the bottom and remove full lines
+            return false when game_over, true otherwise
+        '''
+        metrics = self.metrics
+        if metrics:
+            t = time.perf_counter()
+        self.place(piece, rotation, x)
+        self.cur_pieces += 1
+        if metrics:
+            t = metrics.add('place', t)
+        removed_lines = self.cur_removed_lines
+        self.remove_full_lines()
+        self.cur_shape = None
+
+        game_over = self.is_game_over()
+        if metrics:
+            t = metrics.add('clear', t)
+        if self.game_log is not None:
+            self.game_log.add(self, piece, rotation, x, self.cur_removed_lines - removed_lines, game_over)
+        if game_over:
             return False
 
         self.calculate()
+        if metrics:
+            metrics.add('features', t)
         return True
 
-    def add_shape_without_remove(self, n_shape=None):
-        self.__total_points += Shape.MAX_POINT
+    def add_shape(self, n_shape=None):
         if n_shape is None:
             n_shape = self.cur_shape
-        pos = n_shape.get_pos()
-        cur_h = np.argmax(self.board_m, axis=0)
-
-        min_distance = Board.BOARD_HEIGHT
-        for y, x in pos:
-            if (self.cur_y - y - cur_h[x]) < min_distance:
-                min_distance = self.cur_y - y - cur_h[x]
 
-        for y, x in pos:
-            self.set_pos(x, self.cur_y - y - min_distance, n_shape.get_shape())
+        return self.drop(n_shape.piece_shape, n_shape.sub_shape, n_shape.x)
 
-        # self.remove_full_lines()
-        to_remove = np.nonzero(np.all(self.board, axis=1))[0]
-        self.num_of_full_lines = len(to_remove)
+    def add_shape_without_remove(self, n_shape=None):
+        if n_shape is None:
+            n_shape = self.cur_shape
 
+        self.place(n_shape.piece_shape, n_shape.sub_shape, n_shape.x)
+        self.cur_pieces += 1
+        self.num_of_full_lines = self.count_full_lines()
         self.cur_shape = None
 
-        if np.max(self.board_m) > Board.GAME_OVER_HEIGHT:
-            self.started = False
-            self.total_removed_lines += self.cur_removed_lines
-            if self.cur_removed_lines > self.max_removed:
-                self.max_removed = self.cur_removed_lines
-                # print("#########GAME OVER#########")
+        if self.is_game_over():
             return False
 
         if self.num_of_full_lines == 0:
@@ -271,6 +465,9 @@ class Board(object):
 
         return True
 
+    def count_full_lines(self):
+        return len(np.nonzero(np.all(self.board, axis=1))[0])
+
     def remove_full_lines(self):
         # to_remove = np.argwhere(np.sum(self.board, axis=1) == Board.BOARD_WIDTH).ravel()
 
@@ -283,17 +480,40 @@ class Board(object):
         if len(to_remove) == 0:
             return
 
-        self.__removed_points += len(to_remove) * self.BOARD_WIDTH
+        self.__removed_points += len(to_remove) * self.geometry.width
 
         self.one_removed_lines = len(to_remove)
         self.cur_removed_lines += len(to_remove)
 
         after_remove = np.delete(self.board, to_remove, axis=0)
-        self.board = np.zeros((Board.BOARD_HEIGHT, Board.BOARD_WIDTH), np.int)
+        self.board = np.zeros((self.geometry.height, self.geometry.width), np.int)
         np.copyto(self.board[0:after_remove.shape[0]], after_remove)
 
         self.board_m[1:] = self.BOARD_M_FULL[1:] * (self.board > 0)
 
+    def load_board(self, board, removed_lines=0, pieces=0):
+        '''
+            Continue a game from board, e.g. a game log snapshot
+        '''
+        self.board = np.array(board, np.int)
+        self.board_m = np.zeros((self.geometry.height + 1, self.geometry.width), np.int)
+        self.board_m[1:] = self.BOARD_M_FULL[1:] * (self.board > 0)
+        self.cur_removed_lines = removed_lines
+        self.cur_pieces = pieces
+        self.one_removed_lines = 0
+        self.num_of_full_lines = 0
+        self.cur_shape = None
+        self.started = True
+        # point_check counts from the cells loaded
+        self.__total_points = int(np.sum(self.board > 0))
+        self.__removed_points = 0
+        self.calculate()
+        self.last_bad_pos = self.bad_pos
+        self.last_var = self.var
+        self.landing_height = 0
+        if self.reward_set is not None:
+            self.reward_last = self.get_features(self.reward_set, self.reward_buffers[pieces & 1])
+
     def calculate(self):
         top = np.argmax(self.board_m, axis=0)
         self.last_bad_pos = self.bad_pos
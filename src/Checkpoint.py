@@ -0,0 +1,90 @@
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+import ThetaFile
+
+
+class CheckpointWriter(object):
+    '''
+        Saves theta checkpoints from a background thread.
+        save only copies theta, the thread writes the copy to a temporary file and
+        renames it into place, then removes the oldest checkpoints beyond keep.
+        A snapshot still waiting when a newer one arrives is replaced by it.
+        Checkpoints are due every rounds games or every seconds, when set.
+    '''
+
+    def __init__(self, rounds=None, seconds=None, keep=5, latest="theta.save"):
+        self.rounds = rounds
+        self.seconds = seconds
+        self.keep = keep
+        # also written on every checkpoint, None to skip
+        self.latest = latest
+
+        self.files = collections.deque()
+        self.last_round = 0
+        self.last_time = time.time()
+        self.written = 0
+        self.error = None
+
+        self.pending = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def due(self, cur_round):
+        if self.rounds is not None and cur_round - self.last_round >= self.rounds:
+            return True
+        if self.seconds is not None and time.time() - self.last_time >= self.seconds:
+            return True
+        return False
+
+    def save(self, theta, file_name, meta=None, cur_round=None):
+        snapshot = np.array(theta)
+        with self.condition:
+            self.pending = (snapshot, file_name, meta)
+            self.condition.notify()
+        if cur_round is not None:
+            self.last_round = cur_round
+        self.last_time = time.time()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                theta, file_name, meta = self.pending
+                self.pending = None
+            try:
+                self.write(theta, file_name, meta)
+            except Exception as e:
+                self.error = e
+
+    def write(self, theta, file_name, meta):
+        ThetaFile.save_atomic(file_name, theta, meta)
+        if self.latest is not None:
+            ThetaFile.save_atomic(self.latest, theta, meta)
+        self.written += 1
+
+        if file_name in self.files:
+            self.files.remove(file_name)
+        self.files.append(file_name)
+        while len(self.files) > self.keep:
+            old = self.files.popleft()
+            if os.path.exists(old):
+                os.remove(old)
+
+    def close(self):
+        # write the pending snapshot, stop the thread and raise the last write error
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,164 @@
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from BitBoard import BitBoard
+from Geometry import Geometry
+from LinearQLearning import QLearnPlayer
+from PieceSource import UniformSource
+from SearchPlayer import SearchPlayer
+
+PERCENTILES = [10, 25, 50, 75, 90]
+
+# GameRunner of the pool process, set by init_worker
+runner = None
+
+
+class GameRunner(object):
+    '''
+        Plays evaluation games with learn=False, game i always gets the pieces of seed + i
+        with server the moves come from the InferenceServer listening there instead of theta_file
+    '''
+
+    def __init__(self, theta_file, depth=1, seed=0, max_lines=None, server=None):
+        self.seed = seed
+        self.max_lines = max_lines
+        if server is not None:
+            # only the workers of a server pay for the socket and subprocess imports
+            from InferenceServer import InferenceClient, RemotePlayer
+            client = InferenceClient(server)
+            self.board = BitBoard(Geometry.get(client.width, client.height, client.game_over_height))
+            self.player = RemotePlayer(client, self.board.geometry.feature_offset)
+            return
+        if depth > 1:
+            self.player = SearchPlayer(depth)
+        else:
+            self.player = QLearnPlayer()
+            self.player.set_sparse(True)
+        self.player.load_theta(theta_file, mmap=True)
+        # the well of the theta
+        self.board = BitBoard(self.player.geometry)
+        if depth > 1:
+            self.player.set_board(self.board)
+        self.player.set_debug(self.player.DEBUG_LEVEL0, False)
+
+    def play(self, game):
+        '''
+            return (removed lines, pieces, seconds)
+        '''
+        self.board.set_piece_source(UniformSource(self.seed + game))
+        start = time.perf_counter()
+        lines = self.board.play_game(self.player, self.max_lines)
+        return lines, self.board.cur_pieces, time.perf_counter() - start
+
+
+def init_worker(theta_file, depth, seed, max_lines, server):
+    global runner
+    runner = GameRunner(theta_file, depth, seed, max_lines, server)
+
+
+def play(game):
+    return runner.play(game)
+
+
+def get_half_width(lines, confidence):
+    # half width of the normal confidence interval on the mean
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    return z * np.std(lines, ddof=1) / np.sqrt(len(lines))
+
+
+def is_settled(lines, confidence, ci=None, rel_ci=None, min_games=30):
+    if len(lines) < max(min_games, 2) or (ci is None and rel_ci is None):
+        return False
+    half_width = get_half_width(lines, confidence)
+    if ci is not None and half_width <= ci:
+        return True
+    return rel_ci is not None and half_width <= rel_ci * np.mean(lines)
+
+
+def evaluate(theta_file, games=1000, workers=None, depth=1, seed=0, max_lines=None,
+             confidence=0.95, ci=None, rel_ci=None, min_games=30, server=None):
+    '''
+        Play up to games games over a process pool, stopping once the confidence
+        interval on the mean removed lines is narrower than ci lines or rel_ci of the mean
+        results are taken in game order, so stopping early does not favour the short games
+        return the summary
+    '''
+    workers = workers or multiprocessing.cpu_count()
+    lines = []
+    pieces = 0
+    start = time.time()
+    pool = multiprocessing.Pool(workers, init_worker, (theta_file, depth, seed, max_lines, server))
+    try:
+        for removed_lines, game_pieces, seconds in pool.imap(play, range(games)):
+            lines.append(removed_lines)
+            pieces += game_pieces
+            if is_settled(lines, confidence, ci, rel_ci, min_games):
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    return summarize(lines, pieces, time.time() - start, confidence, max_lines)
+
+
+def summarize(lines, pieces, seconds, confidence, max_lines=None):
+    lines = np.asarray(lines)
+    summary = {
+        'games': len(lines),
+        'mean': float(np.mean(lines)),
+        'std': float(np.std(lines, ddof=1)) if len(lines) > 1 else 0.0,
+        'ci': float(get_half_width(lines, confidence)) if len(lines) > 1 else None,
+        'confidence': confidence,
+        'max': int(np.max(lines)),
+        'pieces': pieces,
+        'seconds': seconds,
+        'pieces_per_sec': pieces / max(seconds, 1e-9),
+    }
+    for p, value in zip(PERCENTILES, np.percentile(lines, PERCENTILES)):
+        summary['p%d' % p] = float(value)
+    if max_lines is not None:
+        summary['capped'] = int(np.sum(lines >= max_lines))
+    return summary
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Evaluate a theta file on seeded games without learning')
+    parser.add_argument('theta', help='theta file to evaluate')
+    parser.add_argument('--games', type=int, default=1000, help='games played when the interval never settles')
+    parser.add_argument('--workers', type=int, help='processes, one per core when omitted')
+    parser.add_argument('--depth', type=int, default=1, help='lookahead of the SearchPlayer, 1 plays greedily')
+    parser.add_argument('--seed', type=int, default=0, help='game i gets the pieces of seed + i')
+    parser.add_argument('--max-lines', type=int, help='end a game once it has removed this many lines')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--ci', type=float, help='stop once the interval half width is below this many lines')
+    parser.add_argument('--rel-ci', type=float, help='stop once the interval half width is below this part of the mean')
+    parser.add_argument('--min-games', type=int, default=30, help='games played before stopping early')
+    parser.add_argument('--server', help='play the moves of the InferenceServer on this socket, serving theta')
+    parser.add_argument('--output', help='write the summary as JSON to this file')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    summary = evaluate(args.theta, args.games, args.workers, args.depth, args.seed, args.max_lines,
+                       args.confidence, args.ci, args.rel_ci, args.min_games, args.server)
+    summary['theta'] = args.theta
+
+    print("Games: %d Mean: %.3f +- %.3f Std: %.3f Max: %d" % (
+        summary['games'], summary['mean'], summary['ci'] or 0, summary['std'], summary['max']))
+    print("Percentiles:", " ".join("p%d: %.1f" % (p, summary['p%d' % p]) for p in PERCENTILES))
+    print("Pieces: %d Seconds: %.1f Pieces/s: %.1f" % (summary['pieces'], summary['seconds'],
+                                                       summary['pieces_per_sec']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
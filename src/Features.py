@@ -0,0 +1,180 @@
+import collections
+
+import numpy as np
+
+# size and scale take the Geometry, scale is the largest value of the feature in that well
+# func is None for the features computed in the fused pass of FeatureSet.extract
+Extractor = collections.namedtuple('Extractor', ['size', 'scale', 'func'])
+
+# every feature a FeatureSet can select, in the order they are laid out
+EXTRACTORS = collections.OrderedDict()
+
+# number of ones of a row, int.bit_count is much faster where it exists
+popcount = getattr(int, 'bit_count', lambda row: bin(row).count('1'))
+
+
+def register(name, size, scale, func=None):
+    '''
+        Add a feature, func(rows, heights, landing_height, geometry, out) writes its size values into out
+        rows are the bit masks of the rows from the bottom, heights the column heights
+    '''
+    if name in EXTRACTORS:
+        raise Exception("Feature Error: %s registered twice" % name)
+    EXTRACTORS[name] = Extractor(size, scale, func)
+
+
+# the one-hot contour the sparse players use, heights relative to the lowest column
+register('contour', lambda g: g.features_num, lambda g: 1)
+register('heights', lambda g: g.width, lambda g: g.height)
+# empty cells below the top of their column, Board.bad_pos
+register('holes', lambda g: 1, lambda g: g.width * g.game_over_height)
+# sum of the height differences of neighbour columns, Board.var
+register('bumpiness', lambda g: 1, lambda g: (g.width - 1) * g.game_over_height)
+# sum of the depths of the columns lower than both neighbours, the walls count as full columns
+register('wells', lambda g: 1, lambda g: g.width * g.height)
+# filled and empty neighbours in the rows below the top of the stack, the walls count as filled
+register('row_transitions', lambda g: 1, lambda g: (g.width + 1) * g.game_over_height)
+# filled and empty neighbours in the columns, the floor counts as filled
+register('col_transitions', lambda g: 1, lambda g: g.width * (g.game_over_height + 1))
+# middle height of the last piece placed
+register('landing_height', lambda g: 1, lambda g: g.height)
+
+
+class FeatureSet(object):
+    '''
+        The features of names for the wells of geometry, laid out one after the other.
+        extract computes all the built-in ones together in one pass over the rows and
+        one over the columns, so selecting more of them adds little to a move.
+        With normalize every feature is divided by its scale, for the players.
+    '''
+
+    def __init__(self, names, geometry, normalize=False):
+        self.names = list(names)
+        self.geometry = geometry
+        self.normalize = normalize
+        self.offsets = {}
+        self.size = 0
+        scales = []
+        for name in self.names:
+            if name not in EXTRACTORS:
+                raise Exception("Feature Error: unknown feature %s" % name)
+            extractor = EXTRACTORS[name]
+            self.offsets[name] = self.size
+            self.size += extractor.size(geometry)
+            scales += [1 / extractor.scale(geometry)] * extractor.size(geometry)
+        self.scales = np.array(scales)
+        self.custom = [(self.offsets[name], EXTRACTORS[name]) for name in self.names
+                       if EXTRACTORS[name].func is not None]
+
+        # offset of every built-in feature, -1 when not selected
+        self.contour = self.offsets.get('contour', -1)
+        self.heights = self.offsets.get('heights', -1)
+        self.holes = self.offsets.get('holes', -1)
+        self.bumpiness = self.offsets.get('bumpiness', -1)
+        self.wells = self.offsets.get('wells', -1)
+        self.row_transitions = self.offsets.get('row_transitions', -1)
+        self.col_transitions = self.offsets.get('col_transitions', -1)
+        self.landing_height = self.offsets.get('landing_height', -1)
+        self.scan_rows = self.holes >= 0 or self.row_transitions >= 0 or self.col_transitions >= 0
+        self.scan_columns = self.bumpiness >= 0 or self.wells >= 0
+
+    def __repr__(self):
+        return "FeatureSet(%s)" % ','.join(self.names)
+
+    def size_of(self, name):
+        return EXTRACTORS[name].size(self.geometry)
+
+    def get_empty(self):
+        # values of the empty well
+        geometry = self.geometry
+        return self.extract([0] * geometry.height, [0] * geometry.width, 0)
+
+    def extract(self, rows, heights, landing_height, out=None):
+        '''
+            Write the features into out, a new array when None, and return it
+        '''
+        if out is None:
+            out = np.zeros(self.size)
+        geometry = self.geometry
+        width = geometry.width
+
+        if self.scan_rows:
+            top = max(heights)
+            filled = 0
+            row_transitions = 0
+            col_transitions = 0
+            # the walls left and right of a row shifted one bit up
+            walls = 1 | 1 << (width + 1)
+            mask = (1 << (width + 1)) - 1
+            below = geometry.full_row
+            for y in range(top):
+                row = rows[y]
+                filled += popcount(row)
+                col_transitions += popcount(row ^ below)
+                below = row
+                row = row << 1 | walls
+                row_transitions += popcount((row ^ row >> 1) & mask)
+            # the top filled cells against the empty row above the stack
+            col_transitions += popcount(below)
+            if self.holes >= 0:
+                out[self.holes] = sum(heights) - filled
+            if self.row_transitions >= 0:
+                out[self.row_transitions] = row_transitions
+            if self.col_transitions >= 0:
+                out[self.col_transitions] = col_transitions
+
+        if self.scan_columns:
+            bumpiness = 0
+            wells = 0
+            left = geometry.height
+            for x in range(width):
+                h = heights[x]
+                right = heights[x + 1] if x + 1 < width else geometry.height
+                depth = min(left, right) - h
+                if depth > 0:
+                    wells += depth
+                if x:
+                    bumpiness += abs(h - left)
+                left = h
+            if self.bumpiness >= 0:
+                out[self.bumpiness] = bumpiness
+            if self.wells >= 0:
+                out[self.wells] = wells
+
+        if self.heights >= 0:
+            out[self.heights:self.heights + width] = heights
+        if self.contour >= 0:
+            contour = out[self.contour:self.contour + geometry.features_num]
+            contour[:] = 0
+            contour[geometry.feature_offset + heights - min(heights)] = 1
+        if self.landing_height >= 0:
+            out[self.landing_height] = landing_height
+
+        for offset, extractor in self.custom:
+            extractor.func(rows, heights, landing_height, geometry, out[offset:offset + extractor.size(geometry)])
+
+        if self.normalize:
+            out *= self.scales
+        return out
+
+
+def get_reward_set(weights, geometry):
+    '''
+        weights maps 'lines' and feature names to their weight in a reward, as Board.set_reward takes them
+        return (FeatureSet, weight of every value) of the weighted features, (None, None) when they
+        are only holes and bumpiness, which every board keeps up to date itself
+    '''
+    names = [name for name in weights if name != 'lines']
+    if set(names) <= {'holes', 'bumpiness'}:
+        return None, None
+    feature_set = FeatureSet(names, geometry)
+    vector = np.zeros(feature_set.size)
+    for name in names:
+        offset = feature_set.offsets[name]
+        vector[offset:offset + feature_set.size_of(name)] = weights[name]
+    return feature_set, vector
+
+
+def get_names(names):
+    # feature names given as a comma separated string
+    return [name.strip() for name in names.split(',') if name.strip()]
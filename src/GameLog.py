@@ -0,0 +1,190 @@
+'''
+    Game log format, version 1
+
+    <log>           MAGIC, version, snapshot interval, board height and width as 4 uint32,
+                    then one little endian uint16 per move:
+                    piece 3 bits | rotation 2 bits | x 4 bits | removed lines 3 bits | game over 1 bit
+    <log>.snap      one SNAPSHOT record every interval moves, the board before that move
+
+    Moves are only appended, so the log of a game that is still running can be
+    replayed up to the last flushed chunk.
+'''
+
+import os
+import struct
+import sys
+
+import numpy as np
+
+from Board import Board
+
+MAGIC = b'TETRLOG\x01'
+VERSION = 1
+HEADER = struct.Struct('<IIII')
+SNAPSHOT_INTERVAL = 1024
+# moves buffered before they are written
+CHUNK = 4096
+
+
+def get_snapshot_dtype(height, width):
+    return np.dtype([('game', '<u4'), ('lines', '<u4'), ('pieces', '<u4'), ('board', 'u1', (height, width))])
+
+
+# snapshot of the default board
+SNAPSHOT = get_snapshot_dtype(Board.BOARD_HEIGHT, Board.BOARD_WIDTH)
+
+
+def encode(piece, rotation, x, lines, game_over):
+    return piece | rotation << 3 | x << 5 | lines << 9 | game_over << 12
+
+
+def decode(move):
+    '''
+        return (piece, rotation, x, lines, game over), works on arrays of moves too
+    '''
+    return move & 7, move >> 3 & 3, move >> 5 & 15, move >> 9 & 7, move >> 12 & 1
+
+
+def get_snapshot_name(file_name):
+    return file_name + '.snap'
+
+
+class GameLogWriter(object):
+    '''
+        Appends the moves of a board to a new log.
+        add is called after every drop, the log starts on an empty board.
+    '''
+
+    def __init__(self, file_name, interval=SNAPSHOT_INTERVAL, geometry=None):
+        geometry = geometry or Board.GEOMETRY
+        # x has 4 bits in a move
+        if geometry.width > 16:
+            raise Exception("Game Log Board Error: width %d" % geometry.width)
+        self.interval = interval
+        self.file = open(file_name, 'wb')
+        self.file.write(MAGIC)
+        self.file.write(HEADER.pack(VERSION, interval, geometry.height, geometry.width))
+        self.snapshot_file = open(get_snapshot_name(file_name), 'wb')
+
+        self.chunk = np.zeros(CHUNK, '<u2')
+        self.pos = 0
+        self.moves = 0
+        self.games = 0
+        self.snapshot = np.zeros(1, get_snapshot_dtype(geometry.height, geometry.width))
+        self.write_snapshot(None)
+
+    def add(self, board, piece, rotation, x, lines, game_over):
+        self.chunk[self.pos] = encode(piece, rotation, x, lines, game_over)
+        self.pos += 1
+        if self.pos == CHUNK:
+            self.flush_moves()
+
+        self.moves += 1
+        if game_over:
+            self.games += 1
+        if self.moves % self.interval == 0:
+            self.write_snapshot(None if game_over else board)
+
+    def write_snapshot(self, board):
+        # board None is the empty board a new game starts from
+        snapshot = self.snapshot[0]
+        snapshot['game'] = self.games
+        if board is None:
+            snapshot['lines'] = snapshot['pieces'] = 0
+            snapshot['board'] = 0
+        else:
+            snapshot['lines'] = board.cur_removed_lines
+            snapshot['pieces'] = board.cur_pieces
+            snapshot['board'] = board.board
+        self.snapshot_file.write(self.snapshot.tobytes())
+
+    def flush_moves(self):
+        self.file.write(self.chunk[:self.pos].tobytes())
+        self.pos = 0
+
+    def flush(self):
+        self.flush_moves()
+        self.file.flush()
+        self.snapshot_file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        self.snapshot_file.close()
+
+
+class GameLog(object):
+    '''
+        Reads a log through memory maps, so logs of any length are replayed in constant memory.
+        seek restores a board to any move from the snapshot before it.
+    '''
+
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception("Game Log Error: %s" % file_name)
+            version, self.interval, self.height, self.width = HEADER.unpack(f.read(HEADER.size))
+        if version > VERSION:
+            raise Exception("Game Log Version Error: %d" % version)
+
+        offset = len(MAGIC) + HEADER.size
+        self.moves = map_file(file_name, np.dtype('<u2'), offset)
+        self.snapshots = map_file(get_snapshot_name(file_name), get_snapshot_dtype(self.height, self.width), 0)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def get_move(self, n):
+        return decode(int(self.moves[n]))
+
+    def get_game(self, n):
+        # index of the game move n belongs to
+        k = self.get_snapshot_index(n)
+        return int(self.snapshots[k]['game']) + int(np.sum(self.moves[k * self.interval:n] >> 12 & 1))
+
+    def get_snapshot_index(self, n):
+        return min(n // self.interval, len(self.snapshots) - 1)
+
+    def seek(self, board, n):
+        '''
+            Set board to the position before move n, replaying at most interval moves
+        '''
+        if (board.geometry.height, board.geometry.width) != (self.height, self.width):
+            raise Exception("Game Log Board Error: %dx%d" % (self.height, self.width))
+        k = self.get_snapshot_index(n)
+        snapshot = self.snapshots[k]
+        board.load_board(snapshot['board'], int(snapshot['lines']), int(snapshot['pieces']))
+        for i in range(k * self.interval, n):
+            piece, rotation, x, lines, game_over = self.get_move(i)
+            if game_over:
+                board.init()
+            else:
+                board.drop(piece, rotation, x)
+
+    def get_summary(self):
+        # removed lines of every finished game, reading a chunk at a time
+        ends = []
+        total = 0
+        for start in range(0, len(self.moves), CHUNK):
+            piece, rotation, x, lines, game_over = decode(self.moves[start:start + CHUNK].astype(np.int))
+            cumulative = np.cumsum(lines) + total
+            ends.extend(cumulative[game_over == 1].tolist())
+            total = int(cumulative[-1])
+        return np.diff([0] + ends)
+
+
+def map_file(file_name, dtype, offset):
+    count = (os.path.getsize(file_name) - offset) // dtype.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype)
+    return np.memmap(file_name, dtype, 'r', offset, (count,))
+
+
+if __name__ == '__main__':
+    log = GameLog(sys.argv[1])
+    lines = log.get_summary()
+    print("Moves: %d Games: %d" % (len(log), len(lines)))
+    if len(lines):
+        print("Max: %d Avg: %.3f" % (np.max(lines), np.mean(lines)))
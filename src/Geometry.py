@@ -0,0 +1,97 @@
+import numpy as np
+
+from Shape import Shape, get_placements
+
+
+class Geometry(object):
+    '''
+        Size of a well and the tables that depend on it: the placements of every
+        (piece, rotation, x), the contour feature layout and the theta shape.
+        Geometry.get returns one cached instance per size, so every board and
+        player of a size shares the same tables.
+
+        Placement table, one entry for every (piece, rotation, x) in actions.
+        Rows are counted up from the lowest row of the piece, so a piece dropped
+        on column heights h lands with its lowest row at max(h[cols] - skirt).
+        placements[p][r][x] = (cols, skirt, top, row_masks, row_counts, cells)
+          cols: absolute columns covered, skirt: lowest cell in each column,
+          top: column height inside the piece, row_masks/row_counts: bit mask
+          and number of cells of each row, cells: (up, x) of the four points
+        placement_y/placement_x hold the cells as arrays indexed by placement_index
+    '''
+    CACHE = {}
+    # built on first use, so importing the engine does not pay for them
+    TABLES = ('actions', 'placements', 'placement_index', 'placement_y', 'placement_x',
+              'invalid_q', 'action_count', 'action_total', 'next_action_total')
+
+    # added to the action values of every (shape, rotation, x) outside the well
+    MIN_Q = -(10 ** 10)
+
+    def __init__(self, width, height, game_over_height):
+        # a vertical line dropped on a column at game over height must still fit
+        if width < Shape.MAX_POINT or game_over_height < 1 or height < game_over_height + Shape.MAX_POINT:
+            raise Exception("Geometry Error: %dx%d game over %d" % (width, height, game_over_height))
+        self.width = width
+        self.height = height
+        self.game_over_height = game_over_height
+
+        self.full_row = (1 << width) - 1
+        # start of the one-hot block of each column in the feature vector
+        self.feature_offset = np.arange(width) * (game_over_height + 1)
+        self.features_num = width * (game_over_height + 1)
+        self.theta_shape = (Shape.MAX_SHAPE, Shape.MAX_SUB_SHAPE, width, self.features_num)
+        # board_m row i holds i in every column
+        self.full_board_m = np.repeat(np.arange(height + 1)[:, None], width, axis=1)
+
+    def __getattr__(self, name):
+        # only called while the tables are not built yet
+        if name not in Geometry.TABLES:
+            raise AttributeError(name)
+        self.build_tables()
+        return self.__dict__[name]
+
+    def build_tables(self):
+        width = self.width
+        self.actions = Shape.get_width_actions(width)
+        self.placements, self.placement_index, self.placement_y, self.placement_x = \
+            get_placements(Shape.SHAPE_TABLE, self.actions, width)
+
+        self.invalid_q = np.where(self.placement_index >= 0, 0, Geometry.MIN_Q).reshape(Shape.MAX_SHAPE, -1)
+        # number of x for every (shape, rotation), used to draw random actions in batch
+        self.action_count = np.sum(self.placement_index >= 0, axis=2)
+        self.action_total = np.sum(self.action_count, axis=1)
+        self.next_action_total = int(np.sum(self.action_total[1:Shape.MAX_SHAPE]))
+
+    def __repr__(self):
+        return "Geometry(%d, %d, %d)" % self.get_key()
+
+    def get_key(self):
+        return self.width, self.height, self.game_over_height
+
+    @staticmethod
+    def get(width=Shape.MAX_WIDTH, height=20, game_over_height=16):
+        key = (width, height, game_over_height)
+        if key not in Geometry.CACHE:
+            Geometry.CACHE[key] = Geometry(width, height, game_over_height)
+        return Geometry.CACHE[key]
+
+    @staticmethod
+    def is_contour(shape):
+        # whether the features of a theta of shape can be the contour of a well, width * (game_over_height + 1)
+        width = shape[2]
+        return width >= Shape.MAX_POINT and shape[3] % width == 0 and shape[3] // width > 1
+
+    @staticmethod
+    def from_theta(shape, height=None):
+        '''
+            Geometry of a theta of shape, theta does not depend on the height of the well,
+            when height is None the well keeps the default room above the game over height
+        '''
+        width = shape[2]
+        game_over_height = shape[3] // width - 1
+        if height is None:
+            height = game_over_height + Geometry.DEFAULT.height - Geometry.DEFAULT.game_over_height
+        return Geometry.get(width, height, game_over_height)
+
+
+Geometry.DEFAULT = Geometry.get()
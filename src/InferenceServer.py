@@ -0,0 +1,469 @@
+'''
+    Inference protocol, version 1, all little endian
+
+    hello       server to client on connect: MAGIC, width, height and game over height as 3 uint32
+    request     request id uint32, piece uint8, encoding uint8, then
+                    CONTOUR     width uint8, the column heights
+                    ROWS        height uint16, the bit masks of the rows from the bottom
+    response    request id uint32, rotation uint8, x uint8, value float64
+                rotation is ERROR when the request could not be scored
+
+    Responses of one connection may come back in any order, a client matches them by id.
+    Players of a FeatureSet other than the contour need the ROWS encoding, the requests
+    carry no landing height so FeatureSets using it are not served.
+'''
+
+import argparse
+import os
+import selectors
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from LinearQLearning import QLearnPlayer
+from Shape import Shape
+
+MAGIC = b'TETRINF\x01'
+HELLO = struct.Struct('<III')
+REQUEST = struct.Struct('<IBB')
+RESPONSE = struct.Struct('<IBBd')
+CONTOUR = 0
+ROWS = 1
+ERROR = 255
+# bytes of responses a client may leave unread before it is dropped
+MAX_OUTPUT = 1 << 24
+
+
+class Connection(object):
+    '''
+        One client, a socket or the pair of stdin and stdout file descriptors.
+        The descriptors are non-blocking, write keeps what the client cannot take yet
+        in output and flush sends it once the descriptor is writable again.
+    '''
+
+    def __init__(self, read_fd, write_fd, sock=None):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.sock = sock
+        self.buffer = bytearray()
+        self.output = bytearray()
+        self.closed = False
+        if sock is not None:
+            sock.setblocking(False)
+        else:
+            os.set_blocking(read_fd, False)
+            os.set_blocking(write_fd, False)
+
+    def read(self):
+        # return the bytes received, None when nothing is ready yet
+        try:
+            if self.sock is not None:
+                return self.sock.recv(1 << 16)
+            return os.read(self.read_fd, 1 << 16)
+        except BlockingIOError:
+            return None
+
+    def write(self, data):
+        if self.closed:
+            return
+        self.output += data
+        self.flush()
+
+    def flush(self):
+        # send as much of output as the client takes now
+        while self.output:
+            try:
+                if self.sock is not None:
+                    sent = self.sock.send(self.output)
+                else:
+                    sent = os.write(self.write_fd, self.output)
+            except BlockingIOError:
+                return
+            del self.output[:sent]
+
+    def close(self):
+        self.closed = True
+        self.output = bytearray()
+        if self.sock is not None:
+            self.sock.close()
+
+
+class InferenceServer(object):
+    '''
+        Serves the moves of one theta to many clients.
+        Requests are collected until max_batch are waiting, every client has one waiting or
+        the oldest has waited delay seconds, then scored together with QLearnPlayer.get_values.
+        The theta file is checked every reload_interval seconds and loaded again when it
+        was replaced, e.g. by CheckpointWriter, clients keep their connections.
+    '''
+
+    def __init__(self, theta_file, max_batch=256, delay=0.002, reload_interval=1.0):
+        self.theta_file = theta_file
+        self.max_batch = max_batch
+        self.delay = delay
+        self.reload_interval = reload_interval
+
+        self.player = None
+        self.theta_stat = None
+        self.load()
+        self.geometry = self.player.geometry
+        self.last_check = time.time()
+
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        # (connection, request id, piece, encoding, payload) waiting to be scored
+        self.pending = []
+        # connections with a request in pending
+        self.waiting = set()
+        self.connections = 0
+        self.deadline = None
+        self.running = False
+
+        self.requests = 0
+        self.batches = 0
+        self.reloads = 0
+
+    def load(self):
+        stat = os.stat(self.theta_file)
+        player = QLearnPlayer()
+        player.set_sparse(True)
+        player.load_theta(self.theta_file, mmap=True)
+        player.set_debug(player.DEBUG_LEVEL0, False)
+        if player.feature_set is not None and 'landing_height' in player.feature_set.names:
+            raise Exception("Inference Error: %s needs the landing height" % player.feature_set)
+        # a file that fails is not tried again until it is replaced
+        self.theta_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self.player is not None and player.geometry is not self.geometry:
+            raise Exception("Inference Error: %s changed to %s" % (self.geometry, player.geometry))
+        self.player = player
+
+    def check_reload(self):
+        self.last_check = time.time()
+        try:
+            stat = os.stat(self.theta_file)
+            if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.theta_stat:
+                self.load()
+                self.reloads += 1
+        except Exception as e:
+            # keep serving the theta already loaded
+            print("Reload failed:", e, file=sys.stderr)
+
+    def serve_unix(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(64)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        try:
+            self.run()
+        finally:
+            self.listener.close()
+            os.remove(path)
+
+    def serve_pipe(self, read_fd=0, write_fd=1):
+        # one client talking through a pair of pipes, e.g. the stdin and stdout of a subprocess
+        self.add_connection(Connection(read_fd, write_fd))
+        self.run()
+
+    def add_connection(self, connection):
+        self.selector.register(connection.read_fd, selectors.EVENT_READ, connection)
+        self.connections += 1
+        geometry = self.geometry
+        self.write(connection, MAGIC + HELLO.pack(geometry.width, geometry.height, geometry.game_over_height))
+
+    def write(self, connection, data):
+        # never waits for the client, what it does not take is sent when select finds it writable
+        try:
+            connection.write(data)
+        except OSError:
+            # the client left
+            self.drop(connection)
+            return
+        if len(connection.output) > MAX_OUTPUT:
+            print("Client dropped: %d bytes of responses unread" % len(connection.output), file=sys.stderr)
+            self.drop(connection)
+            return
+        self.set_writing(connection, bool(connection.output))
+
+    def set_writing(self, connection, writing):
+        if connection.closed:
+            return
+        if connection.write_fd == connection.read_fd:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            if self.selector.get_key(connection.read_fd).events != events:
+                self.selector.modify(connection.read_fd, events, connection)
+        elif writing and connection.write_fd not in self.selector.get_map():
+            self.selector.register(connection.write_fd, selectors.EVENT_WRITE, connection)
+        elif not writing and connection.write_fd in self.selector.get_map():
+            self.selector.unregister(connection.write_fd)
+
+    def drop(self, connection):
+        if connection.closed:
+            return
+        self.set_writing(connection, False)
+        self.selector.unregister(connection.read_fd)
+        self.connections -= 1
+        self.waiting.discard(connection)
+        connection.close()
+        if connection.sock is None:
+            # the pipe of the only client is closed
+            self.running = False
+
+    def run(self):
+        self.running = True
+        while self.running:
+            now = time.time()
+            timeout = max(self.last_check + self.reload_interval - now, 0)
+            if self.pending:
+                timeout = min(timeout, max(self.deadline - now, 0))
+            for key, mask in self.selector.select(timeout):
+                connection = key.data
+                if connection is None:
+                    sock, address = self.listener.accept()
+                    self.add_connection(Connection(sock.fileno(), sock.fileno(), sock))
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self.write(connection, b'')
+                if mask & selectors.EVENT_READ and not connection.closed:
+                    self.receive(connection)
+
+            # no need to wait for more once every client has a request waiting
+            if self.pending and (len(self.pending) >= self.max_batch or len(self.waiting) >= self.connections
+                                 or time.time() >= self.deadline):
+                self.score()
+            if time.time() - self.last_check >= self.reload_interval:
+                self.check_reload()
+
+    def receive(self, connection):
+        try:
+            data = connection.read()
+        except OSError:
+            data = b''
+        if data is None:
+            return
+        if not data:
+            self.drop(connection)
+            return
+        connection.buffer += data
+        while not connection.closed and self.parse(connection):
+            if len(self.pending) >= self.max_batch:
+                self.score()
+
+    def parse(self, connection):
+        '''
+            Move the first complete request of connection to pending
+            return false when the buffer holds no complete request
+        '''
+        buffer = connection.buffer
+        if len(buffer) < REQUEST.size:
+            return False
+        request_id, piece, encoding = REQUEST.unpack_from(buffer)
+        geometry = self.geometry
+        if encoding == CONTOUR:
+            size = geometry.width
+        elif encoding == ROWS:
+            size = geometry.height * 2
+        else:
+            # the rest of the stream cannot be framed
+            self.write(connection, RESPONSE.pack(request_id, ERROR, 0, 0))
+            del buffer[:]
+            return False
+        if len(buffer) < REQUEST.size + size:
+            return False
+        payload = bytes(buffer[REQUEST.size:REQUEST.size + size])
+        del buffer[:REQUEST.size + size]
+
+        # a FeatureSet needs the holes the contour does not show
+        if not 0 < piece < Shape.MAX_SHAPE or (encoding == CONTOUR and self.player.feature_set is not None):
+            self.write(connection, RESPONSE.pack(request_id, ERROR, 0, 0))
+            return True
+        if not self.pending:
+            self.deadline = time.time() + self.delay
+        self.pending.append((connection, request_id, piece, encoding, payload))
+        self.waiting.add(connection)
+        return True
+
+    def get_status(self, batch):
+        # the status the player reads for every request of batch, computed together
+        geometry = self.geometry
+        feature_set = self.player.feature_set
+        contour = np.array([request[3] == CONTOUR for request in batch])
+        heights = np.zeros((len(batch), geometry.width), np.int)
+        if np.any(contour):
+            heights[contour] = np.frombuffer(b''.join(request[4] for request in batch if request[3] == CONTOUR),
+                                             np.uint8).reshape(-1, geometry.width)
+        rows = None
+        if not np.all(contour):
+            rows = np.frombuffer(b''.join(request[4] for request in batch if request[3] == ROWS),
+                                 '<u2').reshape(-1, geometry.height)
+            heights[~contour] = get_heights(rows, geometry.width)
+
+        if feature_set is None:
+            return geometry.feature_offset + heights - np.min(heights, axis=1, keepdims=True)
+        status = np.zeros((len(batch), feature_set.size))
+        # load refuses the FeatureSets that read the landing height
+        for i in range(len(batch)):
+            feature_set.extract(rows[i].tolist(), heights[i].tolist(), 0, status[i])
+        return status
+
+    def score(self):
+        batch = self.pending
+        self.pending = []
+        self.waiting.clear()
+        pieces = np.array([request[2] for request in batch])
+        q = self.player.get_values(self.get_status(batch), pieces)
+        actions = np.argmax(q, axis=1)
+        values = q[np.arange(len(batch)), actions]
+        rotations, xs = np.divmod(actions, self.geometry.width)
+
+        responses = {}
+        for i in range(len(batch)):
+            connection, request_id = batch[i][0], batch[i][1]
+            data = RESPONSE.pack(request_id, int(rotations[i]), int(xs[i]), float(values[i]))
+            responses.setdefault(connection, []).append(data)
+        for connection, data in responses.items():
+            self.write(connection, b''.join(data))
+        self.requests += len(batch)
+        self.batches += 1
+
+
+def get_heights(rows, width):
+    # column heights of a batch of rows, as VecBoard computes them
+    bits = (rows[:, ::-1, None].astype(np.int) >> np.arange(width)) & 1
+    return np.where(np.any(bits, axis=1), rows.shape[1] - np.argmax(bits, axis=1), 0)
+
+
+class InferenceClient(object):
+    '''
+        Client of an InferenceServer listening on path, or of one started on the pipes
+        of a subprocess with spawn. select_actions sends all its requests before reading
+        the responses, so they reach the server in one batch.
+    '''
+
+    def __init__(self, path=None, process=None):
+        self.sock = None
+        self.process = process
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+            self.file = self.sock.makefile('rwb')
+        else:
+            self.file = None
+        self.next_id = 0
+
+        magic = self.read(len(MAGIC))
+        if magic != MAGIC:
+            raise Exception("Inference Error: bad hello")
+        self.width, self.height, self.game_over_height = HELLO.unpack(self.read(HELLO.size))
+
+    @staticmethod
+    def spawn(theta_file, *args):
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), theta_file, '--stdio'] + list(args),
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return InferenceClient(process=process)
+
+    def read(self, size):
+        data = (self.file or self.process.stdout).read(size)
+        if len(data) != size:
+            raise Exception("Inference Error: connection closed")
+        return data
+
+    def write(self, data):
+        out = self.file or self.process.stdin
+        out.write(data)
+        out.flush()
+
+    def encode(self, piece, heights=None, rows=None):
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xffffffff
+        if rows is not None:
+            return request_id, REQUEST.pack(request_id, piece, ROWS) + np.asarray(rows, '<u2').tobytes()
+        return request_id, REQUEST.pack(request_id, piece, CONTOUR) + np.asarray(heights, np.uint8).tobytes()
+
+    def select_actions(self, requests):
+        '''
+            requests are (piece, heights, rows) with heights or rows None
+            return [(rotation, x, value)] in the order of requests, None for the failed ones
+        '''
+        ids = []
+        data = []
+        for piece, heights, rows in requests:
+            request_id, encoded = self.encode(piece, heights, rows)
+            ids.append(request_id)
+            data.append(encoded)
+        self.write(b''.join(data))
+
+        results = {}
+        while len(results) < len(ids):
+            request_id, rotation, x, value = RESPONSE.unpack(self.read(RESPONSE.size))
+            results[request_id] = None if rotation == ERROR else (rotation, x, value)
+        return [results[request_id] for request_id in ids]
+
+    def select_action(self, piece, heights=None, rows=None):
+        return self.select_actions([(piece, heights, rows)])[0]
+
+    def close(self):
+        if self.sock is not None:
+            self.file.close()
+            self.sock.close()
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class RemotePlayer(object):
+    '''
+        Plays the moves of an InferenceClient through Board.play_game, without learning
+    '''
+
+    def __init__(self, client, feature_offset):
+        self.client = client
+        self.feature_offset = feature_offset
+        self.feature_set = None
+        self.evaluated = 0
+
+    def select_action(self, feature, shape):
+        # the contour indices minus the column offsets are the heights above the lowest column
+        result = self.client.select_action(shape.get_shape(), heights=feature - self.feature_offset)
+        if result is None:
+            raise Exception("Inference Error: request failed")
+        self.evaluated += 1
+        return result[0], result[1]
+
+    def update(self, new_status, reward, p_shape=None):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the moves of a theta file to local clients')
+    parser.add_argument('theta', help='theta file, loaded again whenever it is replaced')
+    parser.add_argument('--socket', help='Unix domain socket to listen on')
+    parser.add_argument('--stdio', action='store_true', help='serve one client on stdin and stdout')
+    parser.add_argument('--max-batch', type=int, default=256, help='requests scored together at most')
+    parser.add_argument('--delay', type=float, default=0.002, help='seconds a request waits for a fuller batch')
+    parser.add_argument('--reload-interval', type=float, default=1.0, help='seconds between two theta file checks')
+    args = parser.parse_args(argv)
+    if (args.socket is None) == (not args.stdio):
+        parser.error('give either --socket or --stdio')
+
+    server = InferenceServer(args.theta, args.max_batch, args.delay, args.reload_interval)
+    try:
+        if args.stdio:
+            server.serve_pipe()
+        else:
+            print("Serving %s on %s" % (args.theta, args.socket), file=sys.stderr)
+            server.serve_unix(args.socket)
+    except KeyboardInterrupt:
+        pass
+    print("Requests: %d Batches: %d Reloads: %d" % (server.requests, server.batches, server.reloads), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
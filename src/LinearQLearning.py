@@ -1,15 +1,44 @@
+import collections
 import pprint
 import random
 
 import numpy as np
-import pickle
 import time
+
+import ThetaFile
+from Features import FeatureSet
+from Geometry import Geometry
 from Shape import Shape
 
 
+def new_theta(shape, buffer=None):
+    '''
+        Zero theta of shape (shape, rotation, x, feature), in buffer when given, stored feature major:
+        the weights of one feature for every (rotation, x) of a shape are contiguous, so the
+        sparse players gather a few rows instead of a few values from every placement
+    '''
+    s_shape, rotations, width, features = shape
+    if buffer is None:
+        storage = np.zeros((s_shape, features, rotations, width), np.float)
+    else:
+        storage = np.frombuffer(buffer, np.float).reshape((s_shape, features, rotations, width))
+    return storage.transpose(0, 2, 3, 1)
+
+
+def get_feature_major(theta):
+    # (shape, feature, rotation * x) view of a theta laid out by new_theta, None for any other layout
+    view = theta.transpose(0, 3, 1, 2)
+    if not view.flags.c_contiguous:
+        return None
+    return view.reshape(view.shape[0], view.shape[1], -1)
+
+
 class QLearnPlayer(object):
     SHAPES = [Shape(i) for i in range(Shape.MAX_SHAPE)]
 
+    # added to the action values of every (shape, rotation, x) outside the well
+    MIN_Q = Geometry.MIN_Q
+
     DEBUG_LEVEL0 = 0
     DEBUG_LEVEL1 = 1
     DEBUG_LEVEL2 = 2
@@ -20,6 +49,10 @@ class QLearnPlayer(object):
         self.gamma = 0.8
         self.epsilon = 0.0002
         self.theta = None
+        # feature major view of theta for the sparse players, None when theta is not laid out by new_theta
+        self.feature_theta = None
+        # well the theta is for, follows the theta given to set_features and load_theta
+        self.geometry = Geometry.DEFAULT
 
         self.cur_status = None
         self.cur_shape = None
@@ -27,20 +60,121 @@ class QLearnPlayer(object):
 
         self.debug = 0
         self.learn = True
+        # features given as the indices of the ones instead of a dense 0/1 vector
+        self.sparse = False
+        # FeatureSet of the dense features the player reads, None for the contour
+        self.feature_set = None
+        # number of (shape, rotation, x) placements scored so far
+        self.evaluated = 0
+
+        # bumped whenever theta changes, the cache only holds values of the current version
+        self.theta_version = 0
+        # LRU cache of (status, shape) -> (best action, value) of a frozen theta, shape 0 holds the expected value
+        self.cache = collections.OrderedDict()
+        self.cache_size = 1 << 16
+        self.cache_version = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # ReplayBuffer, when set update learns from minibatches sampled from it
+        self.replay = None
+        self.replay_batch = 32
+        self.replay_interval = 1
+        self.replay_count = 0
+
+        # Metrics collecting the Q values and TD errors of every update, None when disabled
+        self.metrics = None
 
     def set_features(self, features_num, categories):
-        self.theta = []
-        for c1 in range(categories[0]):
-            self.theta.append([])
-            for c2 in range(categories[1]):
-                self.theta[c1].append([])
-                for c3 in range(categories[2]):
-                    self.theta[c1][c2].append(np.zeros(features_num, np.float))
+        # one weight vector for each (shape, rotation, x)
+        shape = tuple(categories) + (features_num,)
+        self.set_theta(new_theta(shape) if self.sparse else np.zeros(shape, np.float))
+        # other feature counts keep the geometry of the well
+        if self.theta.shape != self.geometry.theta_shape and Geometry.is_contour(self.theta.shape):
+            self.geometry = Geometry.from_theta(self.theta.shape)
+
+    def set_feature_set(self, feature_set):
+        '''
+            Play on the dense features of feature_set instead of the contour, from a zero theta
+        '''
+        self.feature_set = feature_set
+        self.geometry = feature_set.geometry
+        self.sparse = False
+        self.set_theta(np.zeros(self.geometry.theta_shape[:3] + (feature_set.size,), np.float))
+
+    def set_geometry(self, geometry):
+        # the well height is not part of theta, players of other heights than the default set it here
+        if self.theta is not None and self.theta.shape != geometry.theta_shape:
+            raise Exception("Geometry Error: %s for theta %s" % (geometry, self.theta.shape))
+        self.geometry = geometry
+        self.theta_version += 1
+
+    def set_theta(self, theta):
+        # theta is used as it is, e.g. shared between processes
+        self.theta = theta
+        self.feature_theta = get_feature_major(theta) if self.sparse and theta is not None else None
+        self.theta_version += 1
+
+    def set_sparse(self, sparse):
+        self.sparse = sparse
+        theta = self.theta
+        if sparse and theta is not None and get_feature_major(theta) is None and theta.flags.writeable:
+            # copied into the feature major layout, a read-only map is scored as it is
+            theta = new_theta(theta.shape)
+            theta[:] = self.theta
+        self.set_theta(theta)
 
     def set_debug(self, debug, learn):
         self.debug = debug
         self.learn = learn
 
+    def set_replay(self, replay, batch_size=32, interval=1):
+        '''
+            Store every transition in replay and apply one minibatch of batch_size every interval updates
+        '''
+        if not self.sparse:
+            raise Exception("Replay Buffer Error: sparse features only")
+        self.replay = replay
+        self.replay_batch = batch_size
+        self.replay_interval = interval
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+
+    def get_stats(self):
+        return {'evaluated': self.evaluated, 'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+    def set_cache_size(self, cache_size):
+        # 0 disables the cache
+        self.cache_size = cache_size
+        self.cache.clear()
+
+    def get_cached(self, status, p_shape):
+        '''
+            return (key, cached (action, value) or None)
+            a learning player changes theta on every move, so only players with learn off use the cache
+        '''
+        if not self.cache_size or self.learn:
+            return None, None
+        if self.cache_version != self.theta_version:
+            self.cache.clear()
+            self.cache_version = self.theta_version
+        key = (np.asarray(status).tobytes(), p_shape)
+        value = self.cache.get(key)
+        if value is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+        return key, value
+
+    def set_cached(self, key, value):
+        if key is None:
+            return
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
     def select_action(self, feature, shape):
         self.cur_status = feature
         self.cur_shape = shape
@@ -60,37 +194,178 @@ class QLearnPlayer(object):
                 print("Select Action ", self.cur_action, val)
         return self.cur_action
 
+    def get_value(self, theta, status):
+        # theta . status over the last axis of theta
+        if self.sparse:
+            return theta[..., status].sum(axis=-1)
+        return theta.dot(status)
+
+    def get_shape_values(self, p_shapes, status):
+        # values of every (rotation, x) of p_shapes, a shape or a slice of shapes, flattened over (rotation, x)
+        if self.feature_theta is not None:
+            # the rows of the active features, summed
+            return np.add.reduce(self.feature_theta[p_shapes].take(status, axis=-2), axis=-2)
+        theta = self.theta[p_shapes]
+        return self.get_value(theta, status).reshape(theta.shape[:-3] + (-1,))
+
+    def action_values(self, status, p_shape):
+        # values of every (rotation, x) of p_shape, flattened, invalid ones set to MIN_Q
+        self.evaluated += self.geometry.action_total[p_shape]
+        return self.get_shape_values(p_shape, status) + self.geometry.invalid_q[p_shape]
+
     def best_action(self, status, shape):
-        m = -(10 ** 10)
-        result = (0, 0)
-        actions = shape.get_actions()
-
-        for action_1 in range(len(actions)):
-            for action_2 in actions[action_1]:
-                t = np.sum(self.theta[shape.get_shape()][action_1][action_2] * status)
-                if self.debug >= self.DEBUG_LEVEL3:
-                    print(shape.get_name(), action_1, action_2, t)
-                if t > m:
-                    m = t
-                    result = (action_1, action_2)
+        key, cached = self.get_cached(status, shape.get_shape())
+        if cached is not None:
+            return cached
+        q = self.action_values(status, shape.get_shape())
+        best = np.argmax(q)
+        m = q[best]
+        result = divmod(int(best), self.theta.shape[2])
+
         if self.debug >= self.DEBUG_LEVEL3:
+            actions = shape.get_actions()
+            for action_1 in range(len(actions)):
+                for action_2 in actions[action_1]:
+                    print(shape.get_name(), action_1, action_2, q[action_1 * self.theta.shape[2] + action_2])
             print("Best Action:", shape.get_name(), m, result)
 
+        self.set_cached(key, (result, m))
         return result, m
 
+    def expected_value(self, status):
+        # average over the next shapes of the best action value
+        key, cached = self.get_cached(status, 0)
+        if cached is not None:
+            return cached[1]
+        self.evaluated += self.geometry.next_action_total
+        q = self.get_shape_values(slice(1, Shape.MAX_SHAPE), status) + self.geometry.invalid_q[1:Shape.MAX_SHAPE]
+        value = np.mean(np.max(q, axis=1))
+        self.set_cached(key, (None, value))
+        return value
+
+    def get_values(self, status, p_shapes):
+        # action values of a batch, status[i] is the feature of p_shapes[i], result is (batch, actions)
+        theta = self.theta.reshape(self.theta.shape[0], -1, self.theta.shape[-1])
+        self.evaluated += np.sum(self.geometry.action_total[p_shapes])
+        if self.feature_theta is not None:
+            q = np.add.reduce(self.feature_theta[p_shapes[:, None], status], axis=1)
+        elif self.sparse:
+            actions = np.arange(theta.shape[1])
+            q = theta[p_shapes[:, None, None], actions[None, :, None], status[:, None, :]].sum(axis=-1)
+        else:
+            q = np.einsum('naf,nf->na', theta[p_shapes], status)
+        return q + self.geometry.invalid_q[p_shapes]
+
+    def select_actions(self, status, p_shapes):
+        '''
+            Batched select_action for shapes given as an array of piece numbers
+            return (rotations, xs)
+        '''
+        self.cur_status = status
+        self.cur_shape = p_shapes
+        actions = np.argmax(self.get_values(status, p_shapes), axis=1)
+
+        if self.learn and self.epsilon > 0:
+            explore = np.random.random(len(p_shapes)) < self.epsilon
+            if np.any(explore):
+                shapes = p_shapes[explore]
+                a1 = (np.random.random(len(shapes)) * np.take(Shape.SUB, shapes)).astype(np.int)
+                a2 = (np.random.random(len(shapes)) * self.geometry.action_count[shapes, a1]).astype(np.int)
+                actions[explore] = a1 * self.theta.shape[2] + a2
+
+        self.cur_action = actions
+        return np.divmod(actions, self.theta.shape[2])
+
+    def update_batch(self, new_status, reward, done, p_shapes=None):
+        '''
+            Batched update after select_actions, the next value of the finished games is 0
+            p_shapes None means the average over all the next shapes
+        '''
+        if not self.learn:
+            return
+        if not self.theta.flags.writeable:
+            raise Exception("Theta Error: read-only theta, load it without mmap to learn")
+        self.td_update(self.cur_status, self.cur_shape, self.cur_action, new_status, reward, done, p_shapes)
+
+    def td_update(self, status, shapes, actions, new_status, reward, done, p_shapes=None):
+        '''
+            One TD step for every transition of a batch, actions are flattened as rotation * width + x
+            next shape 0 means the average over all the next shapes
+        '''
+        theta = self.theta.reshape(self.theta.shape[0], -1, self.theta.shape[-1])
+        feature_theta = self.feature_theta
+        if feature_theta is not None:
+            this_q = feature_theta[shapes[:, None], status, actions[:, None]].sum(axis=-1)
+        elif self.sparse:
+            this_q = theta[shapes[:, None], actions[:, None], status].sum(axis=-1)
+        else:
+            this_q = np.einsum('nf,nf->n', theta[shapes, actions], status)
+
+        if p_shapes is None:
+            p_shapes = np.zeros(len(shapes), np.int)
+        next_q = np.zeros(len(shapes))
+        given = p_shapes > 0
+        if np.any(given):
+            next_q[given] = np.max(self.get_values(new_status[given], p_shapes[given]), axis=1)
+        if not np.all(given):
+            expected = ~given
+            for p_shape in range(1, Shape.MAX_SHAPE):
+                next_q[expected] += np.max(self.get_values(new_status[expected],
+                                                           np.full(np.sum(expected), p_shape)), axis=1)
+            next_q[expected] /= (Shape.MAX_SHAPE - 1)
+        next_q[done] = 0
+
+        td_error = reward + self.gamma * next_q - this_q
+        if self.metrics is not None:
+            self.metrics.add_q_batch(this_q, td_error)
+        t = self.alpha * td_error
+        if feature_theta is not None:
+            np.add.at(feature_theta, (shapes[:, None], status, actions[:, None]), t[:, None])
+        elif self.sparse:
+            np.add.at(theta, (shapes[:, None], actions[:, None], status), t[:, None])
+        else:
+            np.add.at(theta, (shapes, actions), status * t[:, None])
+        self.theta_version += 1
+
     def save_theta(self, file_name=None):
         if file_name is None:
             file_name = "theta_%f_%f_%f__" % (self.gamma, self.alpha, self.epsilon) + time.strftime("%Y_%b_%d_%H_%M_%S")
-        with open("theta.save", 'wb') as f:
-            pickle.dump(self.theta, f)
-        with open(file_name, 'wb') as f:
-            pickle.dump(self.theta, f)
+        ThetaFile.save_atomic("theta.save", self.theta, self.get_meta())
+        ThetaFile.save_atomic(file_name, self.theta, self.get_meta())
 
-    def load_theta(self, file_name=None):
+    def get_meta(self):
+        # hyperparameters recorded in the theta file header
+        meta = {'alpha': self.alpha, 'gamma': self.gamma, 'epsilon': self.epsilon, 'board_height': self.geometry.height}
+        if self.feature_set is not None:
+            meta.update({'features': self.feature_set.names, 'normalize': self.feature_set.normalize,
+                         'game_over_height': self.geometry.game_over_height})
+        return meta
+
+    def load_theta(self, file_name=None, mmap=False):
+        '''
+            Load a theta file, or a theta pickled by older versions
+            with mmap the theta is a read-only map of the file, for players that do not learn
+        '''
         if file_name is None:
             file_name = "theta.save"
-        with open(file_name, 'rb') as f:
-            self.theta = pickle.load(f)
+        header = {}
+        if ThetaFile.is_theta_file(file_name):
+            theta, header = ThetaFile.load(file_name, mmap)
+        else:
+            theta = ThetaFile.load_pickle(file_name)
+        if 'features' in header:
+            self.feature_set = FeatureSet(header['features'], Geometry.get(
+                header['board_width'], header['board_height'], header['game_over_height']), header['normalize'])
+            self.geometry = self.feature_set.geometry
+            self.sparse = False
+            self.set_theta(theta)
+            return
+        self.feature_set = None
+        self.theta = theta
+        if self.theta.shape != self.geometry.theta_shape or 'board_height' in header:
+            self.geometry = Geometry.from_theta(self.theta.shape, header.get('board_height'))
+        # lays theta out for the sparse players
+        self.set_sparse(self.sparse)
 
     def update(self, new_status, reward, p_shape=None):
         if self.debug >= self.DEBUG_LEVEL1:
@@ -99,42 +374,69 @@ class QLearnPlayer(object):
 
         if not self.learn:
             return
+        if not self.theta.flags.writeable:
+            raise Exception("Theta Error: read-only theta, load it without mmap to learn")
 
-        this_q = np.sum(self.theta[self.cur_shape.get_shape()][self.cur_action[0]][self.cur_action[1]]
-                        * self.cur_status)
-        next_q = 0
+        if self.replay is not None:
+            self.replay.add(self.cur_status, self.cur_shape.get_shape(),
+                            self.cur_action[0] * self.theta.shape[2] + self.cur_action[1],
+                            new_status, reward, 0 if p_shape is None else p_shape.get_shape())
+            self.replay_count += 1
+            if self.replay_count % self.replay_interval == 0 and len(self.replay) >= self.replay_batch:
+                self.td_update(*self.replay.sample(self.replay_batch))
+            return
+
+        cur_piece = self.cur_shape.get_shape()
+        feature_theta = self.feature_theta
+        if feature_theta is not None:
+            action = self.cur_action[0] * self.theta.shape[2] + self.cur_action[1]
+            this_q = feature_theta[cur_piece, self.cur_status, action].sum()
+        else:
+            this_q = self.get_value(self.theta[cur_piece, self.cur_action[0], self.cur_action[1]], self.cur_status)
 
         if p_shape is None:
-            for p_shape in range(1, Shape.MAX_SHAPE):
-                next_action, max_q = self.best_action(new_status, QLearnPlayer.SHAPES[p_shape])
-                next_q += max_q
-            next_q /= (Shape.MAX_SHAPE - 1)
+            next_q = self.expected_value(new_status)
         else:
             next_action, next_q = self.best_action(new_status, QLearnPlayer.SHAPES[p_shape.get_shape()])
 
         if self.debug >= self.DEBUG_LEVEL2:
             print("Update this: %f next: %f " % (this_q, next_q))
 
-        t = self.alpha * (reward + self.gamma * next_q - this_q)
-        a = np.array(self.cur_status) * t
+        td_error = reward + self.gamma * next_q - this_q
+        if self.metrics is not None:
+            self.metrics.add_q(this_q, td_error)
+        t = self.alpha * td_error
+        if self.sparse:
+            a = t
+        else:
+            a = np.asarray(self.cur_status) * t
         if self.debug >= self.DEBUG_LEVEL2:
             print("Before:")
-            pprint.pprint(self.theta[self.cur_shape.get_shape()][self.cur_action[0]][self.cur_action[1]])
+            pprint.pprint(self.theta[self.cur_shape.get_shape(), self.cur_action[0], self.cur_action[1]])
             print("delta:")
             pprint.pprint(a)
-        self.theta[self.cur_shape.get_shape()][self.cur_action[0]][self.cur_action[1]] += a
+        if feature_theta is not None:
+            # scatter only into the weights of the active features, one row each
+            feature_theta[cur_piece, self.cur_status, action] += a
+        elif self.sparse:
+            # scatter only into the weights of the active features
+            self.theta[cur_piece, self.cur_action[0], self.cur_action[1], self.cur_status] += a
+        else:
+            self.theta[cur_piece, self.cur_action[0], self.cur_action[1]] += a
+        self.theta_version += 1
         if self.debug >= self.DEBUG_LEVEL2:
             print("After:")
-            pprint.pprint(self.theta[self.cur_shape.get_shape()][self.cur_action[0]][self.cur_action[1]])
+            pprint.pprint(self.theta[self.cur_shape.get_shape(), self.cur_action[0], self.cur_action[1]])
 
 
 if __name__ == '__main__':
+    # ten dense features on the default well, theta.save is left alone
     player = QLearnPlayer()
-    player.set_features(10, [8, 4, 10])
+    player.set_features(10, player.geometry.theta_shape[:3])
     player.set_debug(QLearnPlayer.DEBUG_LEVEL2, True)
     s1 = Shape(3)
     for i in range(100):
         player.select_action([1 for i in range(10)], s1)
         player.update([2 for i in range(10)], 1)
 
-    player.save_theta()
\ No newline at end of file
+    print(player.get_stats())
\ No newline at end of file
@@ -0,0 +1,128 @@
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+# phases of one move timed by Board.play_game and Board.drop
+PHASES = ('pieces', 'features', 'select', 'place', 'clear', 'update')
+
+
+class Summary(object):
+    # count, mean, std, min and max of a stream of values
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_array(self, values):
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += float(np.sum(values))
+        self.squares += float(np.sum(np.square(values)))
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+
+    def get(self):
+        if self.count == 0:
+            return {'count': 0}
+        mean = self.total / self.count
+        return {'count': self.count, 'mean': mean, 'std': math.sqrt(max(self.squares / self.count - mean * mean, 0)),
+                'min': self.min, 'max': self.max}
+
+
+class Metrics(object):
+    '''
+        Timers and counters of the training hot path, written as one JSON line per emit.
+        Boards and players keep None instead of a Metrics when disabled and check it
+        before reading the clock, so disabled metrics cost a few comparisons per move.
+        Every emit covers the moves since the previous one.
+    '''
+
+    def __init__(self, file_name=None):
+        self.file = sys.stdout if file_name is None else open(file_name, 'a')
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        self.q = Summary()
+        self.td = Summary()
+        # theta at the last emit, for the drift
+        self.theta = None
+        # hit and miss counters at the last emit
+        self.rates = {}
+        self.last = time.time()
+
+    def add(self, phase, start):
+        '''
+            Count the time since start to phase, return now to start the next phase
+        '''
+        now = time.perf_counter()
+        self.times[phase] += now - start
+        self.counts[phase] += 1
+        return now
+
+    def add_q(self, q, td_error):
+        self.q.add(q)
+        self.td.add(td_error)
+
+    def add_q_batch(self, q, td_error):
+        self.q.add_array(q)
+        self.td.add_array(td_error)
+
+    def get_rate(self, name, hits, misses):
+        last_hits, last_misses = self.rates.get(name, (0, 0))
+        self.rates[name] = (hits, misses)
+        hits -= last_hits
+        misses -= last_misses
+        return {'hits': hits, 'misses': misses, 'rate': hits / (hits + misses) if hits + misses else None}
+
+    def emit(self, player=None, **fields):
+        now = time.time()
+        record = {'time': now, 'seconds': now - self.last}
+        record.update(fields)
+
+        total = sum(self.times.values())
+        record['phases'] = {phase: {'count': self.counts[phase], 'seconds': self.times[phase],
+                                    'ns_per_op': self.times[phase] / self.counts[phase] * 1e9
+                                    if self.counts[phase] else None,
+                                    'share': self.times[phase] / total if total else None}
+                            for phase in PHASES}
+        record['q'] = self.q.get()
+        record['td_error'] = self.td.get()
+
+        if player is not None and player.theta is not None:
+            theta = np.asarray(player.theta)
+            record['theta'] = {'norm': float(np.linalg.norm(theta)),
+                               'drift': None if self.theta is None else float(np.linalg.norm(theta - self.theta))}
+            self.theta = np.array(theta)
+            stats = player.get_stats()
+            record['cache'] = self.get_rate('cache', stats['cache_hits'], stats['cache_misses'])
+            if 'hits' in stats:
+                record['table'] = self.get_rate('table', stats['hits'], stats['misses'])
+            record['evaluated'] = int(stats['evaluated'])
+
+        self.file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.file.flush()
+
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        self.q = Summary()
+        self.td = Summary()
+        self.last = now
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
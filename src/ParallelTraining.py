@@ -0,0 +1,200 @@
+import multiprocessing
+import queue
+import random
+import time
+
+import numpy as np
+
+from BitBoard import BitBoard
+from Board import Board
+from Checkpoint import CheckpointWriter
+from LinearQLearning import QLearnPlayer, new_theta
+from PieceSource import UniformSource
+
+
+class TrainingWorker(multiprocessing.Process):
+    '''
+        Self-play process with its own board and player.
+        In HOGWILD mode the player updates the shared theta in place without locks.
+        In AVERAGE mode it trains a local copy for sync_games games, then all
+        workers meet at the barrier and continue from the average of their copies.
+        With periods set AVERAGE mode stops after that many averaging periods, so
+        a seeded run gives the same theta every time.
+    '''
+
+    def __init__(self, index, mode, shared_theta, shared_slots, geometry, barrier, stop, stop_flag, results,
+                 sync_games, periods, seed):
+        super().__init__()
+        self.daemon = True
+        self.index = index
+        self.mode = mode
+        self.shared_theta = shared_theta
+        self.shared_slots = shared_slots
+        self.geometry = geometry
+        self.shape = geometry.theta_shape
+        self.barrier = barrier
+        self.stop = stop
+        self.stop_flag = stop_flag
+        self.results = results
+        self.sync_games = sync_games
+        self.periods = periods
+        self.seed = seed
+
+    def run(self):
+        if self.seed is not None:
+            random.seed(self.seed + self.index)
+            np.random.seed(self.seed + self.index)
+
+        board = BitBoard(self.geometry)
+        if self.seed is not None:
+            board.set_piece_source(UniformSource(self.seed + self.index))
+        player = QLearnPlayer()
+        player.set_geometry(self.geometry)
+        player.set_debug(player.DEBUG_LEVEL0, True)
+        player.set_sparse(True)
+
+        theta = new_theta(self.shape, self.shared_theta)
+        if self.mode == ParallelTraining.HOGWILD:
+            player.set_theta(theta)
+            while not self.stop.is_set():
+                moves = player.evaluated
+                board.play_game(player)
+                self.results.put((board.cur_removed_lines, board.cur_pieces, player.evaluated - moves))
+            return
+
+        slots = np.frombuffer(self.shared_slots, np.float).reshape((-1,) + self.shape)
+        # keeps the feature major layout of the shared theta
+        player.set_theta(theta.copy(order='K'))
+        period = 0
+        while True:
+            for i in range(self.sync_games):
+                moves = player.evaluated
+                board.play_game(player)
+                self.results.put((board.cur_removed_lines, board.cur_pieces, player.evaluated - moves))
+
+            slots[self.index] = player.theta
+            self.barrier.wait()
+            if self.index == 0:
+                np.mean(slots, axis=0, out=theta)
+                self.stop_flag.value = self.periods is None and self.stop.is_set()
+            self.barrier.wait()
+            period += 1
+            if self.stop_flag.value or period == self.periods:
+                return
+            player.theta[:] = theta
+
+
+class ParallelTraining(object):
+    '''
+        Runs self-play training over several worker processes sharing one theta.
+        The coordinator collects the result of every game, prints the per round
+        statistics and owns checkpointing.
+    '''
+    HOGWILD = 0
+    AVERAGE = 1
+
+    def __init__(self, workers=None, mode=HOGWILD, sync_games=10, seed=None, geometry=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.mode = mode
+        self.sync_games = sync_games
+        self.seed = seed
+        # well of a new theta, a loaded theta brings its own
+        self.geometry = geometry or Board.GEOMETRY
+
+        self.INFO_ROUND = 1000
+        self.round = 0
+        self.average = 0
+        self.max_removed = 0
+        self.total_removed_lines = 0
+        self.info_pieces = 0
+        self.info_moves = 0
+        self.info_time = None
+
+    def start_training(self, theta_file=None, rounds=None, checkpoint=None):
+        '''
+            Train from theta_file until rounds games are played, forever when None
+            checkpoint is a CheckpointWriter, by default one saving every 10 INFO_ROUND games
+            return a player holding the trained theta
+        '''
+        if checkpoint is None:
+            checkpoint = CheckpointWriter(rounds=self.INFO_ROUND * 10)
+        player = QLearnPlayer()
+        player.set_features(self.geometry.features_num, self.geometry.theta_shape[:3])
+        if theta_file is not None:
+            player.load_theta(theta_file)
+        shape = player.theta.shape
+
+        shared_theta = multiprocessing.RawArray('d', player.theta.size)
+        theta = new_theta(shape, shared_theta)
+        theta[:] = player.theta
+        player.set_theta(theta)
+
+        shared_slots = None
+        if self.mode == ParallelTraining.AVERAGE:
+            shared_slots = multiprocessing.RawArray('d', player.theta.size * self.workers)
+
+        barrier = multiprocessing.Barrier(self.workers)
+        stop = multiprocessing.Event()
+        stop_flag = multiprocessing.RawValue('b', 0)
+        results = multiprocessing.Queue()
+
+        periods = None
+        if rounds is not None:
+            periods = -(-rounds // (self.workers * self.sync_games))
+        workers = [TrainingWorker(i, self.mode, shared_theta, shared_slots, player.geometry, barrier, stop, stop_flag,
+                                  results, self.sync_games, periods, self.seed)
+                   for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+
+        self.info_time = time.time()
+        try:
+            while rounds is None or self.round < rounds:
+                self.add_result(*results.get())
+                info = self.round % self.INFO_ROUND == 0
+                if info:
+                    self.average = self.total_removed_lines / self.INFO_ROUND
+                # named by the max and average of the statistics so far, as Board.start_training does
+                if checkpoint.due(self.round):
+                    checkpoint.save(theta, "theta_%d_%.3f" % (self.max_removed, self.average),
+                                    player.get_meta(), self.round)
+                if info:
+                    self.print_info()
+        finally:
+            stop.set()
+            # keep draining so no worker blocks on a full queue before it sees stop
+            while any(worker.is_alive() for worker in workers):
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for worker in workers:
+                worker.join()
+            checkpoint.close()
+
+        player.set_theta(theta.copy(order='K'))
+        return player
+
+    def add_result(self, removed_lines, pieces, moves):
+        self.round += 1
+        self.info_pieces += pieces
+        self.info_moves += moves
+        self.total_removed_lines += removed_lines
+        if removed_lines > self.max_removed:
+            self.max_removed = removed_lines
+
+    def print_info(self):
+        # statistics of the last INFO_ROUND games, counted again from zero
+        now = time.time()
+        print("Round: %-10d" % self.round, "Max:", self.max_removed, "Avg:", self.average,
+              Board.get_throughput(self.INFO_ROUND, self.info_pieces, self.info_moves, now - self.info_time))
+        self.info_time = now
+        self.info_pieces = 0
+        self.info_moves = 0
+        self.total_removed_lines = 0
+        self.max_removed = 0
+
+
+if __name__ == '__main__':
+    training = ParallelTraining()
+    training.start_training('theta.save')
@@ -0,0 +1,104 @@
+import abc
+
+import numpy as np
+
+from Shape import Shape
+
+
+class PieceSource(abc.ABC):
+    '''
+        Stream of piece numbers for Board.new_shape.
+        Pieces are generated BLOCK at a time with numpy and handed out one by one,
+        every source implements get_block.
+    '''
+    BLOCK = 7 * 1024
+    PIECES = np.arange(1, Shape.MAX_SHAPE)
+
+    def __init__(self):
+        self.block = []
+        self.pos = 0
+
+    def next_piece(self):
+        if self.pos == len(self.block):
+            self.block = self.get_block().tolist()
+            self.pos = 0
+        piece = self.block[self.pos]
+        self.pos += 1
+        return piece
+
+    def next_pieces(self, n):
+        return np.array([self.next_piece() for i in range(n)], np.int)
+
+    @abc.abstractmethod
+    def get_block(self):
+        # the next pieces as an array of piece numbers
+        pass
+
+
+class UniformSource(PieceSource):
+    # every piece drawn independently with the same probability
+    def __init__(self, seed=None):
+        super().__init__()
+        self.rng = np.random.RandomState(seed)
+
+    def get_block(self):
+        return self.rng.randint(1, Shape.MAX_SHAPE, PieceSource.BLOCK)
+
+
+class BagSource(PieceSource):
+    # 7-bag randomizer, every run of seven pieces is a permutation of all of them
+    def __init__(self, seed=None):
+        super().__init__()
+        self.rng = np.random.RandomState(seed)
+
+    def get_block(self):
+        bags = np.argsort(self.rng.random_sample((PieceSource.BLOCK // len(PieceSource.PIECES),
+                                                  len(PieceSource.PIECES))), axis=1)
+        return PieceSource.PIECES[bags].ravel()
+
+
+class SequenceSource(PieceSource):
+    '''
+        Fixed sequence of pieces, from a .npy file or a text file of piece numbers.
+        The sequence starts over when it runs out, unless loop is false.
+    '''
+
+    def __init__(self, file_name=None, pieces=None, loop=True):
+        super().__init__()
+        if pieces is None:
+            pieces = SequenceSource.load(file_name)
+        self.pieces = np.asarray(pieces, np.int)
+        if len(self.pieces) == 0 or np.any(self.pieces < 1) or np.any(self.pieces >= Shape.MAX_SHAPE):
+            raise Exception("Piece Sequence Error")
+        self.loop = loop
+        self.started = False
+
+    def get_block(self):
+        if self.started and not self.loop:
+            raise Exception("Piece Sequence End")
+        self.started = True
+        return self.pieces
+
+    @staticmethod
+    def load(file_name):
+        if file_name.endswith('.npy'):
+            return np.load(file_name)
+        return np.loadtxt(file_name, np.int, ndmin=1)
+
+    @staticmethod
+    def save(file_name, pieces):
+        if file_name.endswith('.npy'):
+            np.save(file_name, np.asarray(pieces, np.int8))
+        else:
+            np.savetxt(file_name, np.asarray(pieces, np.int), '%d')
+
+
+def get_piece_source(name, seed=None):
+    '''
+        'uniform', 'bag', or the name of a sequence file
+    '''
+    if name == 'uniform':
+        return UniformSource(seed)
+    if name == 'bag':
+        return BagSource(seed)
+    return SequenceSource(name)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from Shape import Shape
+
+
+class ReplayBuffer(object):
+    '''
+        Ring buffer of transitions for players with sparse features, kept in flat
+        arrays allocated once, so memory is bounded by capacity however long the run.
+        When full every new transition overwrites the oldest one.
+        A next shape of 0 means the target is the average over all the next shapes,
+        the next status of a terminal transition is never read.
+    '''
+
+    def __init__(self, capacity, seed=None, features=Shape.MAX_WIDTH):
+        self.capacity = capacity
+        self.status = np.zeros((capacity, features), np.int)
+        self.shapes = np.zeros(capacity, np.int)
+        self.actions = np.zeros(capacity, np.int)
+        self.rewards = np.zeros(capacity)
+        self.new_status = np.zeros((capacity, features), np.int)
+        self.done = np.zeros(capacity, np.bool)
+        self.p_shapes = np.zeros(capacity, np.int)
+
+        self.pos = 0
+        self.size = 0
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, status, shape, action, new_status, reward, p_shape=0):
+        # an empty new_status marks the end of the game
+        i = self.pos
+        self.status[i] = status
+        self.shapes[i] = shape
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.done[i] = len(new_status) == 0
+        if not self.done[i]:
+            self.new_status[i] = new_status
+        self.p_shapes[i] = p_shape
+
+        self.pos = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_batch(self, status, shapes, actions, new_status, rewards, done, p_shapes):
+        # transitions of a batch of games, e.g. one VecBoard step
+        index = (self.pos + np.arange(len(shapes))) % self.capacity
+        self.status[index] = status
+        self.shapes[index] = shapes
+        self.actions[index] = actions
+        self.rewards[index] = rewards
+        self.new_status[index] = new_status
+        self.done[index] = done
+        self.p_shapes[index] = p_shapes
+
+        self.pos = (self.pos + len(shapes)) % self.capacity
+        self.size = min(self.size + len(shapes), self.capacity)
+
+    def sample(self, batch_size):
+        '''
+            return (status, shapes, actions, new_status, rewards, done, p_shapes)
+            of batch_size transitions drawn uniformly, in the order of QLearnPlayer.td_update
+        '''
+        index = self.rng.randint(0, self.size, batch_size)
+        return (self.status[index], self.shapes[index], self.actions[index], self.new_status[index],
+                self.rewards[index], self.done[index], self.p_shapes[index])
@@ -0,0 +1,246 @@
+import random
+import sys
+import time
+
+import numpy as np
+
+from BitBoard import BitBoard
+from Board import Board
+from Features import get_reward_set
+from LinearQLearning import QLearnPlayer
+from Shape import Shape
+
+
+class SearchPlayer(QLearnPlayer):
+    '''
+        Expectimax search over placements, leaves are scored with the linear Q of theta.
+        depth 1 is the greedy QLearnPlayer, depth 2 adds the reward of every
+        placement and the average over the next shapes of their best Q, and so on.
+        beam limits every node to its best placements by Q.
+        With table_size, afterstate values are kept in a transposition table keyed by
+        the packed rows, and the landing height when the reward weights it, so the same
+        board reached by different placements is evaluated once. It is off by default:
+        few boards repeat, about 0.0003 of the lookups hit at depth 2 and 0.05 at depth 3,
+        and the keys cost more than the hits save.
+        select_action reads the position from the BitBoard given to set_board,
+        and the rewards are weighted as in its set_reward.
+    '''
+    GAME_OVER_REWARD = -3
+
+    def __init__(self, depth=2, beam=None, table_size=0):
+        super().__init__()
+        self.depth = depth
+        self.beam = beam
+        self.table_size = table_size
+        self.sparse = True
+        self.board = None
+
+        self.reward_weights = None
+        # FeatureSet and weights of the reward, None when it only weights holes and bumpiness
+        self.reward_set = None
+        self.reward_vector = None
+        # the value of a state depends on its landing height, through the reward of the next placement
+        self.key_landing = False
+        self.set_reward()
+
+        self.table = {}
+        self.table_version = 0
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def set_board(self, board):
+        self.board = board
+        self.set_reward(board.reward_weights)
+
+    def set_reward(self, weights=None):
+        # the weights of Board.set_reward, Board.REWARD_WEIGHTS when None
+        self.reward_weights = Board.REWARD_WEIGHTS if weights is None else weights
+        self.reward_set, self.reward_vector = get_reward_set(self.reward_weights, self.geometry)
+        self.key_landing = self.reward_set is not None and 'landing_height' in self.reward_set.names
+        # values of other rewards
+        self.clear_table()
+
+    def set_feature_set(self, feature_set):
+        # the search scores the contour of the positions it reaches
+        raise Exception("Search Error: contour features only")
+
+    def load_theta(self, file_name=None, mmap=False):
+        super().load_theta(file_name, mmap)
+        if self.feature_set is not None:
+            raise Exception("Search Error: contour features only")
+
+    def clear_table(self):
+        self.table = {}
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        stats = super().get_stats()
+        stats.update({'nodes': self.nodes, 'hits': self.hits, 'misses': self.misses,
+                      'hit_rate': self.hits / lookups if lookups else 0, 'table': len(self.table)})
+        return stats
+
+    def select_action(self, feature, shape):
+        if self.learn and random.random() < self.epsilon:
+            return super().select_action(self.board.get_feature_index(), shape)
+
+        if self.board.reward_weights is not self.reward_weights:
+            self.set_reward(self.board.reward_weights)
+        self.cur_status = self.board.get_feature_index()
+        self.cur_shape = shape
+        state = (self.board.rows, self.board.heights, self.board.filled, self.board.landing_height)
+        self.cur_action, val = self.search(state, shape.get_shape(), self.depth)
+        if self.debug >= self.DEBUG_LEVEL1:
+            print("Search Action ", self.cur_action, val, self.get_stats())
+        return self.cur_action
+
+    def search(self, state, piece, depth):
+        '''
+            return the best (rotation, x) of piece and its value
+        '''
+        rows, heights, filled, landing_height = state
+        if depth <= 1:
+            return self.best_action(get_contour(self.geometry, heights), QLearnPlayer.SHAPES[piece])
+
+        q = self.action_values(get_contour(self.geometry, heights), piece)
+
+        actions = np.argsort(-q, kind='stable')
+        actions = actions[q[actions] > QLearnPlayer.MIN_Q]
+        if self.beam is not None:
+            actions = actions[:self.beam]
+
+        values = self.get_reward_values(state)
+        result = None
+        m = None
+        for action in actions.tolist():
+            action = divmod(action, self.geometry.width)
+            next_state, lines, game_over = place(self.geometry, state, piece, action[0], action[1])
+            self.nodes += 1
+            if game_over:
+                value = SearchPlayer.GAME_OVER_REWARD
+            else:
+                next_values = self.get_reward_values(next_state)
+                value = lines * self.reward_weights.get('lines', 0) + self.get_reward(values, next_values)
+                value += self.gamma * self.get_expected_value(next_state, depth - 1)
+            if m is None or value > m:
+                m = value
+                result = action
+        return result, m
+
+    def get_reward_values(self, state):
+        # what the reward weights in state: (holes, bumpiness) or the values of reward_set
+        if self.reward_set is None:
+            return get_bad_var(state[1], state[2])
+        return self.reward_set.extract(state[0], state[1], state[3])
+
+    def get_reward(self, values, next_values):
+        # reward of the change from values to next_values, without the removed lines, as in Board.get_reward
+        if self.reward_set is None:
+            weights = self.reward_weights
+            return (next_values[0] - values[0]) * weights.get('holes', 0) + \
+                (next_values[1] - values[1]) * weights.get('bumpiness', 0)
+        return float(np.dot(self.reward_vector, next_values - values))
+
+    def get_expected_value(self, state, depth):
+        # average over the next shapes of the best value reachable in depth placements
+        if self.table_version != self.theta_version:
+            # values computed with an older theta
+            self.clear_table()
+            self.table_version = self.theta_version
+        key = None
+        if self.table_size:
+            key = (get_key(self.geometry, state[0]), depth)
+            if depth > 1 and self.key_landing:
+                key += (state[3],)
+            value = self.table.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        if depth <= 1:
+            value = self.expected_value(get_contour(self.geometry, state[1]))
+        else:
+            value = 0
+            for piece in range(1, Shape.MAX_SHAPE):
+                value += self.search(state, piece, depth)[1]
+            value /= (Shape.MAX_SHAPE - 1)
+
+        if key is not None:
+            if len(self.table) >= self.table_size:
+                self.table = {}
+            self.table[key] = value
+        return value
+
+
+def get_contour(geometry, heights):
+    return geometry.feature_offset - min(heights) + heights
+
+
+def get_bad_var(heights, filled):
+    # holes and bumpiness as in Board.calculate
+    return sum(heights) - filled, sum(abs(heights[i + 1] - heights[i]) for i in range(len(heights) - 1))
+
+
+def get_key(geometry, rows):
+    # all the rows packed in one integer
+    key = 0
+    for row in rows:
+        key = (key << geometry.width) | row
+    return key
+
+
+def place(geometry, state, piece, rotation, x):
+    '''
+        Drop a piece on a copy of (rows, heights, filled, landing height) of a well of geometry
+        return (next state, removed lines, game over)
+    '''
+    rows, heights, filled, landing_height = state
+    cols, skirt, top, row_masks, row_counts, cells = geometry.placements[piece][rotation][x]
+    base = 0
+    for i in range(len(cols)):
+        if heights[cols[i]] - skirt[i] > base:
+            base = heights[cols[i]] - skirt[i]
+
+    rows = list(rows)
+    heights = list(heights)
+    for i in range(len(row_masks)):
+        rows[base + i] |= row_masks[i]
+    for i in range(len(cols)):
+        heights[cols[i]] = base + top[i]
+    filled += Shape.MAX_POINT
+    landing_height = base + (len(row_masks) - 1) / 2
+
+    full_row = geometry.full_row
+    lines = 0
+    for y in range(base, base + len(row_masks)):
+        if rows[y] == full_row:
+            lines += 1
+    if lines:
+        rows = [row for row in rows if row != full_row] + [0] * lines
+        filled -= lines * geometry.width
+        for c in range(geometry.width):
+            bit = 1 << c
+            h = heights[c] - lines
+            while h and not rows[h - 1] & bit:
+                h -= 1
+            heights[c] = h
+
+    return (rows, heights, filled, landing_height), lines, max(heights) > geometry.game_over_height
+
+
+if __name__ == '__main__':
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    games = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    player = SearchPlayer(depth)
+    player.load_theta('16_theta_14')
+    board = BitBoard(player.geometry)
+    player.set_debug(player.DEBUG_LEVEL0, False)
+    player.set_board(board)
+    start = time.time()
+    pieces = 0
+    for i in range(games):
+        lines = board.play_game(player)
+        pieces += board.cur_pieces
+        print("Game: %d Lines: %d" % (i, lines), player.get_stats())
+    print("Pieces/s: %.1f" % (pieces / (time.time() - start)))
@@ -3,6 +3,51 @@ import random
 import numpy as np
 
 
+def get_cells(points):
+    # (y, x) points of SHAPE_TABLE to rows counted up from the bottom and x from 0
+    cell_up = np.max(points[:, 0]) - points[:, 0]
+    cell_x = points[:, 1] - np.min(points[:, 1])
+    return cell_up, cell_x
+
+
+def get_actions(shape_width, width):
+    # x of every (piece, rotation) in a well of width columns
+    return [[list(range(width - w + 1)) for w in widths] for widths in shape_width]
+
+
+def get_placements(shape_table, actions, width):
+    '''
+        return (placements, placement index, placement y, placement x) for actions in a well of width columns
+        as described in Geometry
+    '''
+    placements = []
+    placement_index = np.full((len(actions), max(len(a) for a in actions) or 1, width), -1, np.int)
+    placement_y = []
+    placement_x = []
+    for p_shape in range(len(actions)):
+        placements.append([])
+        for s_shape in range(len(actions[p_shape])):
+            placements[p_shape].append([])
+            cell_up, cell_x = get_cells(shape_table[p_shape][s_shape])
+            for x in actions[p_shape][s_shape]:
+                placements[p_shape][s_shape].append(get_placement(cell_up, cell_x + x))
+                placement_index[p_shape, s_shape, x] = len(placement_y)
+                placement_y.append(cell_up)
+                placement_x.append(cell_x + x)
+    return placements, placement_index, np.array(placement_y), np.array(placement_x)
+
+
+def get_placement(cell_up, cell_x):
+    cols = tuple(range(np.min(cell_x), np.max(cell_x) + 1))
+    skirt = tuple(int(np.min(cell_up[cell_x == c])) for c in cols)
+    top = tuple(int(np.max(cell_up[cell_x == c])) + 1 for c in cols)
+    rows = range(np.max(cell_up) + 1)
+    row_masks = tuple(sum(1 << int(c) for c in cell_x[cell_up == r]) for r in rows)
+    row_counts = tuple(int(np.sum(cell_up == r)) for r in rows)
+    cells = tuple((int(u), int(c)) for u, c in zip(cell_up, cell_x))
+    return cols, skirt, top, row_masks, row_counts, cells
+
+
 class Shape(object):
     NoShape = 0
     ZShape = 1
@@ -56,24 +101,47 @@ class Shape(object):
             min_x = np.min(SHAPE_TABLE[p_shape][s_shape][:, 1])
             SHAPE_WIDTH[p_shape].append(max_x - min_x + 1)
 
-    ACTIONS = []
+    # lowest row of every (piece, rotation) in SHAPE_TABLE, rows are counted down from the top of the shape
+    SHAPE_BOTTOM = []
     for p_shape in range(0, MAX_SHAPE):
-        ACTIONS.append([])
+        SHAPE_BOTTOM.append([])
         for s_shape in range(SUB[p_shape]):
-            ACTIONS[p_shape].append([i for i in range(MAX_WIDTH - SHAPE_WIDTH[p_shape][s_shape] + 1)])
+            SHAPE_BOTTOM[p_shape].append(int(np.max(SHAPE_TABLE[p_shape][s_shape][:, 0])))
+
+    ACTIONS = get_actions(SHAPE_WIDTH, MAX_WIDTH)
+    # ACTIONS of every well width used so far
+    WIDTH_ACTIONS = {MAX_WIDTH: ACTIONS}
 
-    def __init__(self, p_shape=None):
+    def __init__(self, p_shape=None, width=MAX_WIDTH):
         if p_shape is None:
-            self.piece_shape = random.choice([self.SquareShape, self.LShape, self.MirroredLShape,
-                                              self.TShape, self.LineShape, self.ZShape, self.SShape])
-            # self.piece_shape = random.choice([self.SquareShape, self.LineShape])
+            self.piece_shape = Shape.random_shape()
         else:
             self.piece_shape = p_shape
+        # width of the well the shape moves in
+        self.width = width
+        self.sub_shape = 0
+        self.x = None
+        self.reset()
+
+    @staticmethod
+    def random_shape():
+        # a piece drawn with the global random, for the boards without a piece source
+        return random.choice([Shape.SquareShape, Shape.LShape, Shape.MirroredLShape,
+                              Shape.TShape, Shape.LineShape, Shape.ZShape, Shape.SShape])
+
+    def reset(self):
+        # back to the spawn rotation and column of a new piece
         self.sub_shape = 0
-        self.x = int(Shape.MAX_WIDTH/2-1)
+        self.x = int(self.width / 2 - 1)
+
+    @staticmethod
+    def get_width_actions(width):
+        if width not in Shape.WIDTH_ACTIONS:
+            Shape.WIDTH_ACTIONS[width] = get_actions(Shape.SHAPE_WIDTH, width)
+        return Shape.WIDTH_ACTIONS[width]
 
     def set_x(self, x):
-        if x < 0 or x > Shape.MAX_WIDTH - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]:
+        if x < 0 or x > self.width - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]:
             # raise (Exception("Set X Error %d" % x))
             return
         self.x = x
@@ -106,17 +174,17 @@ class Shape(object):
     def rotate_right(self, step=1):
         self.sub_shape += step
         self.sub_shape %= Shape.SUB[self.piece_shape]
-        if self.x > Shape.MAX_WIDTH - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]:
-            self.x = Shape.MAX_WIDTH - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]
+        if self.x > self.width - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]:
+            self.x = self.width - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]
 
     def rotate_left(self, step=1):
         self.sub_shape -= step
         self.sub_shape %= Shape.SUB[self.piece_shape]
-        if self.x > Shape.MAX_WIDTH - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]:
-            self.x = Shape.MAX_WIDTH - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]
+        if self.x > self.width - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]:
+            self.x = self.width - Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape]
 
     def get_actions(self):
-        return Shape.ACTIONS[self.piece_shape]
+        return Shape.get_width_actions(self.width)[self.piece_shape]
 
     def print_shape(self):
         s_map = np.zeros((4, 4), np.int)
@@ -128,7 +196,7 @@ class Shape(object):
         # pprint.pprint(self.get_pos())
         print('Width', Shape.SHAPE_WIDTH[self.piece_shape][self.sub_shape])
         print('Actions:')
-        pprint.pprint(Shape.ACTIONS[self.piece_shape])
+        pprint.pprint(self.get_actions())
         print()
 
 
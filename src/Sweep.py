@@ -0,0 +1,246 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import time
+
+import numpy as np
+
+import ThetaFile
+from BitBoard import BitBoard
+from Board import Board
+from Features import EXTRACTORS, FeatureSet, get_names
+from LinearQLearning import QLearnPlayer
+from PieceSource import UniformSource
+
+# hyperparameters of the player, every other parameter is a reward weight
+PLAYER_PARAMS = ('alpha', 'gamma', 'epsilon')
+# evaluation game i gets the pieces of EVAL_SEED + i, apart from the training pieces of any seed used here
+EVAL_SEED = 1000000
+
+
+class Trial(object):
+    '''
+        One configuration of the sweep, params maps the names of the space to their values
+    '''
+
+    def __init__(self, index, params):
+        self.index = index
+        self.params = params
+        self.rung = -1
+        self.games = 0
+        self.pieces = 0
+        self.seconds = 0.0
+        # summary of the evaluation after the last rung
+        self.score = None
+
+    def get_row(self):
+        row = {'trial': self.index, 'rung': self.rung, 'games': self.games, 'pieces': self.pieces,
+               'seconds': self.seconds}
+        row.update(self.score or {})
+        row['params'] = self.params
+        return row
+
+
+def get_space(texts):
+    '''
+        texts are name=v1,v2,.. for the values of a grid, name=low:high to sample uniformly
+        or name=low:high:log to sample log-uniformly, return {name: list or (low, high, log)}
+    '''
+    space = {}
+    for text in texts:
+        name, values = text.split('=', 1)
+        name = name.strip()
+        if name not in PLAYER_PARAMS and name != 'lines' and name not in EXTRACTORS:
+            raise Exception("Sweep Error: unknown parameter %s" % name)
+        if ':' in values:
+            bounds = values.split(':')
+            if len(bounds) not in (2, 3) or (len(bounds) == 3 and bounds[2] != 'log'):
+                raise Exception("Sweep Error: range %s" % text)
+            space[name] = (float(bounds[0]), float(bounds[1]), len(bounds) == 3)
+        else:
+            space[name] = [float(value) for value in get_names(values)]
+    return space
+
+
+def get_configs(space, trials=None, seed=0):
+    # the grid of all the value lists when trials is None, else trials random samples
+    if trials is None:
+        if any(not isinstance(values, list) for values in space.values()):
+            raise Exception("Sweep Error: ranges need a number of trials")
+        names = sorted(space)
+        return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+    rng = np.random.RandomState(seed)
+    configs = []
+    for i in range(trials):
+        config = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values, list):
+                config[name] = values[rng.randint(len(values))]
+            else:
+                low, high, log = values
+                if log:
+                    config[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+                else:
+                    config[name] = float(rng.uniform(low, high))
+        configs.append(config)
+    return configs
+
+
+def get_reward_weights(params):
+    weights = dict(Board.REWARD_WEIGHTS)
+    weights.update({name: value for name, value in params.items() if name not in PLAYER_PARAMS})
+    return weights
+
+
+def run_trial(task):
+    '''
+        Train the theta of a trial for games more games and evaluate it without learning
+        every trial of a rung trains on the pieces and exploration draws of seed + rung
+        and is evaluated on the same eval_games games, so only its parameters differ
+        return (trial index, games, pieces, seconds, evaluation summary)
+    '''
+    index, params, rung, games, options = task
+    start = time.time()
+    random.seed(options['seed'] + rung)
+    np.random.seed(options['seed'] + rung)
+
+    player = QLearnPlayer()
+    player.set_features(player.geometry.features_num, player.geometry.theta_shape[:3])
+    player.set_debug(player.DEBUG_LEVEL0, True)
+    player.set_sparse(True)
+    if options['features'] is not None:
+        player.set_feature_set(FeatureSet(options['features'], player.geometry, normalize=True))
+    theta_file = get_theta_name(options['directory'], index)
+    if rung > 0:
+        player.load_theta(theta_file)
+    elif options['theta_in'] is not None:
+        player.load_theta(options['theta_in'])
+    for name in PLAYER_PARAMS:
+        if name in params:
+            setattr(player, name, params[name])
+
+    board = BitBoard(player.geometry)
+    weights = get_reward_weights(params)
+    board.set_reward(weights)
+    board.set_piece_source(UniformSource(options['seed'] + rung))
+    pieces = 0
+    for i in range(games):
+        board.play_game(player, options['max_lines'])
+        pieces += board.cur_pieces
+    meta = player.get_meta()
+    meta['reward'] = weights
+    ThetaFile.save_atomic(theta_file, player.theta, meta)
+
+    player.set_debug(player.DEBUG_LEVEL0, False)
+    lines = []
+    for game in range(options['eval_games']):
+        board.set_piece_source(UniformSource(EVAL_SEED + game))
+        lines.append(board.play_game(player, options['max_lines']))
+    score = {'mean': float(np.mean(lines)), 'std': float(np.std(lines)), 'max': int(np.max(lines))}
+    return index, games, pieces, time.time() - start, score
+
+
+def get_theta_name(directory, index):
+    return os.path.join(directory, 'trial_%d.theta' % index)
+
+
+def sweep(configs, directory, workers=None, min_games=100, eta=3, rungs=3, eval_games=20, seed=0,
+          max_lines=1000, features=None, theta_in=None):
+    '''
+        Successive halving over configs: every rung trains the remaining trials over a process pool,
+        rung r for min_games * eta ** r more games, then keeps the best 1 / eta of them by the
+        mean lines of the evaluation games, at least one
+        the theta of every trial is kept in directory as trial_<index>.theta, the best is copied to best.theta
+        return the trials ranked, the furthest rung first, then by mean lines
+    '''
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or multiprocessing.cpu_count()
+    options = {'directory': directory, 'eval_games': eval_games, 'seed': seed, 'max_lines': max_lines,
+               'features': features, 'theta_in': theta_in}
+    trials = [Trial(i, params) for i, params in enumerate(configs)]
+    if not trials:
+        raise Exception("Sweep Error: no trials")
+
+    alive = trials
+    pool = multiprocessing.Pool(min(workers, len(trials)))
+    try:
+        for rung in range(rungs):
+            games = min_games * eta ** rung
+            tasks = [(trial.index, trial.params, rung, games, options) for trial in alive]
+            for index, trial_games, pieces, seconds, score in pool.imap_unordered(run_trial, tasks):
+                trial = trials[index]
+                trial.rung = rung
+                trial.games += trial_games
+                trial.pieces += pieces
+                trial.seconds += seconds
+                trial.score = score
+            alive = sorted(alive, key=lambda trial: -trial.score['mean'])
+            print("Rung: %d Games: %d Trials: %d Best: %.3f" % (rung, games, len(alive), alive[0].score['mean']),
+                  alive[0].params)
+            alive = alive[:max(1, len(alive) // eta)]
+    finally:
+        pool.terminate()
+        pool.join()
+
+    ranked = sorted(trials, key=lambda trial: (-trial.rung, -trial.score['mean'], trial.index))
+    shutil.copyfile(get_theta_name(directory, ranked[0].index), os.path.join(directory, 'best.theta'))
+    with open(os.path.join(directory, 'results.json'), 'w') as f:
+        json.dump([trial.get_row() for trial in ranked], f, indent=2, sort_keys=True)
+    return ranked
+
+
+def print_table(ranked):
+    names = sorted(set(name for trial in ranked for name in trial.params))
+    print("%4s %5s %6s %5s %9s %8s %6s " % ('rank', 'trial', 'rung', 'games', 'mean', 'std', 'max') +
+          " ".join("%10s" % name for name in names))
+    for rank, trial in enumerate(ranked):
+        print("%4d %5d %6d %5d %9.3f %8.3f %6d " % (rank + 1, trial.index, trial.rung, trial.games,
+                                                    trial.score['mean'], trial.score['std'], trial.score['max']) +
+              " ".join("%10.4g" % trial.params[name] if name in trial.params else "%10s" % '-' for name in names))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Sweep the hyperparameters and reward weights of the linear '
+                                                 'Q-learning player with successive halving over a process pool')
+    parser.add_argument('param', nargs='+',
+                        help="alpha, gamma, epsilon, 'lines' or a feature name as a reward weight, "
+                             "given as name=v1,v2,.. (grid) or name=low:high[:log] (sampled, needs --trials)")
+    parser.add_argument('--output', default='sweep', help='directory of the trial thetas, results.json and best.theta')
+    parser.add_argument('--trials', type=int, help='random samples of the space, the whole grid when omitted')
+    parser.add_argument('--workers', type=int, help='processes, one per core when omitted')
+    parser.add_argument('--min-games', type=int, default=100, help='training games of every trial in the first rung')
+    parser.add_argument('--eta', type=int, default=3,
+                        help='the games grow and the trials shrink by this factor from one rung to the next')
+    parser.add_argument('--rungs', type=int, default=3, help='number of rungs')
+    parser.add_argument('--eval-games', type=int, default=20, help='evaluation games after every rung')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the samples and of the training pieces')
+    parser.add_argument('--max-lines', type=int, default=1000,
+                        help='end a training or evaluation game once it has removed this many lines')
+    parser.add_argument('--features', help='comma separated features of a dense theta, the sparse contour when omitted')
+    parser.add_argument('--theta-in', help='theta file every trial starts from, zero theta when omitted')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    configs = get_configs(get_space(args.param), args.trials, args.seed)
+    features = get_names(args.features) if args.features is not None else None
+    start = time.time()
+    ranked = sweep(configs, args.output, args.workers, args.min_games, args.eta, args.rungs, args.eval_games,
+                   args.seed, args.max_lines, features, args.theta_in)
+    print_table(ranked)
+    print("Trials: %d Seconds: %.1f Best: %s" % (len(ranked), time.time() - start,
+                                                 os.path.join(args.output, 'best.theta')))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+'''
+    Theta file format, version 1
+
+    MAGIC                 8 bytes
+    header length         4 bytes, unsigned little endian
+    header                JSON, padded with spaces so the data starts on an ALIGN boundary
+    data                  theta as one C ordered array of the dtype and shape in the header
+
+    The header also records the board width, the game over height, the feature
+    layout and the hyperparameters theta was trained with, board_height is the
+    height of the well it was trained in. Theta of the 'features' layout is for
+    the FeatureSet of the names in features.
+'''
+
+import json
+import os
+import pickle
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'TETRIS\x93\x01'
+VERSION = 1
+ALIGN = 64
+# the contour one-hot indices of the sparse players
+FEATURE_LAYOUT = 'contour'
+# the dense values of a FeatureSet
+FEATURES_LAYOUT = 'features'
+
+
+def get_header(theta, meta):
+    header = dict(meta)
+    header.update({
+        'version': VERSION,
+        'dtype': theta.dtype.str,
+        'shape': list(theta.shape),
+        'board_width': theta.shape[2],
+        'feature_layout': FEATURES_LAYOUT if 'features' in header else FEATURE_LAYOUT,
+    })
+    if 'features' not in header:
+        # the contour feature holds board_width blocks of game_over_height + 1 heights
+        header['game_over_height'] = theta.shape[3] // theta.shape[2] - 1
+    return header
+
+
+def save(file_name, theta, meta=None, sync=False):
+    theta = np.ascontiguousarray(theta)
+    header = json.dumps(get_header(theta, meta or {}), sort_keys=True).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+    with open(file_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(theta.tobytes())
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def save_atomic(file_name, theta, meta=None):
+    # readers and crashes see either the old file or the complete new one
+    temp_name = file_name + '.tmp'
+    save(temp_name, theta, meta, sync=True)
+    os.replace(temp_name, file_name)
+
+
+def is_theta_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(file_name):
+    '''
+        return (header, offset of the data)
+    '''
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception("Theta File Error: %s" % file_name)
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length).decode())
+    if header['version'] > VERSION:
+        raise Exception("Theta File Version Error: %d" % header['version'])
+    return header, len(MAGIC) + 4 + length
+
+
+def load(file_name, mmap=False):
+    '''
+        return (theta, header)
+        with mmap theta is a read-only memory map shared by every process loading the file
+    '''
+    header, offset = read_header(file_name)
+    dtype = np.dtype(header['dtype'])
+    shape = tuple(header['shape'])
+    if mmap:
+        theta = np.memmap(file_name, dtype, 'r', offset, shape)
+    else:
+        with open(file_name, 'rb') as f:
+            f.seek(offset)
+            theta = np.fromfile(f, dtype, int(np.prod(shape))).reshape(shape)
+    return theta, header
+
+
+def load_pickle(file_name):
+    # theta pickled as nested lists of arrays, or as one array
+    with open(file_name, 'rb') as f:
+        return np.array(pickle.load(f), np.float)
+
+
+def convert(pickle_file, file_name, meta=None):
+    save(file_name, load_pickle(pickle_file), meta)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        convert(sys.argv[1], sys.argv[2])
+    elif len(sys.argv) == 2:
+        print(json.dumps(read_header(sys.argv[1])[0], indent=2, sort_keys=True))
+    else:
+        print("Usage: python ThetaFile.py PICKLE_FILE THETA_FILE   convert a pickled theta")
+        print("       python ThetaFile.py THETA_FILE               print the header")
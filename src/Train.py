@@ -0,0 +1,123 @@
+import argparse
+import random
+
+import numpy as np
+
+from BitBoard import BitBoard
+from Board import Board
+from Checkpoint import CheckpointWriter
+from Features import FeatureSet, get_names
+from GameLog import GameLogWriter
+from Geometry import Geometry
+from LinearQLearning import QLearnPlayer
+from Metrics import Metrics
+from PieceSource import get_piece_source
+from ReplayBuffer import ReplayBuffer
+from TrainingCurve import CurveWriter
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Train the linear Q-learning player without the GUI')
+    parser.add_argument('--theta-in', help='theta file to start from, zero theta when omitted')
+    parser.add_argument('--theta-out', help='file the trained theta is saved to')
+    parser.add_argument('--alpha', type=float, help='learning rate')
+    parser.add_argument('--gamma', type=float, help='discount factor')
+    parser.add_argument('--epsilon', type=float, help='probability of a random action')
+    parser.add_argument('--rounds', type=int, help='number of games to train')
+    parser.add_argument('--seconds', type=float, help='wall-clock budget, checked between games')
+    parser.add_argument('--target-lines', type=int,
+                        help='stop and save theta as soon as one game removes this many lines')
+    parser.add_argument('--info-round', type=int, default=1000, help='games between two statistics lines')
+    parser.add_argument('--checkpoint-rounds', type=int, default=10000, help='games between two checkpoints')
+    parser.add_argument('--checkpoint-seconds', type=float, help='seconds between two checkpoints')
+    parser.add_argument('--keep', type=int, default=5, help='number of checkpoints kept')
+    parser.add_argument('--pieces', default='uniform',
+                        help="piece stream: 'uniform', 'bag' (7-bag) or a file with a fixed sequence")
+    parser.add_argument('--seed', type=int, help='seed of the piece and exploration random generators')
+    parser.add_argument('--log', help='game log file recording every move played')
+    parser.add_argument('--metrics', help='append a JSON line of phase timings and learning statistics '
+                                          'to this file every info round')
+    parser.add_argument('--curve', help='directory the lines, pieces, reward, epsilon and time of every game are '
+                                        'recorded into, continued when it holds a run')
+    parser.add_argument('--curve-windows', default='100,1000,10000',
+                        help='comma separated games of the rolling aggregates reported every info round')
+    parser.add_argument('--replay', type=int, help='learn from an experience replay buffer of this many transitions')
+    parser.add_argument('--batch-size', type=int, default=32, help='transitions in every replay minibatch')
+    parser.add_argument('--replay-interval', type=int, default=1, help='moves between two replay minibatches')
+    parser.add_argument('--width', type=int, default=Geometry.DEFAULT.width,
+                        help='well width of a new theta, a loaded theta keeps its own')
+    parser.add_argument('--height', type=int, default=Geometry.DEFAULT.height, help='well height')
+    parser.add_argument('--game-over-height', type=int, default=Geometry.DEFAULT.game_over_height,
+                        help='stack height ending the game, of a new theta')
+    parser.add_argument('--features',
+                        help='comma separated features of a new dense theta, e.g. contour,holes,wells,landing_height, '
+                             'the sparse contour when omitted')
+    parser.add_argument('--reward', help="comma separated name=weight of the reward, e.g. 'lines=4,holes=-7,wells=-1', "
+                                         "'lines' and feature names")
+    return parser
+
+
+def get_reward_weights(text):
+    weights = {}
+    for item in get_names(text):
+        name, weight = item.split('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    geometry = Geometry.get(args.width, args.height, args.game_over_height)
+    player = QLearnPlayer()
+    player.set_features(geometry.features_num, geometry.theta_shape[:3])
+    player.set_geometry(geometry)
+    player.set_debug(player.DEBUG_LEVEL0, True)
+    player.set_sparse(True)
+    if args.features is not None:
+        player.set_feature_set(FeatureSet(get_names(args.features), geometry, normalize=True))
+    if args.theta_in is not None:
+        player.load_theta(args.theta_in)
+    if args.alpha is not None:
+        player.alpha = args.alpha
+    if args.gamma is not None:
+        player.gamma = args.gamma
+    if args.epsilon is not None:
+        player.epsilon = args.epsilon
+    if args.replay is not None:
+        player.set_replay(ReplayBuffer(args.replay, args.seed, player.geometry.width),
+                          args.batch_size, args.replay_interval)
+
+    board = BitBoard(player.geometry)
+    board.set_reward(Board.REWARD_WEIGHTS if args.reward is None else get_reward_weights(args.reward))
+    board.set_piece_source(get_piece_source(args.pieces, args.seed))
+    board.INFO_ROUND = args.info_round
+    # the board constructor already counted one round
+    board.round = 0
+    if args.log is not None:
+        board.set_game_log(GameLogWriter(args.log, geometry=board.geometry))
+    if args.metrics is not None:
+        board.set_metrics(Metrics(args.metrics))
+    if args.curve is not None:
+        board.set_curve(CurveWriter(args.curve, [int(window) for window in args.curve_windows.split(',')]))
+    checkpoint = CheckpointWriter(args.checkpoint_rounds, args.checkpoint_seconds, args.keep)
+    try:
+        board.start_training(player, args.rounds, args.seconds, args.target_lines, checkpoint)
+    finally:
+        if board.game_log is not None:
+            board.game_log.close()
+        if board.metrics is not None:
+            board.metrics.close()
+        if board.curve is not None:
+            board.curve.close()
+
+    if args.theta_out is not None:
+        player.save_theta(args.theta_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+'''
+    Training curve format
+
+    <dir>/<column>_<chunk>.npy      one .npy array per column of every CHUNK games, chunk counted from 0
+
+    Columns are in COLUMNS, row i of every column is game i of the run. Only the last
+    chunk can be shorter than CHUNK, it is rewritten as games are added, so a run that
+    stopped anywhere is read back up to the last flush and can be continued.
+'''
+
+import collections
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+# name and dtype of every column
+COLUMNS = [('lines', np.uint32), ('pieces', np.uint32), ('reward', np.float32), ('epsilon', np.float32),
+           ('time', np.float64)]
+CHUNK = 1 << 16
+# seconds between two writes of the last chunk
+FLUSH_SECONDS = 60
+
+
+def get_chunk_name(directory, column, chunk):
+    return os.path.join(directory, '%s_%06d.npy' % (column, chunk))
+
+
+def get_chunk_count(directory):
+    pattern = re.compile(r'%s_(\d+)\.npy$' % COLUMNS[0][0])
+    chunks = [int(m.group(1)) for m in map(pattern.match, os.listdir(directory)) if m]
+    return max(chunks) + 1 if chunks else 0
+
+
+class Rolling(object):
+    '''
+        Mean, max and quantiles of the last window values.
+        add is O(1): the sum is kept as values enter and leave the window, the max
+        with a deque of the values no later one is larger than. quantile sorts the
+        window, so it is meant for the reports, not for every game.
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.values = np.zeros(window)
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+        # (index, value) of the candidates for the max, values decreasing
+        self.maxima = collections.deque()
+        self.index = 0
+
+    def add(self, value):
+        if self.count == self.window:
+            self.total -= self.values[self.pos]
+        else:
+            self.count += 1
+        self.values[self.pos] = value
+        self.total += value
+        self.pos += 1
+        if self.pos == self.window:
+            self.pos = 0
+            # drop the rounding error the running sum collected over one window
+            self.total = float(np.sum(self.values))
+
+        maxima = self.maxima
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append((self.index, value))
+        if maxima[0][0] <= self.index - self.window:
+            maxima.popleft()
+        self.index += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def max(self):
+        return self.maxima[0][1] if self.maxima else None
+
+    def quantile(self, q):
+        return float(np.quantile(self.values[:self.count], q)) if self.count else None
+
+    def get(self, quantiles=(0.1, 0.5, 0.9)):
+        summary = {'games': self.count, 'mean': self.mean(), 'max': self.max()}
+        for q in quantiles:
+            summary['p%d' % round(q * 100)] = self.quantile(q)
+        return summary
+
+
+class CurveWriter(object):
+    '''
+        Records one row of COLUMNS per game into directory, keeping at most one chunk in memory,
+        and the Rolling aggregates of the removed lines and the reward over every window.
+        A directory holding a run already is continued.
+    '''
+
+    def __init__(self, directory, windows=(100, 1000, 10000), chunk=CHUNK):
+        self.directory = directory
+        self.chunk_size = chunk
+        os.makedirs(directory, exist_ok=True)
+
+        self.buffers = {name: np.zeros(chunk, dtype) for name, dtype in COLUMNS}
+        self.chunk = get_chunk_count(directory)
+        self.pos = 0
+        self.games = 0
+        if self.chunk:
+            # continue the last chunk when it is not full
+            self.chunk -= 1
+            last = {name: np.load(get_chunk_name(directory, name, self.chunk)) for name, dtype in COLUMNS}
+            self.pos = min(len(values) for values in last.values())
+            if self.pos > chunk:
+                raise Exception("Training Curve Error: chunks of %d games in %s" % (self.pos, directory))
+            if self.pos == chunk:
+                self.chunk += 1
+                self.pos = 0
+            else:
+                for name, values in last.items():
+                    self.buffers[name][:self.pos] = values[:self.pos]
+            self.games = self.chunk * chunk + self.pos
+
+        self.lines = {window: Rolling(window) for window in windows}
+        self.rewards = {window: Rolling(window) for window in windows}
+        self.last_flush = time.time()
+
+    def add(self, lines, pieces, reward, epsilon, now=None):
+        i = self.pos
+        buffers = self.buffers
+        buffers['lines'][i] = lines
+        buffers['pieces'][i] = pieces
+        buffers['reward'][i] = reward
+        buffers['epsilon'][i] = epsilon
+        buffers['time'][i] = time.time() if now is None else now
+        for rolling in self.lines.values():
+            rolling.add(lines)
+        for rolling in self.rewards.values():
+            rolling.add(reward)
+
+        self.pos += 1
+        self.games += 1
+        if self.pos == self.chunk_size:
+            self.flush()
+            self.chunk += 1
+            self.pos = 0
+        elif buffers['time'][i] - self.last_flush >= FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        # write the games of the current chunk, replacing the shorter copy written before
+        for name, dtype in COLUMNS:
+            file_name = get_chunk_name(self.directory, name, self.chunk)
+            temp_name = file_name + '.tmp'
+            with open(temp_name, 'wb') as f:
+                np.save(f, self.buffers[name][:self.pos])
+            os.replace(temp_name, file_name)
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.pos:
+            self.flush()
+
+    def get_summary(self):
+        return {'games': self.games,
+                'lines': {window: rolling.get() for window, rolling in self.lines.items()},
+                'reward': {window: rolling.get() for window, rolling in self.rewards.items()}}
+
+    def get_info(self):
+        return " ".join("Lines(%d) Mean: %.3f P50: %.1f P90: %.1f Max: %d" % (
+            window, rolling.mean(), rolling.quantile(0.5), rolling.quantile(0.9), rolling.max())
+                        for window, rolling in sorted(self.lines.items()) if rolling.count)
+
+
+def load_curve(directory, columns=None):
+    '''
+        return {column: values of every game}, the chunks are memory mapped and copied once
+    '''
+    columns = columns or [name for name, dtype in COLUMNS]
+    count = get_chunk_count(directory)
+    curve = {}
+    for name in columns:
+        chunks = [np.load(get_chunk_name(directory, name, chunk), mmap_mode='r') for chunk in range(count)]
+        curve[name] = np.concatenate(chunks) if chunks else np.zeros(0, dict(COLUMNS)[name])
+    # a crash between two column writes can leave one column a flush ahead
+    games = min(len(values) for values in curve.values()) if curve else 0
+    return {name: values[:games] for name, values in curve.items()}
+
+
+def get_rolling_mean(values, window):
+    # mean of every window of values ending at each game, for plotting a whole run
+    total = np.cumsum(values, dtype=np.float64)
+    total[window:] = total[window:] - total[:-window]
+    return total / np.minimum(np.arange(1, len(values) + 1), window)
+
+
+if __name__ == '__main__':
+    start = time.time()
+    curve = load_curve(sys.argv[1])
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    lines = curve['lines']
+    print("Games: %d Loaded in %.3f s" % (len(lines), time.time() - start))
+    if len(lines):
+        print("Pieces: %d Hours: %.2f" % (np.sum(curve['pieces'], dtype=np.int64),
+                                          (curve['time'][-1] - curve['time'][0]) / 3600))
+        mean = get_rolling_mean(lines, window)
+        print("Lines Mean(%d) Last: %.3f Best: %.3f Max: %d" % (window, mean[-1], np.max(mean), np.max(lines)))
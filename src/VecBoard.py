@@ -0,0 +1,194 @@
+import numpy as np
+
+from Board import Board
+from Features import get_reward_set
+from Shape import Shape
+from LinearQLearning import QLearnPlayer
+
+
+class VecBoard(object):
+    '''
+        N independent wells of geometry played in lockstep, Board.GEOMETRY when None.
+        Every well is kept as its height row bit masks plus its column heights,
+        step applies one (rotation, x) per well, clears lines, and resets the
+        wells whose game is over.
+    '''
+    GAME_OVER_REWARD = -3
+
+    def __init__(self, n, seed=None, geometry=None):
+        self.n = n
+        self.geometry = geometry or Board.GEOMETRY
+        self.env = np.arange(n)
+        self.rng = np.random.RandomState(seed)
+
+        self.INFO_ROUND = 1000
+        self.round = 0
+
+        self.rows = None
+        self.heights = None
+        self.filled = None
+        self.bad_pos = None
+        self.var = None
+        self.pieces = None
+        # height of the middle of the last piece placed in every well
+        self.landing_height = None
+
+        # weights of the reward as in Board.set_reward
+        self.reward_weights = None
+        self.reward_set = None
+        self.reward_vector = None
+        # values of reward_set after the last move of every well
+        self.reward_last = None
+        # lines and pieces of the running game of every well
+        self.cur_removed_lines = None
+        self.cur_pieces = None
+        self.set_reward()
+        self.init()
+
+    def set_reward(self, weights=None):
+        # as Board.set_reward, applied from the next step
+        self.reward_weights = dict(Board.REWARD_WEIGHTS if weights is None else weights)
+        self.reward_set, self.reward_vector = get_reward_set(self.reward_weights, self.geometry)
+        if self.reward_set is not None:
+            self.reward_last = np.tile(self.reward_set.get_empty(), (self.n, 1))
+
+    def init(self):
+        self.rows = np.zeros((self.n, self.geometry.height), np.int)
+        self.heights = np.zeros((self.n, self.geometry.width), np.int)
+        self.filled = np.zeros(self.n, np.int)
+        self.bad_pos = np.zeros(self.n, np.int)
+        self.var = np.zeros(self.n, np.int)
+        self.cur_removed_lines = np.zeros(self.n, np.int)
+        self.cur_pieces = np.zeros(self.n, np.int)
+        self.landing_height = np.zeros(self.n)
+        if self.reward_set is not None:
+            self.reward_last[:] = self.reward_set.get_empty()
+        self.new_shapes()
+        return self.get_feature_index()
+
+    def new_shapes(self):
+        self.pieces = self.rng.randint(1, Shape.MAX_SHAPE, self.n)
+        return self.pieces
+
+    def get_feature_index(self):
+        return self.geometry.feature_offset + self.heights - np.min(self.heights, axis=1, keepdims=True)
+
+    def step(self, rotations, xs):
+        '''
+            Drop the current piece of every well with the given rotations and xs
+            return (features, rewards, done, lines), lines being the removed lines
+            of the games that just finished; those wells are already reset
+        '''
+        env = self.env
+        geometry = self.geometry
+        index = geometry.placement_index[self.pieces, rotations, xs]
+        cell_y = geometry.placement_y[index]
+        cell_x = geometry.placement_x[index]
+        cell_y += np.max(self.heights[env[:, None], cell_x] - cell_y, axis=1, keepdims=True)
+        self.landing_height = (np.min(cell_y, axis=1) + np.max(cell_y, axis=1)) / 2
+
+        # one point per well at a time so no row is written twice in one assignment
+        for i in range(Shape.MAX_POINT):
+            y = cell_y[:, i]
+            x = cell_x[:, i]
+            self.rows[env, y] |= 1 << x
+            self.heights[env, x] = np.maximum(self.heights[env, x], y + 1)
+        self.filled += Shape.MAX_POINT
+        self.cur_pieces += 1
+
+        full = self.rows == geometry.full_row
+        removed = np.sum(full, axis=1)
+        cleared = np.nonzero(removed)[0]
+        if len(cleared):
+            self.remove_full_lines(cleared, full[cleared], removed[cleared])
+        self.cur_removed_lines += removed
+
+        done = np.max(self.heights, axis=1) > geometry.game_over_height
+
+        rewards = self.get_reward(removed)
+        rewards[done] = VecBoard.GAME_OVER_REWARD
+
+        lines = self.cur_removed_lines.copy()
+        if np.any(done):
+            self.reset(done)
+        self.new_shapes()
+        return self.get_feature_index(), rewards, done, lines
+
+    def remove_full_lines(self, cleared, full, removed):
+        # stable sort moves the full rows on top keeping the order of the others
+        order = np.argsort(full, axis=1, kind='stable')
+        rows = np.take_along_axis(self.rows[cleared], order, axis=1)
+        rows[rows == self.geometry.full_row] = 0
+        self.rows[cleared] = rows
+        self.filled[cleared] -= removed * self.geometry.width
+
+        bits = (rows[:, ::-1, None] >> np.arange(self.geometry.width)) & 1
+        self.heights[cleared] = np.where(np.any(bits, axis=1), self.geometry.height - np.argmax(bits, axis=1), 0)
+
+    def get_reward(self, removed):
+        # the reward of Board.get_reward for every well
+        weights = self.reward_weights
+        last_bad_pos = self.bad_pos
+        last_var = self.var
+        self.bad_pos = np.sum(self.heights, axis=1) - self.filled
+        self.var = np.sum(np.abs(np.diff(self.heights, axis=1)), axis=1)
+        rewards = removed * weights.get('lines', 0)
+        if self.reward_set is None:
+            return rewards + (self.bad_pos - last_bad_pos) * weights.get('holes', 0) + \
+                (self.var - last_var) * weights.get('bumpiness', 0)
+
+        values = np.empty_like(self.reward_last)
+        for i in range(self.n):
+            self.reward_set.extract(self.rows[i].tolist(), self.heights[i].tolist(), self.landing_height[i], values[i])
+        rewards = rewards + (values - self.reward_last).dot(self.reward_vector)
+        self.reward_last = values
+        return rewards
+
+    def reset(self, done):
+        self.rows[done] = 0
+        self.heights[done] = 0
+        self.filled[done] = 0
+        self.bad_pos[done] = 0
+        self.var[done] = 0
+        self.cur_removed_lines[done] = 0
+        self.cur_pieces[done] = 0
+        self.landing_height[done] = 0
+        if self.reward_set is not None:
+            self.reward_last[done] = self.reward_set.get_empty()
+
+    def start_training(self):
+        player = QLearnPlayer()
+        player.set_features(self.geometry.features_num, self.geometry.theta_shape[:3])
+        player.set_debug(player.DEBUG_LEVEL0, True)
+        player.set_sparse(True)
+        player.load_theta()
+        if player.geometry is not self.geometry:
+            raise Exception("Geometry Error: theta of %s for %s" % (player.geometry, self.geometry))
+
+        features = self.init()
+        total_removed_lines = 0
+        max_removed = 0
+        while True:
+            rotations, xs = player.select_actions(features, self.pieces)
+            features, rewards, done, lines = self.step(rotations, xs)
+            player.update_batch(features, rewards, done, self.pieces)
+
+            for removed in lines[done]:
+                self.round += 1
+                total_removed_lines += removed
+                max_removed = max(max_removed, removed)
+
+                if self.round % self.INFO_ROUND == 0:
+                    average = total_removed_lines / self.INFO_ROUND
+                    print("Round: %-10d" % self.round, "Max:", max_removed, "Avg:", average)
+                    total_removed_lines = 0
+
+                    if self.round % (self.INFO_ROUND * 10) == 0:
+                        player.save_theta("theta_%d_%.3f" % (max_removed, average))
+
+                    max_removed = 0
+
+
+if __name__ == '__main__':
+    board = VecBoard(256)
+    board.start_training()